@@ -0,0 +1,95 @@
+"""Compare download throughput and CPU cost of plain FileResponse and serve_file
+
+The response body is pushed into one end of a socketpair while a thread
+drains the other end, which is roughly what a WSGI server does. The plain
+path copies every block through Python (read + sendall); the sendfile path
+does what gunicorn does with a file wrapper (socket.sendfile with the
+Content-Length as count).
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_download --size-mb 1024
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(DEFAULT_CHARSET='utf-8', USE_TZ=True)
+
+from django.http import FileResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from control_app.downloads import serve_file  # noqa: E402
+
+
+def drain(sock):
+    buffer = bytearray(1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+
+def send_iter(response, sock):
+    for chunk in response.streaming_content:
+        sock.sendall(chunk)
+
+
+def send_file(response, sock):
+    filelike = response.file_to_stream
+    offset = os.lseek(filelike.fileno(), 0, os.SEEK_CUR)
+    sock.sendfile(filelike, offset=offset, count=int(response['Content-Length']))
+
+
+def measure(label, make_response, send, size):
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,))
+    reader.start()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    response = make_response()
+    send(response, sender)
+    response.close()
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    sender.close()
+    reader.join()
+    receiver.close()
+    gigabytes = size / 1024 ** 3
+    print(f'{label:<34} {size / wall / 1024 ** 2:9.0f} MB/s {cpu / gigabytes:8.3f} CPU s/GB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    factory = RequestFactory()
+    with tempfile.NamedTemporaryFile(prefix='bench-download-') as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            f.write(block)
+        f.flush()
+        path = f.name
+        quarter = size // 4
+
+        full = factory.get('/api/download-file/')
+        ranged = factory.get('/api/download-file/', HTTP_RANGE=f'bytes={quarter}-{3 * quarter - 1}')
+
+        print(f'{args.size_mb} MB file, page cache warm after the first run')
+        for _ in range(args.repeat):
+            measure('FileResponse (read + sendall)', lambda: FileResponse(open(path, 'rb')), send_iter, size)
+            measure('serve_file (read + sendall)', lambda: serve_file(full, path), send_iter, size)
+            measure('serve_file (sendfile)', lambda: serve_file(full, path), send_file, size)
+            measure('serve_file 206 half (sendfile)', lambda: serve_file(ranged, path), send_file, 2 * quarter)
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compare the psutil and /proc process list backends on a synthetic /proc tree
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_procfs --processes 10000
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import psutil
+
+from control_app.processes import ProcessRegistry
+from control_app.procfs import ProcfsSampler, read_proc_table
+
+MEMINFO = """MemTotal:       16384000 kB
+MemFree:         8192000 kB
+MemAvailable:   12288000 kB
+Buffers:          256000 kB
+Cached:          2048000 kB
+SwapCached:            0 kB
+Active:          4096000 kB
+Inactive:        2048000 kB
+Shmem:            128000 kB
+SReclaimable:     128000 kB
+SwapTotal:       2048000 kB
+SwapFree:        2048000 kB
+"""
+
+
+def build_proc_tree(root, count):
+    """Write stat, statm, status and cmdline files for count fake processes"""
+    with open(os.path.join(root, 'stat'), 'w') as f:
+        f.write('cpu  100 0 100 10000 0 0 0 0 0 0\nbtime 1700000000\n')
+    with open(os.path.join(root, 'meminfo'), 'w') as f:
+        f.write(MEMINFO)
+    with open(os.path.join(root, 'uptime'), 'w') as f:
+        f.write('100000.00 90000.00\n')
+    for pid in range(1, count + 1):
+        directory = os.path.join(root, str(pid))
+        os.mkdir(directory)
+        name = f'worker {pid % 97}'
+        with open(os.path.join(directory, 'stat'), 'w') as f:
+            f.write(f'{pid} ({name}) S {max(1, pid // 8)} {pid} {pid} 0 -1 4194304 100 0 0 0 '
+                    f'{pid % 500} {pid % 300} 0 0 20 0 1 0 {1000 + pid} 10000000 {pid % 4000 + 100} '
+                    '18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0\n')
+        with open(os.path.join(directory, 'statm'), 'w') as f:
+            f.write(f'2441 {pid % 4000 + 100} 300 10 0 500 0\n')
+        with open(os.path.join(directory, 'status'), 'w') as f:
+            f.write(f'Name:\t{name}\nState:\tS (sleeping)\nPPid:\t{max(1, pid // 8)}\n'
+                    'Uid:\t0\t0\t0\t0\nGid:\t0\t0\t0\t0\nThreads:\t1\n')
+        with open(os.path.join(directory, 'cmdline'), 'w') as f:
+            f.write(f'/usr/bin/worker\0--id\0{pid}\0')
+
+
+def psutil_process_iter():
+    """The original get_running_processes() implementation"""
+    processes = []
+    for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
+        processes.append({
+            'pid': proc.info['pid'],
+            'name': proc.info['name'],
+            'cpu_percent': proc.info['cpu_percent'],
+            'memory_percent': proc.info['memory_percent']
+        })
+    return processes
+
+
+def measure(label, func, repeat):
+    func()  # warm caches and prime CPU counters
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = func()
+        timings.append(time.perf_counter() - started)
+    print(f'{label:<28} rows={len(rows):>6}  best={min(timings) * 1000:8.1f} ms  '
+          f'median={statistics.median(timings) * 1000:8.1f} ms')
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='fake-proc-')
+    original_procfs = psutil.PROCFS_PATH
+    try:
+        build_proc_tree(root, args.processes)
+        psutil.PROCFS_PATH = root
+
+        registry = ProcessRegistry(min_interval=0, warmup=0)
+        sampler = ProcfsSampler(root, min_interval=0, warmup=0)
+        baseline = measure('psutil.process_iter', psutil_process_iter, args.repeat)
+        measure('ProcessRegistry (psutil)', registry.refresh, args.repeat)
+        fast = measure('ProcfsSampler', sampler.refresh, args.repeat)
+        measure('read_proc_table (raw rows)', lambda: read_proc_table(root), args.repeat)
+        print(f'procfs speedup over process_iter: {baseline / fast:.1f}x')
+    finally:
+        psutil.PROCFS_PATH = original_procfs
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -176,3 +176,83 @@ LOGGING = {
         },
     },
 }
+
+# Telemetry settings
+# Seconds between background samples of CPU, memory, disk, network and sensors
+TELEMETRY_INTERVAL = 2.0
+# Seconds of metrics history kept in memory for /api/metrics/history/
+METRICS_HISTORY_SECONDS = 24 * 60 * 60
+
+# Live update stream (/api/events/, requires an ASGI server)
+# Seconds between collections of each subscribed topic
+STREAM_INTERVAL = TELEMETRY_INTERVAL
+# Seconds of silence before a keepalive comment is sent
+STREAM_KEEPALIVE = 15
+# Seconds directory change events are collected before one batch is pushed
+WATCH_DEBOUNCE = 0.1
+# /api/tail/?follow=true: seconds between checks when inotify is unavailable,
+# and seconds appended data is collected before it is pushed
+TAIL_POLL_INTERVAL = 1.0
+TAIL_BATCH_INTERVAL = 0.2
+
+# Process list backend: 'psutil', 'procfs' (read /proc directly, Linux only)
+# or 'auto' (procfs when /proc is available)
+PROCESS_BACKEND = 'psutil'
+
+# Parsed .desktop entries are persisted here so a restart does not re-parse
+# every application directory (set to None to keep the index in memory only)
+APPLICATION_INDEX_CACHE = str(Path.home() / '.cache' / 'shellsync' / 'applications.json')
+
+# Upper bound (approximate bytes) of cached directory listings; entries are
+# invalidated through inotify, or by directory mtime when no watch is available
+DIRECTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Filename search index (/api/search/files/). One worker crawls the roots and
+# writes the index file; all workers memory-map it.
+FILE_INDEX_ROOTS = ['~']
+FILE_INDEX_PATH = str(Path.home() / '.cache' / 'shellsync' / 'files.idx')
+# Directory names that are not descended into
+FILE_INDEX_EXCLUDE = ['.cache', '.git', 'node_modules', '__pycache__', '.venv', 'Trash']
+# Seconds between full mtime-checked passes; inotify triggers earlier ones
+FILE_INDEX_INTERVAL = 300
+# Shallowest directories watched through inotify for early rebuilds
+FILE_INDEX_MAX_WATCHES = 1024
+
+# Content search (/api/search/content/): size of the process pool (None means
+# one per CPU) and files larger than this many bytes are skipped
+CONTENT_SEARCH_WORKERS = None
+CONTENT_SEARCH_MAX_FILE_SIZE = 10 * 1024 * 1024
+
+# Disk usage analyzer (/api/disk-usage/): scanner threads, and seconds after
+# which a cached directory is listed again even if its mtime is unchanged
+DISK_USAGE_WORKERS = 8
+DISK_USAGE_CACHE_TTL = 600
+
+# Most bytes /api/read-file/ returns per call; page with offset/length or
+# from_line/lines for larger files
+READ_FILE_MAX_BYTES = 1024 * 1024
+
+# Resumable uploads (/api/uploads/): session metadata, suggested chunk size,
+# and how long an idle session is kept before its partial file is deleted
+UPLOAD_STATE_DIR = str(Path.home() / '.cache' / 'shellsync' / 'uploads')
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# Deduplicated transfers (/api/dedup/): chunk index, pending chunks and
+# sessions; unused chunks and idle sessions are dropped after the TTL
+DEDUP_STATE_DIR = str(Path.home() / '.cache' / 'shellsync' / 'dedup')
+DEDUP_SESSION_TTL = 24 * 3600
+
+# Directory sync (/api/sync/): persistent sha256 cache and hashing threads
+SYNC_INDEX_PATH = str(Path.home() / '.cache' / 'shellsync' / 'sync.sqlite3')
+SYNC_HASH_WORKERS = 4
+# /api/sync/apply/ sends a whole batch of files in one multipart request
+DATA_UPLOAD_MAX_NUMBER_FILES = 10000
+
+# Deflate level (0-9) of zip archives streamed by /api/download-item/
+ARCHIVE_ZIP_LEVEL = 6
+# Levels of tar.gz (0-9) and tar.zst (1-22) downloads
+ARCHIVE_GZIP_LEVEL = 6
+ARCHIVE_ZSTD_LEVEL = 3
+# zstd worker threads: -1 for one per CPU, 0 to compress in the request thread
+ARCHIVE_ZSTD_THREADS = -1
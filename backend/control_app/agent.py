@@ -11,24 +11,42 @@ import time
 import shutil
 import tempfile
 import zipfile
-from typing import Dict, Any, Union
+from typing import Dict, Any, Iterable, Union
 from PIL import ImageGrab
 import dbus
 import glob
+import base64
+import re
+import heapq
+import math
+from functools import lru_cache
+from django.conf import settings
+from .telemetry import TelemetrySampler
+from .timeseries import MetricHistory
+from .applications import ApplicationIndex, ApplicationSearchIndex, locale_variants, parse_desktop_entry, xdg_application_dirs
+from . import procfs
+from .procfs import ProcfsSampler
+from .processes import ProcessRegistry, ProcessSnapshotLog, build_process_tree, query_processes
+from . import inotify
+from .inotify import WatchManager
+from .fscache import DirectoryCache
+from .filesearch import FilenameIndex, FilenameIndexer
+from .contentsearch import ContentSearcher
+from .diskusage import DiskUsageAnalyzer
+from .filereader import LINE_SAFE_ENCODINGS, SNIFF_BYTES, LineIndexCache, detect_encoding
+from .tail import FileFollower, read_last_lines
+from .archives import gzip_compressor, stream_tar, stream_zip, zstandard, zstd_compressor
+from .uploads import UploadError, UploadManager
+from .dedup import DedupTransfer
+from .sync import DirectorySync
 
-def get_system_info():
-    """Get comprehensive system information"""
-    # Basic system info
-    system = platform.system()
-    release = platform.release()
-    machine = platform.machine()
-    processor = platform.processor()
-    hostname = socket.gethostname()
-
+def collect_telemetry():
+    """Collect the volatile part of the system information"""
     # CPU info
     cpu_freq = psutil.cpu_freq()
     cpu_info = {
-        'percent': psutil.cpu_percent(interval=1),
+        'percent': psutil.cpu_percent(interval=None),
+        'per_core': psutil.cpu_percent(interval=None, percpu=True),
         'cores': psutil.cpu_count(),
         'physical_cores': psutil.cpu_count(logical=False),
         'frequency': {
@@ -51,47 +69,134 @@ def get_system_info():
 
     # Disk info
     disk = psutil.disk_usage('/')
+    disk_io = psutil.disk_io_counters()
     disk_info = {
         'total': disk.total,
         'free': disk.free,
         'used': disk.used,
-        'percent': disk.percent
+        'percent': disk.percent,
+        'io': {
+            'read_bytes': disk_io.read_bytes,
+            'write_bytes': disk_io.write_bytes
+        } if disk_io else None
+    }
+
+    return {
+        'cpu': cpu_info,
+        'memory': memory_info,
+        'disk': disk_info,
+        'battery': get_battery_info(),
+        'network': get_network_info(),
+        'active_windows': get_active_windows()
     }
 
-    # Battery info
-    battery = get_battery_info()
+def prime_telemetry():
+    """Prime the interval-less CPU counters so the first sample is meaningful"""
+    psutil.cpu_percent(interval=None)
+    psutil.cpu_percent(interval=None, percpu=True)
+
+# Shared sampler; system_info requests read its latest snapshot instead of
+# blocking on psutil.cpu_percent(interval=1)
+sampler = TelemetrySampler(collect_telemetry, prime=prime_telemetry)
+
+HISTORY_METRICS = {
+    'cpu': ('percent',),
+    'cpu_per_core': tuple(f'core{i}' for i in range(psutil.cpu_count() or 1)),
+    'memory': ('percent', 'used'),
+    'swap': ('percent', 'used'),
+    'network': ('sent_per_sec', 'recv_per_sec'),
+    'disk_io': ('read_per_sec', 'write_per_sec')
+}
+
+def _history_capacity():
+    seconds = getattr(settings, 'METRICS_HISTORY_SECONDS', 24 * 60 * 60)
+    return max(1, int(math.ceil(seconds / sampler.interval)))
+
+metrics_history = MetricHistory(_history_capacity(), HISTORY_METRICS)
+_last_counters = {}
+
+def _counter_rates(key, timestamp, counters):
+    """Turn monotonic byte counters into per-second rates"""
+    previous = _last_counters.get(key)
+    _last_counters[key] = (timestamp, counters)
+    if previous is None or timestamp <= previous[0]:
+        return (0.0,) * len(counters)
+    elapsed = timestamp - previous[0]
+    # Counters can wrap or reset (e.g. a NIC going away), never report negative rates
+    return tuple(max(0.0, (now - before) / elapsed) for now, before in zip(counters, previous[1]))
+
+def record_metrics(snapshot, sampled_at):
+    """Append a telemetry snapshot to the metrics history"""
+    memory = snapshot['memory']
+    usage = snapshot['network'].get('usage', {})
+    disk_io = snapshot['disk'].get('io') or {}
+    metrics_history.append(sampled_at, {
+        'cpu': (snapshot['cpu']['percent'],),
+        'cpu_per_core': snapshot['cpu']['per_core'],
+        'memory': (memory['percent'], memory['used']),
+        'swap': (memory['swap']['percent'], memory['swap']['used']),
+        'network': _counter_rates('network', sampled_at, (usage.get('bytes_sent', 0), usage.get('bytes_recv', 0))),
+        'disk_io': _counter_rates('disk_io', sampled_at, (disk_io.get('read_bytes', 0), disk_io.get('write_bytes', 0)))
+    })
+
+sampler.subscribe(record_metrics)
+
+def get_metrics_history(metric='cpu', since=None, until=None, step=None, points=300):
+    """Get recorded history of a host metric, downsampled to step-second buckets"""
+    if metric not in HISTORY_METRICS:
+        return {'error': f"Unknown metric '{metric}'", 'metrics': list(HISTORY_METRICS)}
+    sampler.start()
+    now = time.time()
+    # Negative bounds are relative to now, e.g. since=-3600 is the last hour
+    if since is not None and since <= 0:
+        since = now + since
+    if until is not None and until <= 0:
+        until = now + until
+    if step is None and points:
+        start = since if since is not None else now - len(metrics_history) * sampler.interval
+        span = (until if until is not None else now) - start
+        step = max(sampler.interval, span / points)
+    result = metrics_history.query(metric, since, until, step)
+    result['resolution'] = sampler.interval
+    return result
+
+@lru_cache(maxsize=None)
+def get_platform_info():
+    """Get system information that does not change while running"""
+    return {
+        'os': platform.system(),
+        'release': platform.release(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'hostname': socket.gethostname()
+    }
 
-    # Network info
-    network_info = get_network_info()
+def get_system_info():
+    """Get comprehensive system information"""
+    snapshot, sample_age = sampler.latest()
+    if snapshot is None:
+        snapshot = sampler.sample()
+        sample_age = 0.0
 
     # Date and time
     now = datetime.now()
     time_info = {
         'date': now.strftime('%Y-%m-%d'),
         'time': now.strftime('%H:%M:%S'),
-        'timezone': datetime.now().astimezone().tzname(),
+        'timezone': now.astimezone().tzname(),
         'timestamp': int(now.timestamp())
     }
 
-    # Active windows
-    active_windows = get_active_windows()
-
     return {
-        'system': {
-            'os': system,
-            'release': release,
-            'machine': machine,
-            'processor': processor,
-            'hostname': hostname,
-            'uptime': get_uptime()
-        },
-        'cpu': cpu_info,
-        'memory': memory_info,
-        'disk': disk_info,
-        'battery': battery,
-        'network': network_info,
+        'system': dict(get_platform_info(), uptime=get_uptime()),
+        'cpu': snapshot['cpu'],
+        'memory': snapshot['memory'],
+        'disk': snapshot['disk'],
+        'battery': snapshot['battery'],
+        'network': snapshot['network'],
         'time': time_info,
-        'active_windows': active_windows
+        'active_windows': snapshot['active_windows'],
+        'sample_age': round(sample_age, 3)
     }
 
 def get_cpu_temperature():
@@ -169,88 +274,198 @@ def get_active_windows():
     except:
         return []
 
+# Shared by the process list and the kill endpoints
+process_registry = ProcessRegistry()
+# Optional Linux fast path for the plain process list (PROCESS_BACKEND = 'procfs')
+procfs_sampler = ProcfsSampler()
+
+def _use_procfs():
+    backend = getattr(settings, 'PROCESS_BACKEND', 'psutil')
+    return backend == 'procfs' or (backend == 'auto' and procfs.is_available())
+
 def get_running_processes():
     """Get list of running processes"""
-    processes = []
-    for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-        try:
-            processes.append({
-                'pid': proc.info['pid'],
-                'name': proc.info['name'],
-                'cpu_percent': proc.info['cpu_percent'],
-                'memory_percent': proc.info['memory_percent']
-            })
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
-    return processes
+    if _use_procfs():
+        return procfs_sampler.refresh()
+    return process_registry.refresh()
+
+def query_running_processes(**filters):
+    """Get running processes filtered, sorted and paged on the server"""
+    return query_processes(get_running_processes(), **filters)
+
+def get_process_tree(root=None, max_depth=None):
+    """Get the process tree with per-subtree resource totals"""
+    return build_process_tree(process_registry.refresh(details=True), root, max_depth)
+
+# Recent process table versions for delta updates
+process_snapshots = ProcessSnapshotLog(get_running_processes)
+
+def get_process_changes(since=None):
+    """Get process table changes since a snapshot version, or a full snapshot"""
+    return process_snapshots.changes(since)
+
+# Locale suffixes used to pick Name[xx]/Comment[xx] translations
+DESKTOP_LOCALES = locale_variants()
 
 def parse_desktop_file(file_path):
     """Parse a .desktop file and extract relevant information"""
     try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            data = {}
-            for line in lines:
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    data[key.strip()] = value.strip()
-            return {
-                'name': data.get('Name', ''),
-                'exec': data.get('Exec', ''),
-                'icon': data.get('Icon', ''),
-                'path': file_path,
-                'description': data.get('Comment', '')
-            }
+        return parse_desktop_entry(file_path, DESKTOP_LOCALES)
     except:
         return None
 
+def get_application_dirs():
+    """Directories that hold .desktop application entries, highest priority first"""
+    return xdg_application_dirs()
+
+# Desktop entries are parsed once and re-read only when a directory changes
+application_index = ApplicationIndex(
+    get_application_dirs,
+    parse_desktop_file,
+    cache_path=getattr(settings, 'APPLICATION_INDEX_CACHE', None)
+)
+
+application_search = ApplicationSearchIndex()
+
 def list_applications():
     """List available desktop applications"""
-    apps = []
-    app_dirs = [
-        '/usr/share/applications/',
-        os.path.expanduser('~/.local/share/applications/')
-    ]
-    
-    for app_dir in app_dirs:
-        if os.path.exists(app_dir):
-            for file in os.listdir(app_dir):
-                if file.endswith('.desktop'):
-                    app_path = os.path.join(app_dir, file)
-                    app_data = parse_desktop_file(app_path)
-                    if app_data and app_data['exec']:  # Only add if we have a valid exec command
-                        apps.append(app_data)
-    return apps
+    return application_index.entries()
 
-def list_directory(path='/'):
-    """List contents of a directory"""
-    try:
-        path = os.path.expanduser(path)
-        items = []
-        for item in os.listdir(path):
-            full_path = os.path.join(path, item)
+def search_applications(query, limit=10):
+    """Search installed applications by name, generic name, keywords and command"""
+    return application_search.search(application_index.entries(), query, limit)
+
+DIRECTORY_FIELDS = ('name', 'path', 'is_dir', 'size', 'modified')
+
+# Row layout: (name, path, is_dir, size, modified)
+DIRECTORY_SORT_KEYS = {
+    'name': lambda row: (not row[2], row[0].lower()),
+    'type': lambda row: (not row[2], os.path.splitext(row[0])[1].lower(), row[0].lower()),
+    'size': lambda row: (row[3] or 0, row[0].lower()),
+    'modified': lambda row: (row[4] or 0, row[0].lower())
+}
+
+def scan_directory(path):
+    """Read every entry of a directory as (name, path, is_dir, size, modified) rows"""
+    rows = []
+    with os.scandir(path) as entries:
+        for entry in entries:
             try:
-                stat = os.stat(full_path)
-                items.append({
-                    'name': item,
-                    'path': full_path,
-                    'is_dir': os.path.isdir(full_path),
-                    'size': stat.st_size,
-                    'modified': stat.st_mtime
-                })
-            except:
+                stat = entry.stat()
+                rows.append((entry.name, entry.path, entry.is_dir(), stat.st_size, stat.st_mtime))
+            except OSError:
+                # Dangling symlink or entry removed while listing
                 continue
-        return items
+    return rows
+
+# Listings stay cached until inotify reports a change in the directory
+watch_manager = WatchManager()
+directory_cache = DirectoryCache(
+    getattr(settings, 'DIRECTORY_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+    watch_manager
+)
+
+def list_directory_page(path='/', sort=None, order='asc', offset=0, limit=None, show_hidden=True, fields=None):
+    """List one page of a directory from the directory cache"""
+    try:
+        path = os.path.abspath(os.path.expanduser(path))
+        fields = [field for field in (fields or DIRECTORY_FIELDS) if field in DIRECTORY_FIELDS]
+        if sort is not None and sort not in DIRECTORY_SORT_KEYS:
+            return {'error': f"Invalid sort '{sort}'", 'sort_keys': list(DIRECTORY_SORT_KEYS)}
+
+        rows = directory_cache.get(path, lambda: scan_directory(path))
+        if not show_hidden:
+            rows = [row for row in rows if not row[0].startswith('.')]
+
+        total = len(rows)
+        if sort is not None:
+            key = DIRECTORY_SORT_KEYS[sort]
+            descending = order == 'desc'
+            if limit is not None:
+                # Only the requested page needs ordering
+                select = heapq.nlargest if descending else heapq.nsmallest
+                rows = select(offset + limit, rows, key=key)
+            else:
+                rows = sorted(rows, key=key, reverse=descending)
+
+        end = total if limit is None else min(offset + limit, total)
+        indexes = [DIRECTORY_FIELDS.index(field) for field in fields]
+        items = [{field: row[i] for field, i in zip(fields, indexes)} for row in rows[offset:end]]
+        return {
+            'items': items,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'next_offset': end if end < total else None
+        }
+    except PermissionError:
+        return {'error': 'Permission denied'}
+    except Exception as e:
+        return {'error': str(e)}
+
+def get_directory_cache_stats():
+    """Hit/miss counters and size of the directory listing cache"""
+    stats = directory_cache.stats()
+    stats['inotify'] = inotify.is_available()
+    stats['watches'] = watch_manager.watched_count()
+    return stats
+
+# One worker crawls and writes the index file, every worker maps it
+FILE_INDEX_PATH = getattr(settings, 'FILE_INDEX_PATH', os.path.expanduser('~/.cache/shellsync/files.idx'))
+filename_indexer = FilenameIndexer(
+    getattr(settings, 'FILE_INDEX_ROOTS', ['~']),
+    FILE_INDEX_PATH,
+    exclude=getattr(settings, 'FILE_INDEX_EXCLUDE', ()),
+    interval=getattr(settings, 'FILE_INDEX_INTERVAL', 300),
+    max_watches=getattr(settings, 'FILE_INDEX_MAX_WATCHES', 1024),
+    watch_manager=watch_manager
+)
+filename_index = FilenameIndex(FILE_INDEX_PATH)
+
+def search_files(query, root=None, limit=100):
+    """Search indexed file and directory names by substring or glob"""
+    try:
+        filename_indexer.start()
+        if root:
+            root = os.path.abspath(os.path.expanduser(root))
+        result = filename_index.search(query, limit, root)
+        result['query'] = query
+        if filename_indexer.last_build:
+            result['last_build'] = filename_indexer.last_build
+        return result
     except Exception as e:
         return {'error': str(e)}
 
+content_searcher = ContentSearcher(
+    workers=getattr(settings, 'CONTENT_SEARCH_WORKERS', None),
+    max_file_size=getattr(settings, 'CONTENT_SEARCH_MAX_FILE_SIZE', 10 * 1024 * 1024)
+)
+
+def search_file_contents(root, pattern, regex=False, case_sensitive=False, limit=1000, use_gitignore=True):
+    """Search file contents under root; returns an iterator of matches or an error dict"""
+    root = os.path.abspath(os.path.expanduser(root))
+    if not os.path.isdir(root):
+        return {'error': f'Not a directory: {root}'}
+    try:
+        return content_searcher.search(root, pattern, regex=regex, case_sensitive=case_sensitive,
+                                       limit=limit, use_gitignore=use_gitignore)
+    except re.error as e:
+        return {'error': f'Invalid pattern: {e}'}
+
+def list_directory(path='/'):
+    """List contents of a directory"""
+    result = list_directory_page(path)
+    if 'error' in result:
+        return result
+    return result['items']
+
 def launch_application(app_path, use_sudo=False, sudo_password=None):
     """Launch an application from its .desktop file"""
     try:
         if not app_path.endswith('.desktop'):
             return {'error': 'Not a valid desktop entry file'}
             
-        app_data = parse_desktop_file(app_path)
+        app_data = application_index.get(app_path) or parse_desktop_file(app_path)
         if not app_data or not app_data['exec']:
             return {'error': 'Invalid desktop entry or missing Exec field'}
             
@@ -315,33 +530,128 @@ export XDG_RUNTIME_DIR="/run/user/{os.getuid()}"
 def terminate_process(pid):
     """Terminate a process by PID"""
     try:
-        process = psutil.Process(pid)
+        process = process_registry.get(pid)
         process.terminate()
         return {'status': 'success'}
     except Exception as e:
         return {'error': str(e)}
 
-def read_file_content(file_path):
-    """Read the content of a file"""
+# Cap on the bytes returned by one read_file_content() call
+READ_FILE_MAX_BYTES = getattr(settings, 'READ_FILE_MAX_BYTES', 1024 * 1024)
+line_indexes = LineIndexCache()
+
+def read_file_content(file_path, offset=None, length=None, from_line=None, lines=None):
+    """Read part of a file: a byte range (offset/length) or a page of lines (from_line/lines)
+
+    Without a range the file is read from the start, up to READ_FILE_MAX_BYTES.
+    Binary files are returned base64 encoded in 'content_base64'.
+    """
     try:
         file_path = os.path.expanduser(file_path)
         if not os.path.exists(file_path):
             return {'error': 'File does not exist'}
         if not os.path.isfile(file_path):
             return {'error': 'Path is not a file'}
-            
-        with open(file_path, 'r') as f:
-            content = f.read()
-            return {
-                'content': content,
-                'size': os.path.getsize(file_path),
-                'modified': os.path.getmtime(file_path)
+
+        with open(file_path, 'rb') as f:
+            fd = f.fileno()
+            stat = os.fstat(fd)
+            size = stat.st_size
+            encoding, bom_length = detect_encoding(os.pread(fd, SNIFF_BYTES, 0))
+            result = {
+                'size': size,
+                'modified': stat.st_mtime,
+                'encoding': encoding or 'binary',
+                'binary': encoding is None
             }
+
+            if from_line is not None or lines is not None:
+                if encoding not in LINE_SAFE_ENCODINGS:
+                    return {'error': f"Line paging is not supported for {result['encoding']} files"}
+                from_line = max(1, from_line or 1)
+                lines = max(0, lines if lines is not None else 1000)
+                index = line_indexes.get(file_path, stat)
+                start = max(index.line_offset(fd, from_line), bom_length)
+                end = index.line_offset(fd, from_line + lines)
+                if end - start > READ_FILE_MAX_BYTES:
+                    # Return whole lines only, as many as fit
+                    chunk = os.pread(fd, READ_FILE_MAX_BYTES, start)
+                    cut = chunk.rfind(b'\n') + 1
+                    chunk = chunk[:cut] if cut else chunk
+                else:
+                    chunk = os.pread(fd, end - start, start)
+                current = os.fstat(fd)
+                if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                    # Written to while it was read: the next request indexes it afresh
+                    line_indexes.discard(file_path)
+                returned = chunk.count(b'\n')
+                if chunk and not chunk.endswith(b'\n'):
+                    returned += 1
+                total_lines = index.total_lines
+                next_line = from_line + returned
+                result.update({
+                    'content': chunk.decode(encoding, errors='replace'),
+                    'from_line': from_line,
+                    'lines': returned,
+                    'total_lines': total_lines,
+                    'next_line': next_line if next_line <= total_lines else None,
+                    'offset': start,
+                    'length': len(chunk)
+                })
+                return result
+
+            offset = max(0, offset or 0)
+            length = READ_FILE_MAX_BYTES if length is None else max(0, min(length, READ_FILE_MAX_BYTES))
+            if encoding is not None and offset < bom_length:
+                offset = bom_length
+            chunk = os.pread(fd, length, offset)
+            end = offset + len(chunk)
+            result.update({
+                'offset': offset,
+                'length': len(chunk),
+                'next_offset': end if end < size else None,
+                'truncated': end < size
+            })
+            if encoding is None:
+                result['content_base64'] = base64.b64encode(chunk).decode('ascii')
+            else:
+                result['content'] = chunk.decode(encoding, errors='replace')
+            return result
     except PermissionError:
         return {'error': 'Permission denied. Try with sudo.'}
     except Exception as e:
         return {'error': str(e)}
 
+def tail_file(file_path, lines=200):
+    """Read the last lines of a file without reading the rest of it"""
+    try:
+        file_path = os.path.expanduser(file_path)
+        if not os.path.isfile(file_path):
+            return {'error': 'Path is not a file'}
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            data, offset = read_last_lines(f.fileno(), size, lines, READ_FILE_MAX_BYTES)
+        return {
+            'content': data.decode('utf-8', errors='replace'),
+            'offset': offset,
+            'size': size,
+            'lines': data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+        }
+    except PermissionError:
+        return {'error': 'Permission denied. Try with sudo.'}
+    except Exception as e:
+        return {'error': str(e)}
+
+def follow_file(file_path, offset):
+    """Follower yielding data appended to a file after offset"""
+    return FileFollower(
+        os.path.expanduser(file_path),
+        offset,
+        watch_manager,
+        poll_interval=getattr(settings, 'TAIL_POLL_INTERVAL', 1.0),
+        batch_interval=getattr(settings, 'TAIL_BATCH_INTERVAL', 0.2)
+    )
+
 def write_file_content(file_path, content, use_sudo=False):
     """Write content to a file"""
     try:
@@ -420,6 +730,8 @@ def get_file_info(file_path):
             'name': os.path.basename(file_path),
             'path': file_path,
             'size': stat.st_size,
+            # Bytes allocated on disk; for a directory see get_disk_usage()
+            'disk_usage': stat.st_blocks * 512,
             'modified': stat.st_mtime,
             'created': stat.st_ctime,
             'accessed': stat.st_atime,
@@ -436,51 +748,67 @@ def get_file_info(file_path):
     except Exception as e:
         return {'error': str(e)}
 
-def create_zip_archive(path: str) -> Dict[str, Any]:
-    """Create a zip archive of a directory"""
+disk_usage_analyzer = DiskUsageAnalyzer(
+    workers=getattr(settings, 'DISK_USAGE_WORKERS', 8),
+    ttl=getattr(settings, 'DISK_USAGE_CACHE_TTL', 600)
+)
+
+def stream_disk_usage(path='/', depth=2, fresh=False):
+    """Yield progress events and a final result for a recursive size scan"""
+    return disk_usage_analyzer.scan(os.path.expanduser(path), depth, fresh)
+
+def get_disk_usage(path='/', depth=2, fresh=False):
+    """Recursive disk usage of a directory as a tree cut at depth"""
     try:
-        import os
-        import tempfile
-        import shutil
-        from pathlib import Path
-        
-        # Ensure path exists and is a directory
+        path = os.path.expanduser(path)
+        if not os.path.isdir(path):
+            return {'error': 'Path is not a directory'}
+        return disk_usage_analyzer.analyze(path, depth, fresh)
+    except PermissionError:
+        return {'error': 'Permission denied'}
+    except Exception as e:
+        return {'error': str(e)}
+
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar.gz': 'application/gzip',
+    'tar.zst': 'application/zstd',
+}
+
+def archive_directory(path: str, format: str = 'zip') -> Dict[str, Any]:
+    """Stream a directory as a zip, tar.gz or tar.zst archive, without a temporary file"""
+    try:
+        if format not in ARCHIVE_FORMATS:
+            return {'error': f"Invalid format '{format}'", 'formats': list(ARCHIVE_FORMATS)}
+        if format == 'tar.zst' and zstandard is None:
+            return {'error': 'tar.zst needs the zstandard package', 'formats': ['zip', 'tar.gz']}
+        path = os.path.expanduser(path)
         if not os.path.exists(path):
             return {'error': 'Path does not exist'}
         if not os.path.isdir(path):
             return {'error': 'Path is not a directory'}
-            
-        # Create a temporary directory that will definitely exist
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            # Create zip file name based on directory name
-            dir_name = os.path.basename(path.rstrip('/'))
-            zip_name = f"{dir_name}.zip"
-            zip_path = os.path.join(temp_dir, zip_name)
-            
-            # Create the zip archive
-            shutil.make_archive(
-                os.path.join(temp_dir, dir_name),  # Base name (without .zip)
-                'zip',  # Format
-                path  # Root directory to zip
-            )
-            
-            return {
-                'zip_path': zip_path,
-                'filename': zip_name
-            }
-            
-        except Exception as e:
-            # Clean up temp dir in case of error
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            return {'error': str(e)}
-            
+        dir_name = os.path.basename(path.rstrip('/')) or 'root'
+        if format == 'zip':
+            stream = stream_zip(path, getattr(settings, 'ARCHIVE_ZIP_LEVEL', 6))
+        elif format == 'tar.gz':
+            stream = stream_tar(path, gzip_compressor(getattr(settings, 'ARCHIVE_GZIP_LEVEL', 6)))
+        else:
+            stream = stream_tar(path, zstd_compressor(getattr(settings, 'ARCHIVE_ZSTD_LEVEL', 3),
+                                                      getattr(settings, 'ARCHIVE_ZSTD_THREADS', -1)))
+        return {
+            'stream': stream,
+            'filename': f'{dir_name}.{format}',
+            'content_type': ARCHIVE_FORMATS[format]
+        }
     except Exception as e:
         return {'error': str(e)}
 
-def handle_file_upload(file_data: bytes, target_path: str, filename: str, use_sudo: bool = False) -> Dict[str, Any]:
-    """Handle file upload to a specific directory"""
+def handle_file_upload(file_data: Union[bytes, Iterable[bytes]], target_path: str, filename: str, use_sudo: bool = False) -> Dict[str, Any]:
+    """Handle file upload to a specific directory
+
+    file_data is either the whole content or an iterable of chunks (such as
+    UploadedFile.chunks()), which is written out without being joined.
+    """
     try:
         target_path = os.path.expanduser(target_path)
         if not os.path.exists(target_path):
@@ -490,11 +818,13 @@ def handle_file_upload(file_data: bytes, target_path: str, filename: str, use_su
             return {'error': 'Target path is not a directory'}
             
         file_path = os.path.join(target_path, filename)
+        chunks = [file_data] if isinstance(file_data, (bytes, bytearray)) else file_data
         
         if use_sudo:
             # Write to temporary file first
             with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file.write(file_data)
+                for chunk in chunks:
+                    temp_file.write(chunk)
                 temp_path = temp_file.name
             
             # Use sudo to move the file to target location
@@ -502,7 +832,8 @@ def handle_file_upload(file_data: bytes, target_path: str, filename: str, use_su
             subprocess.run(['sudo', 'chmod', '644', file_path], check=True)
         else:
             with open(file_path, 'wb') as f:
-                f.write(file_data)
+                for chunk in chunks:
+                    f.write(chunk)
         
         return {'status': 'success', 'path': file_path}
     except PermissionError:
@@ -510,6 +841,84 @@ def handle_file_upload(file_data: bytes, target_path: str, filename: str, use_su
     except Exception as e:
         return {'error': str(e)}
 
+upload_manager = UploadManager(
+    getattr(settings, 'UPLOAD_STATE_DIR', os.path.expanduser('~/.cache/shellsync/uploads')),
+    ttl=getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 3600),
+    chunk_size=getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+)
+
+def _upload_call(method, *args, **kwargs) -> Dict[str, Any]:
+    try:
+        return method(*args, **kwargs)
+    except UploadError as e:
+        return {'error': str(e), 'http_status': e.status, **e.details}
+    except PermissionError:
+        return {'error': 'Permission denied. Try with sudo.', 'http_status': 403}
+    except Exception as e:
+        return {'error': str(e)}
+
+def create_upload(target_path: str, filename: str, size: int, sha256: str = None, use_sudo: bool = False) -> Dict[str, Any]:
+    """Start a resumable upload; the file is preallocated at its full size"""
+    return _upload_call(upload_manager.create, target_path, filename, size, sha256, use_sudo)
+
+def get_upload_status(upload_id: str) -> Dict[str, Any]:
+    """Bytes received so far and the ranges still missing"""
+    return _upload_call(upload_manager.status, upload_id)
+
+def write_upload_chunk(upload_id: str, offset: int, stream, length: int) -> Dict[str, Any]:
+    """Write one chunk, read from stream in blocks, at offset"""
+    return _upload_call(upload_manager.write, upload_id, offset, stream, length)
+
+def finalize_upload(upload_id: str, sha256: str = None) -> Dict[str, Any]:
+    """Check the upload is complete (and its sha256) and move it into place"""
+    return _upload_call(upload_manager.finalize, upload_id, sha256)
+
+def abort_upload(upload_id: str) -> Dict[str, Any]:
+    return _upload_call(upload_manager.abort, upload_id)
+
+dedup_transfer = DedupTransfer(
+    getattr(settings, 'DEDUP_STATE_DIR', os.path.expanduser('~/.cache/shellsync/dedup')),
+    ttl=getattr(settings, 'DEDUP_SESSION_TTL', 24 * 3600)
+)
+
+def get_chunk_manifest(path: str) -> Dict[str, Any]:
+    """Content-defined chunks (digest, offset, length) of a file, for deduplicated downloads"""
+    return _upload_call(dedup_transfer.manifest, path)
+
+def create_dedup_upload(target_path: str, filename: str, size: int, sha256: str, chunks) -> Dict[str, Any]:
+    """Start a deduplicated upload from a chunk manifest; returns the digests the server lacks"""
+    return _upload_call(dedup_transfer.create, target_path, filename, size, sha256, chunks)
+
+def get_dedup_upload_status(upload_id: str) -> Dict[str, Any]:
+    return _upload_call(dedup_transfer.status, upload_id)
+
+def put_dedup_chunk(upload_id: str, digest: str, stream, length: int) -> Dict[str, Any]:
+    return _upload_call(dedup_transfer.put_chunk, upload_id, digest, stream, length)
+
+def commit_dedup_upload(upload_id: str) -> Dict[str, Any]:
+    """Assemble the file from sent and already present chunks and move it into place"""
+    return _upload_call(dedup_transfer.commit, upload_id)
+
+def abort_dedup_upload(upload_id: str) -> Dict[str, Any]:
+    return _upload_call(dedup_transfer.abort, upload_id)
+
+directory_sync = DirectorySync(
+    getattr(settings, 'SYNC_INDEX_PATH', os.path.expanduser('~/.cache/shellsync/sync.sqlite3')),
+    workers=getattr(settings, 'SYNC_HASH_WORKERS', 4)
+)
+
+def get_sync_manifest(path: str) -> Dict[str, Any]:
+    """Every file under path with size, mtime and sha256 (cached across calls)"""
+    return _upload_call(directory_sync.manifest, path)
+
+def diff_sync(path: str, entries, delete: bool = True) -> Dict[str, Any]:
+    """Plan of mkdir/upload/copy/rename/delete operations that mirrors the client's manifest"""
+    return _upload_call(directory_sync.diff, path, entries, delete)
+
+def apply_sync(path: str, plan: Dict[str, Any], files: Dict[str, Iterable[bytes]]) -> Dict[str, Any]:
+    """Apply a sync plan as one batch, rolled back as a whole if any step fails"""
+    return _upload_call(directory_sync.apply, path, plan, files)
+
 def extract_zip(zip_path: str, target_dir: str, use_sudo: bool = False) -> Dict[str, Any]:
     """Extract a zip file to a target directory"""
     try:
@@ -701,7 +1110,7 @@ def kill_process(pid: int, use_sudo: bool = False) -> Dict[str, str]:
         if use_sudo:
             subprocess.run(['sudo', 'kill', str(pid)], check=True)
         else:
-            process = psutil.Process(pid)
+            process = process_registry.get(pid)
             process.terminate()
         return {
             "status": "success",
@@ -0,0 +1,478 @@
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+
+LOCALIZED_KEYS = {'Name', 'GenericName', 'Comment', 'Keywords'}
+ESCAPES = {'s': ' ', 'n': '\n', 't': '\t', 'r': '\r', '\\': '\\'}
+
+
+def locale_variants(locale: Optional[str] = None) -> List[str]:
+    """Locale suffixes to look for, most specific first (Desktop Entry spec order)"""
+    if locale is None:
+        for variable in ('LC_ALL', 'LC_MESSAGES', 'LANG'):
+            locale = os.environ.get(variable)
+            if locale:
+                break
+    if not locale or locale in ('C', 'POSIX'):
+        return []
+    # lang_COUNTRY.ENCODING@MODIFIER; the encoding is ignored for matching
+    locale, _, modifier = locale.partition('@')
+    lang, _, country = locale.split('.')[0].partition('_')
+    variants = []
+    if country and modifier:
+        variants.append(f'{lang}_{country}@{modifier}')
+    if country:
+        variants.append(f'{lang}_{country}')
+    if modifier:
+        variants.append(f'{lang}@{modifier}')
+    variants.append(lang)
+    return variants
+
+
+def _unescape(value: str) -> str:
+    if '\\' not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            escaped = next(chars, '')
+            out.append(ESCAPES.get(escaped, '\\' + escaped))
+        else:
+            out.append(char)
+    return ''.join(out)
+
+
+def _split_list(value: str) -> List[str]:
+    # ';' separates items, '\;' is a literal semicolon
+    items = value.replace('\\;', '\0').split(';')
+    return [_unescape(item.replace('\0', ';')).strip() for item in items if item.strip()]
+
+
+def _is_executable(command: str) -> bool:
+    if os.path.isabs(command):
+        return os.access(command, os.X_OK)
+    return shutil.which(command) is not None
+
+
+def parse_desktop_entry(path: str, locales: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+    """Parse the [Desktop Entry] group of a .desktop file in a single pass
+
+    Reading stops at the next group header, so [Desktop Action ...] groups
+    never override Name/Exec. Returns None if the file has no entry group.
+    """
+    rank = {locale: i for i, locale in enumerate(locales)}
+    values = {}
+    localized = {}
+    found = False
+    in_entry = False
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            if line[0] == '[':
+                if in_entry:
+                    break
+                in_entry = line == '[Desktop Entry]'
+                found = found or in_entry
+                continue
+            if not in_entry:
+                continue
+            key, sep, value = line.partition('=')
+            if not sep:
+                continue
+            key = key.rstrip()
+            value = value.lstrip()
+            if key.endswith(']'):
+                base, _, locale = key[:-1].partition('[')
+                if base in LOCALIZED_KEYS and locale in rank:
+                    if base not in localized or rank[locale] < localized[base][0]:
+                        localized[base] = (rank[locale], value)
+                continue
+            values[key] = value
+    if not found:
+        return None
+
+    for key, (_, value) in localized.items():
+        values[key] = value
+
+    def flag(key):
+        return values.get(key, '').lower() == 'true'
+
+    try_exec = _unescape(values.get('TryExec', ''))
+    return {
+        'name': _unescape(values.get('Name', '')),
+        'generic_name': _unescape(values.get('GenericName', '')),
+        'exec': _unescape(values.get('Exec', '')),
+        'icon': _unescape(values.get('Icon', '')),
+        'path': path,
+        'description': _unescape(values.get('Comment', '')),
+        'keywords': _split_list(values.get('Keywords', '')),
+        'categories': _split_list(values.get('Categories', '')),
+        'type': values.get('Type', ''),
+        'terminal': flag('Terminal'),
+        'no_display': flag('NoDisplay'),
+        'hidden': flag('Hidden'),
+        'try_exec': try_exec,
+        'available': not try_exec or _is_executable(try_exec)
+    }
+
+
+def xdg_application_dirs() -> List[str]:
+    """applications/ directories from XDG_DATA_HOME and XDG_DATA_DIRS, highest priority first"""
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    data_dirs = os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share'
+    roots = [data_home] + data_dirs.split(':') + [
+        # Services often run without the session's XDG_DATA_DIRS, which is
+        # where flatpak and snap register their export directories
+        os.path.expanduser('~/.local/share/flatpak/exports/share'),
+        '/var/lib/flatpak/exports/share',
+        '/var/lib/snapd/desktop',
+    ]
+    return [os.path.join(root, 'applications') for root in dict.fromkeys(roots) if root]
+
+
+def is_listed(entry: Optional[Dict[str, Any]]) -> bool:
+    """Whether an entry belongs in the launcher"""
+    return bool(
+        entry
+        and entry.get('exec')
+        and entry.get('type', 'Application') in ('Application', '')
+        and not entry.get('no_display')
+        and not entry.get('hidden')
+        and entry.get('available', True)
+    )
+
+
+class ApplicationIndex:
+    """Parsed desktop entries, re-read only when an application directory changes
+
+    Every lookup stats the application directories and their subdirectories
+    (a handful of syscalls). A directory tree is rescanned only when one of
+    its mtimes changed, and within it only .desktop files whose mtime or size
+    changed are parsed again. Changed trees are scanned in parallel. The
+    index can be persisted as JSON so a restart does not re-parse everything.
+    """
+
+    def __init__(self, directories: Callable[[], Iterable[str]],
+                 parse: Callable[[str], Optional[Dict[str, Any]]],
+                 cache_path: Optional[str] = None,
+                 include: Callable[[Optional[Dict[str, Any]]], bool] = is_listed,
+                 workers: int = 8):
+        self.directories = directories
+        self.parse = parse
+        self.cache_path = cache_path
+        self.include = include
+        self.workers = workers
+        # root -> {directory: mtime_ns} for the root and all its subdirectories
+        self._dir_mtimes = {}
+        # root -> {path: (mtime_ns, size, entry or None)}
+        self._files = {}
+        self._by_path = {}
+        self._entries = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load_cache(self):
+        self._loaded = True
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+            if data.get('version') != CACHE_VERSION:
+                return
+            self._dir_mtimes = data['directories']
+            self._files = {
+                root: {path: tuple(record) for path, record in files.items()}
+                for root, files in data['files'].items()
+            }
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable application index cache: {e}")
+            self._dir_mtimes, self._files = {}, {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({
+                    'version': CACHE_VERSION,
+                    'directories': self._dir_mtimes,
+                    'files': self._files
+                }, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write application index cache: {e}")
+
+    def _is_stale(self, root: str) -> bool:
+        known = self._dir_mtimes.get(root)
+        if not known:
+            return True
+        for directory, mtime in known.items():
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return True
+        return False
+
+    def _scan_root(self, root: str):
+        """Walk one applications/ tree, re-parsing only changed files"""
+        previous = self._files.get(root, {})
+        mtimes = {}
+        files = {}
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            pending.append(entry.path)
+                            continue
+                        if not entry.name.endswith('.desktop'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        cached = previous.get(entry.path)
+                        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                            files[entry.path] = cached
+                            continue
+                        parsed = self.parse(entry.path)
+                        if parsed is not None:
+                            # Desktop file ID: path below applications/ with '/' -> '-'
+                            parsed['id'] = os.path.relpath(entry.path, root).replace(os.sep, '-')
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size, parsed)
+            except OSError:
+                # Missing directories are remembered too, so their creation is noticed
+                mtimes.setdefault(directory, None)
+        return root, mtimes, files
+
+    def refresh(self) -> bool:
+        """Rescan changed directory trees; returns True if anything was rescanned"""
+        with self._lock:
+            if not self._loaded:
+                self._load_cache()
+            roots = list(dict.fromkeys(self.directories()))
+            stale = [root for root in roots if self._is_stale(root)]
+            removed = [root for root in self._dir_mtimes if root not in roots]
+            changed = bool(stale or removed)
+            if len(stale) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(stale))) as pool:
+                    results = list(pool.map(self._scan_root, stale))
+            else:
+                results = [self._scan_root(root) for root in stale]
+            for root, mtimes, files in results:
+                self._dir_mtimes[root] = mtimes
+                self._files[root] = files
+            for root in removed:
+                self._dir_mtimes.pop(root, None)
+                self._files.pop(root, None)
+
+            if changed or self._entries is None:
+                self._rebuild(roots)
+            if changed:
+                self._save_cache()
+            return changed
+
+    def _rebuild(self, roots: List[str]):
+        # Earlier roots take precedence; an entry with Hidden=true in a
+        # higher-priority root hides the same desktop ID further down
+        seen = set()
+        entries = []
+        by_path = {}
+        for root in roots:
+            for path, record in sorted(self._files.get(root, {}).items()):
+                entry = record[2]
+                by_path[path] = entry
+                if entry is None or entry['id'] in seen:
+                    continue
+                seen.add(entry['id'])
+                if self.include(entry):
+                    entries.append(entry)
+        self._entries = entries
+        self._by_path = by_path
+
+    def invalidate(self, root: Optional[str] = None):
+        """Force a rescan of one directory tree (or all) on the next lookup"""
+        with self._lock:
+            if root is None:
+                self._dir_mtimes.clear()
+            else:
+                self._dir_mtimes.pop(root, None)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Return every launchable application"""
+        self.refresh()
+        return self._entries
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """Return the parsed entry of one desktop file"""
+        self.refresh()
+        return self._by_path.get(path)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'docs')
+
+    def __init__(self):
+        self.children = {}
+        # doc id -> best field weight of any token below this node
+        self.docs = {}
+
+
+def _tokens(text: str) -> List[str]:
+    return [token for token in re.split(r'[^\w]+', text.lower()) if token]
+
+
+def _trigrams(token: str) -> set:
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ApplicationSearchIndex:
+    """Prefix trie plus trigram index over application names, keywords and commands
+
+    Each query term must prefix-match a token of some indexed field; the
+    field weight decides the score (Name > GenericName > Keywords > Exec).
+    When that yields fewer than the requested results, trigram similarity
+    fills in typo-tolerant matches. The index is rebuilt only when the
+    ApplicationIndex hands out a new entries list.
+    """
+
+    FIELD_WEIGHTS = (
+        ('name', 10.0),
+        ('generic_name', 5.0),
+        ('keywords', 4.0),
+        ('exec', 3.0),
+    )
+    FUZZY_THRESHOLD = 0.5
+
+    def __init__(self):
+        self._source = None
+        self._entries = []
+        self._root = _TrieNode()
+        self._tokens = {}
+        self._trigrams = {}
+        self._names = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _field_text(entry: Dict[str, Any], field: str) -> str:
+        value = entry.get(field) or ''
+        if field == 'keywords':
+            return ' '.join(value)
+        if field == 'exec':
+            # Only the program name is useful, not paths or %U placeholders
+            command = value.split()[0] if value.split() else ''
+            return os.path.basename(command.strip('"\''))
+        return value
+
+    def _build(self, entries: List[Dict[str, Any]]):
+        root = _TrieNode()
+        tokens = {}
+        trigrams = {}
+        for doc, entry in enumerate(entries):
+            grams = set()
+            for field, weight in self.FIELD_WEIGHTS:
+                text = self._field_text(entry, field)
+                for token in _tokens(text):
+                    if field != 'exec':
+                        grams |= _trigrams(token)
+                    exact = tokens.setdefault(token, {})
+                    exact[doc] = max(exact.get(doc, 0.0), weight)
+                    node = root
+                    for char in token:
+                        node = node.children.setdefault(char, _TrieNode())
+                        if node.docs.get(doc, 0.0) < weight:
+                            node.docs[doc] = weight
+            for gram in grams:
+                trigrams.setdefault(gram, []).append(doc)
+        self._root, self._tokens = root, tokens
+        self._trigrams = trigrams
+        self._entries = entries
+        self._names = sorted((entry['name'].lower(), doc) for doc, entry in enumerate(entries))
+
+    def _prefix(self, term: str) -> Dict[int, float]:
+        node = self._root
+        for char in term:
+            node = node.children.get(char)
+            if node is None:
+                return {}
+        return node.docs
+
+    def search(self, entries: List[Dict[str, Any]], query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return up to limit entries ranked by relevance to query"""
+        with self._lock:
+            if entries is not self._source:
+                self._build(entries)
+                self._source = entries
+        terms = _tokens(query)
+        if not terms:
+            return [self._entries[doc] for _, doc in self._names[:limit]]
+
+        # Every term has to prefix-match; exact token matches rank higher
+        scores = None
+        for term in terms:
+            term_scores = dict(self._prefix(term))
+            for doc, weight in self._tokens.get(term, {}).items():
+                if doc in term_scores:
+                    term_scores[doc] += weight * 0.5
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc: score + term_scores[doc] for doc, score in scores.items() if doc in term_scores}
+            if not scores:
+                break
+        scores = scores or {}
+
+        lowered = query.strip().lower()
+        if len(scores) < limit:
+            # Not enough prefix matches: fall back to trigram similarity,
+            # measured as the share of the query's trigrams a document has
+            query_grams = set()
+            for term in terms:
+                query_grams |= _trigrams(term)
+            overlap = {}
+            for gram in query_grams:
+                for doc in self._trigrams.get(gram, ()):
+                    overlap[doc] = overlap.get(doc, 0) + 1
+            for doc, shared in overlap.items():
+                similarity = shared / len(query_grams)
+                if doc not in scores and similarity >= self.FUZZY_THRESHOLD:
+                    scores[doc] = similarity * 5.0
+
+        # Names starting with the whole query get a bonus; the sorted name
+        # list finds them with a bisect instead of testing every hit
+        start = bisect_left(self._names, (lowered,))
+        for name, doc in islice(self._names, start, start + limit * 5):
+            if not name.startswith(lowered):
+                break
+            if doc in scores:
+                scores[doc] += 5.0
+
+        best = heapq.nlargest(limit, scores.items(),
+                              key=lambda item: (item[1], -len(self._entries[item[0]]['name'])))
+        return [dict(self._entries[doc], score=round(score, 3)) for doc, score in best]
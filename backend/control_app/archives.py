@@ -0,0 +1,209 @@
+import grp
+import os
+import pwd
+import tarfile
+import zipfile
+import zlib
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+# Yield to the client once this much archive data is buffered
+FLUSH_SIZE = 256 * 1024
+
+# Formats that are already compressed; deflating them again only burns CPU
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.webm',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.apk', '.whl',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.woff', '.woff2',
+}
+
+
+class StreamSink:
+    """Write-only, unseekable file object that collects bytes until drained
+
+    zipfile sees no seek() and switches to data descriptors, so nothing
+    already written ever has to be patched.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._size += len(data)
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    @property
+    def buffered(self) -> int:
+        return self._size
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+def walk_tree(root: str) -> Iterator[Tuple[str, str, os.stat_result]]:
+    """Yield (path, archive name, stat) for every directory and file under root
+
+    Symlinked files are archived with their target's content; symlinked
+    directories are not descended into, as with os.walk.
+    """
+    base = os.path.basename(root.rstrip('/')) or 'root'
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        relative = os.path.relpath(directory, root)
+        prefix = base if relative == '.' else os.path.join(base, relative)
+        try:
+            yield directory, prefix + '/', os.stat(directory)
+        except OSError:
+            continue
+        for name in sorted(filenames):
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                yield path, os.path.join(prefix, name), stat
+
+
+def stream_zip(root: str, compresslevel: Optional[int] = 6) -> Iterator[bytes]:
+    """Yield a zip archive of root chunk by chunk, without a temporary file
+
+    Entries use data descriptors and switch to ZIP64 by themselves when a
+    file (or the archive) outgrows the classic 4 GiB limits. Each file is
+    archived at the size it had when the walk reached it.
+    """
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED,
+                         allowZip64=True, compresslevel=compresslevel) as archive:
+        for path, name, stat in walk_tree(root):
+            info = zipfile.ZipInfo.from_file(path, name)
+            if info.is_dir():
+                archive.writestr(info, b'')
+                continue
+            extension = os.path.splitext(name)[1].lower()
+            info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            try:
+                source = open(path, 'rb')
+            except OSError:
+                continue
+            with source, archive.open(info, 'w') as target:
+                remaining = stat.st_size
+                while remaining > 0:
+                    chunk = source.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    target.write(chunk)
+                    if sink.buffered >= FLUSH_SIZE:
+                        yield sink.drain()
+            if sink.buffered >= FLUSH_SIZE:
+                yield sink.drain()
+    # Closing the archive wrote the central directory
+    yield sink.drain()
+
+
+@lru_cache(maxsize=256)
+def _user_name(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return ''
+
+
+@lru_cache(maxsize=256)
+def _group_name(gid: int) -> str:
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return ''
+
+
+def _tar_header(name: str, stat: os.stat_result, is_dir: bool) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE if is_dir else tarfile.REGTYPE
+    info.size = 0 if is_dir else stat.st_size
+    info.mode = stat.st_mode & 0o7777
+    # An int mtime keeps PAX from adding an extended header to every entry
+    info.mtime = int(stat.st_mtime)
+    info.uid, info.gid = stat.st_uid, stat.st_gid
+    info.uname, info.gname = _user_name(stat.st_uid), _group_name(stat.st_gid)
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def gzip_compressor(level: int = 6):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def zstd_compressor(level: int = 3, threads: int = -1):
+    """zstd compressor; threads=-1 uses one worker per CPU, 0 compresses inline"""
+    if zstandard is None:
+        raise RuntimeError('zstandard is not installed')
+    return zstandard.ZstdCompressor(level=level, threads=threads).compressobj()
+
+
+def stream_tar(root: str, compressor) -> Iterator[bytes]:
+    """Yield a compressed tar archive of root chunk by chunk, without a temporary file
+
+    The tar stream is written by hand rather than through tarfile.TarFile,
+    which copies a whole member before returning and would buffer large
+    files in memory. `compressor` is any object with compress()/flush(),
+    such as gzip_compressor() or zstd_compressor(). A file that shrinks
+    while it is read is padded with zeros to the size in its header.
+    """
+    raw = StreamSink()
+
+    def compressed():
+        return compressor.compress(raw.drain())
+
+    for path, name, stat in walk_tree(root):
+        if name.endswith('/'):
+            raw.write(_tar_header(name, stat, True))
+            continue
+        try:
+            source = open(path, 'rb')
+        except OSError:
+            continue
+        with source:
+            raw.write(_tar_header(name, stat, False))
+            remaining = stat.st_size
+            while remaining > 0:
+                chunk = source.read(min(CHUNK_SIZE, remaining)) or bytes(min(CHUNK_SIZE, remaining))
+                remaining -= len(chunk)
+                raw.write(chunk)
+                if raw.buffered >= FLUSH_SIZE:
+                    data = compressed()
+                    if data:
+                        yield data
+        padding = -stat.st_size % tarfile.BLOCKSIZE
+        raw.write(bytes(padding))
+        if raw.buffered >= FLUSH_SIZE:
+            data = compressed()
+            if data:
+                yield data
+
+    # End of archive: two zero blocks, then pad to a whole record
+    raw.write(bytes(2 * tarfile.BLOCKSIZE))
+    raw.write(bytes(-raw.tell() % tarfile.RECORDSIZE))
+    yield compressed() + compressor.flush()
@@ -0,0 +1,276 @@
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 8192
+SNIPPET_CHARS = 200
+# Directories never worth searching, .gitignore or not
+ALWAYS_SKIP = {'.git', '.hg', '.svn'}
+
+IgnoreRule = Tuple[str, 're.Pattern', bool, bool]
+
+
+def _segment_regex(segment: str) -> str:
+    """Regex for one '/'-free piece of a gitignore pattern; wildcards never match '/'"""
+    out = []
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        if char == '\\' and i + 1 < len(segment):
+            i += 1
+            out.append(re.escape(segment[i]))
+        elif char == '*':
+            while i + 1 < len(segment) and segment[i + 1] == '*':
+                i += 1
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = segment.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                body = segment[i + 1:end]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append('(?!/)[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+
+def gitignore_regex(pattern: str) -> str:
+    """Translate a gitignore pattern (without '!' or a trailing '/') segment by segment
+
+    '**' is only special as a whole segment: a leading '**/' and a middle
+    '/**/' match any number of directories, a trailing '/**' everything inside.
+    """
+    segments = pattern.split('/')
+    out = []
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == '**':
+            out.append('.+' if last else '(?:[^/]+/)*')
+        else:
+            out.append(_segment_regex(segment) + ('' if last else '/'))
+    return ''.join(out)
+
+
+def parse_gitignore(directory: str) -> List[IgnoreRule]:
+    """Read directory/.gitignore into (anchor, regex, negated, dir_only) rules"""
+    try:
+        with open(os.path.join(directory, '.gitignore'), encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            # An escaped trailing space is kept
+            stripped += ' '
+        line = stripped
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        # A slash anywhere but the end anchors the pattern to this directory
+        anchored = '/' in line
+        line = line.lstrip('/')
+        rules.append((directory if anchored else None, re.compile(gitignore_regex(line)), negated, dir_only))
+    return rules
+
+
+def is_ignored(rules: Sequence[IgnoreRule], path: str, name: str, is_dir: bool) -> bool:
+    """Apply gitignore rules in order; the last matching rule wins
+
+    Unanchored rules match the name, anchored ones the path relative to
+    their .gitignore. An ignored directory is never entered, so, as in git,
+    nothing below it can be re-included.
+    """
+    ignored = False
+    for anchor, regex, negated, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        target = os.path.relpath(path, anchor) if anchor else name
+        if regex.fullmatch(target):
+            ignored = not negated
+    return ignored
+
+
+def iter_files(root: str, max_file_size: int, use_gitignore: bool = True) -> Iterator[Tuple[str, int]]:
+    """Yield (path, size) of regular files under root that should be searched"""
+    stack = [(root, ())]
+    while stack:
+        directory, rules = stack.pop()
+        if use_gitignore:
+            local = parse_gitignore(directory)
+            if local:
+                # Rules of parent directories stay in force below them
+                rules = rules + tuple(local)
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    continue
+                is_dir = entry.is_dir()
+                if is_dir and entry.name in ALWAYS_SKIP:
+                    continue
+                if rules and is_ignored(rules, entry.path, entry.name, is_dir):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rules))
+                elif entry.is_file():
+                    size = entry.stat().st_size
+                    if 0 < size <= max_file_size:
+                        yield entry.path, size
+            except OSError:
+                continue
+
+
+def search_batch(paths: Sequence[str], pattern: str, flags: int, max_per_file: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """Search a batch of files in a worker process
+
+    Returns (files_searched, matches). Files whose first block contains a NUL
+    byte are treated as binary and skipped.
+    """
+    regex = re.compile(pattern, flags)
+    searched = 0
+    matches = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(SNIFF_BYTES)
+                if b'\0' in head:
+                    continue
+                data = head + f.read()
+        except OSError:
+            continue
+        searched += 1
+        text = data.decode('utf-8', errors='replace')
+        line = 1
+        counted_to = 0
+        found = 0
+        position = 0
+        while found < max_per_file:
+            match = regex.search(text, position)
+            if match is None:
+                break
+            start = text.rfind('\n', 0, match.start()) + 1
+            end = text.find('\n', match.end())
+            if end == -1:
+                end = len(text)
+            line += text.count('\n', counted_to, start)
+            counted_to = start
+            matches.append({
+                'path': path,
+                'line': line,
+                'column': match.start() - start + 1,
+                'text': text[start:end][:SNIPPET_CHARS]
+            })
+            found += 1
+            # One result per line; carry on from the next line
+            position = end + 1
+    return searched, matches
+
+
+class ContentSearcher:
+    """Run searches over a shared process pool, streaming results as they arrive"""
+
+    def __init__(self, workers: Optional[int] = None, batch_files: int = 64,
+                 batch_bytes: int = 4 * 1024 * 1024, max_file_size: int = 10 * 1024 * 1024):
+        self.workers = workers or os.cpu_count() or 2
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self.max_file_size = max_file_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # fork from a threaded server is unsafe; forkserver starts clean workers
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _batches(self, root: str, use_gitignore: bool) -> Iterator[List[str]]:
+        batch, size = [], 0
+        for path, file_size in iter_files(root, self.max_file_size, use_gitignore):
+            batch.append(path)
+            size += file_size
+            if len(batch) >= self.batch_files or size >= self.batch_bytes:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def search(self, root: str, pattern: str, regex: bool = False, case_sensitive: bool = False,
+               limit: int = 1000, max_per_file: int = 100, use_gitignore: bool = True) -> Iterator[Dict[str, Any]]:
+        """Start a search and return an iterator of match dicts
+
+        The pattern is compiled here so a bad regex raises re.error before
+        anything is streamed. The iterator ends with one summary dict
+        carrying 'done': True.
+        """
+        if not regex:
+            pattern = re.escape(pattern)
+        flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+        re.compile(pattern, flags)
+        return self._run(root, pattern, flags, limit, max_per_file, use_gitignore)
+
+    def _run(self, root, pattern, flags, limit, max_per_file, use_gitignore):
+        # Closing the generator (the client went away) cancels every batch
+        # that has not started; batches are small, so running ones end soon
+        pool = self._executor()
+        batches = self._batches(root, use_gitignore)
+        pending = set()
+        searched = 0
+        sent = 0
+        truncated = False
+        try:
+            exhausted = False
+            while True:
+                # Keep a couple of batches queued per worker, no more
+                while not exhausted and len(pending) < self.workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(search_batch, batch, pattern, flags, max_per_file))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_searched, matches = future.result()
+                    searched += batch_searched
+                    for match in matches:
+                        if sent >= limit:
+                            truncated = True
+                            break
+                        sent += 1
+                        yield match
+                if truncated:
+                    break
+            yield {'done': True, 'files_searched': searched, 'matches': sent, 'truncated': truncated}
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,506 @@
+"""Content-addressed, deduplicating file transfer
+
+Files are cut into content-defined chunks and each chunk is named by its
+BLAKE2b-128 digest. A client uploading a file sends the list of
+(digest, length) pairs first; the server answers with the digests it
+cannot find in its chunk store or in files it has already indexed, and
+only those chunks cross the wire. Downloads work the other way round: the
+client asks for the manifest of a file and fetches the chunks it lacks with
+Range requests.
+
+Chunking (clients must implement the same rule to share chunks with files
+chunked on the server):
+
+* Each byte b maps to bit (KEY[b >> 3] >> (b & 7)) & 1, where KEY is
+  blake2b(b'shellsync-cdc', digest_size=32).
+* A chunk that starts at s ends right after the first run of RUN_LENGTH
+  consecutive 1-bytes that ends at or after s + MIN_CHUNK, or at
+  s + MAX_CHUNK if there is none (or at EOF).
+
+The rule only looks at a 16-byte window, so an edit moves at most the
+boundaries next to it; it also maps onto bytes.translate() and
+bytes.find(), which chunk a few hundred MB/s without a compiled extension.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .uploads import BLOCK_SIZE, UploadError, preallocate
+
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 256 * 1024
+RUN_LENGTH = 16
+DIGEST_SIZE = 16
+READ_SIZE = 4 * 1024 * 1024
+
+_KEY = hashlib.blake2b(b'shellsync-cdc', digest_size=32).digest()
+BOUNDARY_TABLE = bytes((_KEY[b >> 3] >> (b & 7)) & 1 for b in range(256))
+_RUN = b'\x01' * RUN_LENGTH
+
+_SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+_DIGEST = re.compile(r'^[0-9a-f]{%d}$' % (2 * DIGEST_SIZE))
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def chunk_digest(data) -> str:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def iter_chunks(file) -> Iterator[Tuple[int, int, str]]:
+    """Yield (offset, length, digest) for the content-defined chunks of a binary file object"""
+    buffer = b''
+    bits = b''
+    start = 0
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - start < MAX_CHUNK:
+            data = file.read(READ_SIZE)
+            if data:
+                buffer = buffer[start:] + data
+                bits = bits[start:] + data.translate(BOUNDARY_TABLE)
+                start = 0
+                continue
+            eof = True
+        if start >= len(buffer):
+            return
+        index = bits.find(_RUN, start + MIN_CHUNK - RUN_LENGTH, start + MAX_CHUNK)
+        end = index + RUN_LENGTH if index >= 0 else min(len(buffer), start + MAX_CHUNK)
+        yield offset, end - start, chunk_digest(memoryview(buffer)[start:end])
+        offset += end - start
+        start = end
+
+
+def _identity(stat: os.stat_result) -> Tuple[int, int, int, int]:
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class ChunkIndex:
+    """SQLite map from chunk digest to (path, offset, length) in files on disk
+
+    A file's rows are only trusted while its device, inode, size and mtime
+    still match the values recorded when it was chunked.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            # Created on first use, not when the agent module is imported
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=30) as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, '
+                           'size INTEGER, mtime_ns INTEGER)')
+                db.execute('CREATE TABLE IF NOT EXISTS chunks (digest BLOB, path TEXT, offset INTEGER, length INTEGER)')
+                db.execute('CREATE INDEX IF NOT EXISTS chunks_digest ON chunks (digest)')
+                db.execute('CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path)')
+            self._ready = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def add_file(self, path: str, stat: os.stat_result, chunks: List[Tuple[int, int, str]]):
+        with self._connect() as db:
+            db.execute('DELETE FROM chunks WHERE path = ?', (path,))
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', (path, *_identity(stat)))
+            db.executemany('INSERT INTO chunks VALUES (?, ?, ?, ?)',
+                           ((bytes.fromhex(digest), path, offset, length) for offset, length, digest in chunks))
+
+    def forget(self, path: str):
+        with self._connect() as db:
+            db.execute('DELETE FROM chunks WHERE path = ?', (path,))
+            db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def file_chunks(self, path: str) -> Optional[List[Tuple[int, int, str]]]:
+        """Chunks of path if its index entry is still current"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._connect() as db:
+            row = db.execute('SELECT dev, ino, size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+            if row is None or tuple(row) != _identity(stat):
+                return None
+            rows = db.execute('SELECT offset, length, digest FROM chunks WHERE path = ? ORDER BY offset',
+                              (path,)).fetchall()
+        return [(offset, length, digest.hex()) for offset, length, digest in rows]
+
+    def locate(self, digests: List[str]) -> Dict[str, Tuple[str, int, int]]:
+        """Map each digest found in a still-current file to (path, offset, length)"""
+        found = {}
+        current = {}
+        with self._connect() as db:
+            for digest in digests:
+                for path, offset, length, dev, ino, size, mtime_ns in db.execute(
+                        'SELECT c.path, c.offset, c.length, f.dev, f.ino, f.size, f.mtime_ns '
+                        'FROM chunks c JOIN files f ON f.path = c.path WHERE c.digest = ?',
+                        (bytes.fromhex(digest),)):
+                    if path not in current:
+                        try:
+                            current[path] = _identity(os.stat(path)) == (dev, ino, size, mtime_ns)
+                        except OSError:
+                            current[path] = False
+                    if current[path]:
+                        found[digest] = (path, offset, length)
+                        break
+        return found
+
+
+class ChunkStore:
+    """Chunks uploaded for pending transfers, one file per digest
+
+    Sessions share chunks, so none is deleted when one session ends: a
+    chunk goes once no session has asked for it for longer than the TTL.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def keep(self, digest: str) -> bool:
+        """Like has(), and keeps a chunk a session still needs from being pruned"""
+        try:
+            os.utime(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put(self, digest: str, stream, length: int) -> int:
+        """Store a chunk read from stream; raises UploadError unless it hashes to digest"""
+        if length > MAX_CHUNK:
+            raise UploadError(f'Chunks are at most {MAX_CHUNK} bytes', 413)
+        data = stream.read(length)
+        if len(data) != length:
+            raise UploadError(f'Chunk ended after {len(data)} of {length} bytes')
+        if chunk_digest(data) != digest:
+            raise UploadError('Chunk does not match its digest', 422)
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return length
+
+    def prune(self, max_age: float):
+        cutoff = time.time() - max_age
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.unlink(path)
+                except OSError:
+                    continue
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        count = os.pwrite(fd, view, offset)
+        view = view[count:]
+        offset += count
+
+
+def _copy_range(source_fd: int, source_offset: int, target_fd: int, target_offset: int, length: int):
+    """Copy bytes between files in the kernel (a reflink on btrfs/XFS) where possible"""
+    while length > 0:
+        try:
+            count = os.copy_file_range(source_fd, target_fd, length, source_offset, target_offset)
+        except (AttributeError, OSError):
+            count = 0
+        if count <= 0:
+            data = os.pread(source_fd, min(length, BLOCK_SIZE), source_offset)
+            if not data:
+                raise UploadError('Source chunk is shorter than indexed', 409)
+            count = os.pwrite(target_fd, data, target_offset)
+        source_offset += count
+        target_offset += count
+        length -= count
+
+
+class DedupTransfer:
+    """Upload sessions and download manifests over a ChunkStore and a ChunkIndex
+
+    Chunking the file an upload replaces, and pruning expired sessions and
+    chunks, run on a background thread rather than in the request.
+    """
+
+    def __init__(self, state_dir: str, ttl: float = 24 * 3600, prune_interval: float = 3600):
+        self.state_dir = os.path.expanduser(state_dir)
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.index = ChunkIndex(os.path.join(self.state_dir, 'index.sqlite3'))
+        self.store = ChunkStore(os.path.join(self.state_dir, 'chunks'))
+        self.sessions_dir = os.path.join(self.state_dir, 'sessions')
+        self._pool = None
+        self._indexing = {}
+        self._pruned_at = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dedup')
+            return self._pool
+
+    def _session_path(self, upload_id: str, suffix: str = '.json') -> str:
+        if not _SESSION_ID.match(upload_id or ''):
+            raise UploadError('Upload not found', 404)
+        return os.path.join(self.sessions_dir, upload_id + suffix)
+
+    def _load(self, upload_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._session_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """Yield the session under an exclusive lock shared by all workers"""
+        if not os.path.exists(self._session_path(upload_id)):
+            raise UploadError('Upload not found', 404)
+        with open(self._session_path(upload_id, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Committed or aborted while we waited
+            yield self._load(upload_id)
+
+    def _index_in_background(self, path: str):
+        """Chunk path on the background thread unless its index is current"""
+        with self._lock:
+            future = self._indexing.get(path)
+            if future is not None and not future.done():
+                return
+        if self.index.file_chunks(path) is not None:
+            return
+
+        def index():
+            try:
+                self.index_file(path)
+            except OSError:
+                pass
+
+        future = self._executor().submit(index)
+        with self._lock:
+            self._indexing[path] = future
+            for other in [other for other, done in self._indexing.items() if done.done()]:
+                del self._indexing[other]
+
+    def _wait_for_index(self, path: str):
+        with self._lock:
+            future = self._indexing.get(path)
+        if future is not None:
+            future.result()
+
+    def _prune_in_background(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._pruned_at is not None and now - self._pruned_at < self.prune_interval:
+                return
+            self._pruned_at = now
+        self._executor().submit(self.prune)
+
+    def _missing(self, digests: List[str]) -> List[str]:
+        pending = [digest for digest in digests if not self.store.keep(digest)]
+        located = self.index.locate(pending)
+        return [digest for digest in pending if digest not in located]
+
+    def index_file(self, path: str) -> List[Tuple[int, int, str]]:
+        """Chunks of path, from the index when current, otherwise chunked and indexed now"""
+        chunks = self.index.file_chunks(path)
+        if chunks is not None:
+            return chunks
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            chunks = list(iter_chunks(f))
+        self.index.add_file(path, stat, chunks)
+        return chunks
+
+    def manifest(self, path: str) -> Dict[str, Any]:
+        path = os.path.expanduser(path)
+        if not os.path.isfile(path):
+            raise UploadError('Path is not a file', 404)
+        chunks = self.index_file(path)
+        return {
+            'path': path,
+            'size': sum(length for _, length, _ in chunks),
+            'chunks': [[digest, offset, length] for offset, length, digest in chunks],
+        }
+
+    def prune(self):
+        """Drop sessions and chunks nobody used for longer than ttl"""
+        cutoff = time.time() - self.ttl
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        names = os.listdir(self.sessions_dir)
+        for name in names:
+            path = os.path.join(self.sessions_dir, name)
+            upload_id, extension = os.path.splitext(name)
+            try:
+                if extension == '.lock':
+                    # The lock file stays until its session is gone
+                    if upload_id + '.json' not in names:
+                        os.unlink(path)
+                elif os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+            except OSError:
+                continue
+        self.store.prune(self.ttl)
+
+    def create(self, directory: str, filename: str, size: int, sha256: str,
+               chunks: List[List[Any]]) -> Dict[str, Any]:
+        directory = os.path.expanduser(directory)
+        if not filename or filename in ('.', '..') or '/' in filename or '\0' in filename:
+            raise UploadError('Invalid filename')
+        if not _SHA256.match((sha256 or '').lower()):
+            raise UploadError('sha256 of the whole file is required (64 hex digits)')
+        if not os.path.isdir(directory):
+            raise UploadError('Target directory does not exist')
+        try:
+            chunks = [[str(digest).lower(), int(length)] for digest, length in chunks]
+        except (TypeError, ValueError):
+            raise UploadError('chunks must be a list of [digest, length] pairs')
+        if any(not _DIGEST.match(digest) or not 0 < length <= MAX_CHUNK for digest, length in chunks):
+            raise UploadError(f'Invalid chunk: digests are {2 * DIGEST_SIZE} hex digits, lengths 1-{MAX_CHUNK}')
+        if sum(length for _, length in chunks) != size:
+            raise UploadError('Chunk lengths do not add up to size')
+
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        self._prune_in_background()
+        target_path = os.path.join(directory, filename)
+        if os.path.isfile(target_path):
+            # The usual case: a new version of a file that is already here. Until it
+            # is chunked, status() reports 'indexing' and lists its chunks as missing.
+            self._index_in_background(target_path)
+
+        upload_id = uuid.uuid4().hex
+        session = {
+            'id': upload_id,
+            'target_path': target_path,
+            'size': size,
+            'sha256': sha256.lower(),
+            'chunks': chunks,
+        }
+        with open(self._session_path(upload_id), 'w') as f:
+            json.dump(session, f)
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        session = self._load(upload_id)
+        lengths = dict(session['chunks'])
+        missing = self._missing(list(lengths))
+        with self._lock:
+            future = self._indexing.get(session['target_path'])
+        return {
+            'upload_id': upload_id,
+            'path': session['target_path'],
+            'size': session['size'],
+            'chunks': len(session['chunks']),
+            'missing': missing,
+            'missing_bytes': sum(lengths[digest] for digest in missing),
+            'indexing': future is not None and not future.done(),
+        }
+
+    def put_chunk(self, upload_id: str, digest: str, stream, length: int) -> Dict[str, Any]:
+        session = self._load(upload_id)
+        digest = digest.lower()
+        if digest not in dict(session['chunks']):
+            raise UploadError('Chunk is not part of this upload', 404)
+        self.store.put(digest, stream, length)
+        return {'digest': digest, 'stored': length}
+
+    def commit(self, upload_id: str) -> Dict[str, Any]:
+        """Assemble the file from stored and indexed chunks, verify it and move it into place"""
+        with self._locked(upload_id) as session:
+            return self._commit(session)
+
+    def _commit(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        upload_id = session['id']
+        target_path = session['target_path']
+        # Chunks of the file being replaced count as soon as they are indexed
+        self._wait_for_index(target_path)
+        digests = [digest for digest, _ in session['chunks']]
+        located = self.index.locate([digest for digest in set(digests) if not self.store.has(digest)])
+        missing = [digest for digest in dict.fromkeys(digests) if not self.store.has(digest) and digest not in located]
+        if missing:
+            raise UploadError('Chunks are missing', 409, missing=missing)
+
+        directory, filename = os.path.split(target_path)
+        part_path = os.path.join(directory, f'.{filename}.{upload_id}.part')
+        # The session lock is held: a part file left here is from a commit that died
+        target_fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        sources = {}
+        try:
+            preallocate(target_fd, session['size'])
+            position = 0
+            for digest, length in session['chunks']:
+                if digest in located:
+                    path, offset, _ = located[digest]
+                    if path not in sources:
+                        sources[path] = os.open(path, os.O_RDONLY)
+                    _copy_range(sources[path], offset, target_fd, position, length)
+                else:
+                    with open(self.store.path(digest), 'rb') as f:
+                        _pwrite_all(target_fd, f.read(), position)
+                position += length
+            os.fsync(target_fd)
+        except BaseException:
+            os.close(target_fd)
+            os.unlink(part_path)
+            raise
+        finally:
+            for fd in sources.values():
+                os.close(fd)
+        os.close(target_fd)
+
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        if digest.hexdigest() != session['sha256']:
+            os.unlink(part_path)
+            # A source file changed without its mtime moving: stop trusting it
+            for path in {path for path, _, _ in located.values()}:
+                self.index.forget(path)
+            raise UploadError('Checksum mismatch', 422, expected=session['sha256'], actual=digest.hexdigest())
+
+        os.replace(part_path, target_path)
+        offsets = []
+        position = 0
+        for chunk, length in session['chunks']:
+            offsets.append((position, length, chunk))
+            position += length
+        # The new file is now where these chunks live; future uploads reuse it
+        self.index.add_file(target_path, os.stat(target_path), offsets)
+        os.unlink(self._session_path(upload_id))
+        return {
+            'status': 'success',
+            'path': target_path,
+            'size': session['size'],
+            'sha256': session['sha256'],
+            'reused_bytes': sum(length for chunk, length in session['chunks'] if chunk in located),
+        }
+
+    def abort(self, upload_id: str) -> Dict[str, Any]:
+        # Its chunks may serve other sessions too; prune() drops them once unused
+        with self._locked(upload_id):
+            os.unlink(self._session_path(upload_id))
+        return {'status': 'success'}
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from .inotify import (
+    IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_ISDIR, IN_MODIFY,
+    IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, WatchManager,
+)
+
+logger = logging.getLogger(__name__)
+
+# A client that falls this many batches behind on one directory is told to rescan it
+MAX_PENDING_BATCHES = 50
+
+
+def _frame(payload) -> bytes:
+    return f"event: directory\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+class ChangeBatch:
+    """Coalesce the raw inotify events of one directory into per-name changes
+
+    Within a batch, created+modified is still 'created', created+deleted
+    cancels out, deleted+created becomes 'modified', and a MOVED_FROM /
+    MOVED_TO pair sharing a cookie becomes one 'moved' change.
+    """
+
+    def __init__(self):
+        self.changes = OrderedDict()
+        self.moves = {}
+        self.rescan = False
+        self.gone = False
+
+    def add(self, event):
+        mask = event.mask
+        if mask & IN_Q_OVERFLOW:
+            self.rescan = True
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.gone = True
+            return
+        if not event.name:
+            return
+        is_dir = bool(mask & IN_ISDIR)
+        if mask & IN_MOVED_FROM:
+            self.moves[event.cookie] = (event.name, is_dir)
+            self._merge(event.name, 'deleted', is_dir)
+        elif mask & IN_MOVED_TO:
+            source = self.moves.pop(event.cookie, None)
+            if source is not None and self.changes.get(source[0], {}).get('type') == 'deleted':
+                del self.changes[source[0]]
+                self.changes.pop(event.name, None)
+                self.changes[event.name] = {'type': 'moved', 'name': event.name,
+                                            'old_name': source[0], 'is_dir': is_dir}
+            else:
+                self._merge(event.name, 'created', is_dir)
+        elif mask & IN_CREATE:
+            self._merge(event.name, 'created', is_dir)
+        elif mask & IN_DELETE:
+            self._merge(event.name, 'deleted', is_dir)
+        elif mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB):
+            self._merge(event.name, 'modified', is_dir)
+
+    def _merge(self, name: str, kind: str, is_dir: bool):
+        previous = self.changes.get(name)
+        if previous is None:
+            self.changes[name] = {'type': kind, 'name': name, 'is_dir': is_dir}
+            return
+        before = previous['type']
+        if kind == 'deleted':
+            if before == 'created':
+                del self.changes[name]
+            elif before == 'moved':
+                # Moved in and deleted again: from the client's view the old name went away
+                del self.changes[name]
+                self._merge(previous['old_name'], 'deleted', is_dir)
+            else:
+                previous['type'] = 'deleted'
+        elif kind == 'created' and before == 'deleted':
+            previous['type'] = 'modified'
+        # created/moved followed by modified stays created/moved
+
+    def payload(self, path: str) -> Dict:
+        if self.rescan or self.gone:
+            return {'path': path, 'type': 'gone' if self.gone else 'rescan', 'changes': []}
+        return {'path': path, 'type': 'changes', 'changes': list(self.changes.values())}
+
+
+class DirectorySubscription:
+    """Per-client queue of encoded change batches for the watched directories
+
+    Batches are queued under a thread lock and the loop is only woken up,
+    so the stream may be consumed on another loop than the one that
+    subscribed (under WSGI the view's loop is gone once it returns).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, paths: Iterable[str]):
+        self.loop = loop
+        self.paths = frozenset(paths)
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._event = asyncio.Event()
+
+    def offer(self, path: str, frame: bytes):
+        with self._lock:
+            frames = self._pending.setdefault(path, [])
+            if len(frames) >= MAX_PENDING_BATCHES:
+                # Too far behind to replay; a fresh listing is cheaper
+                frames[:] = [_frame({'path': path, 'type': 'rescan', 'changes': []})]
+            else:
+                frames.append(frame)
+            loop, event = self.loop, self._event
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # That loop is closed; the batch waits for the next get()
+            pass
+
+    async def get(self, timeout: Optional[float] = None) -> List[bytes]:
+        """Wait for batches; returns an empty list on timeout"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop is not self.loop:
+                self.loop, self._event = loop, asyncio.Event()
+            event = self._event
+            event.clear()
+            waiting = not self._pending
+        if waiting:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        return [frame for frames in pending.values() for frame in frames]
+
+
+class DirectoryWatcher:
+    """Fan coalesced directory changes out to subscribers
+
+    Each directory has one inotify watch no matter how many clients follow
+    it. Events are collected for `debounce` seconds after the first one and
+    then sent as a single batch, so a build writing thousands of files
+    produces a handful of messages rather than thousands.
+    """
+
+    def __init__(self, watch_manager: WatchManager, debounce: float = 0.1):
+        self.watch_manager = watch_manager
+        self.debounce = debounce
+        self._lock = threading.Condition()
+        self._subscribers = {}
+        self._batches = {}
+        self._deadlines = {}
+        self._thread = None
+
+    def subscribe(self, paths: Iterable[str]) -> DirectorySubscription:
+        """Subscribe the running event loop to changes in paths"""
+        subscription = DirectorySubscription(asyncio.get_running_loop(), paths)
+        added = []
+        with self._lock:
+            try:
+                for path in subscription.paths:
+                    subscribers = self._subscribers.get(path)
+                    if subscribers is None:
+                        if not self.watch_manager.watch(path, self._on_events):
+                            raise OSError(f'Cannot watch {path}')
+                        subscribers = self._subscribers[path] = set()
+                    subscribers.add(subscription)
+                    added.append(path)
+            except OSError:
+                self._remove(subscription, added)
+                raise
+            self._ensure_thread()
+        return subscription
+
+    def unsubscribe(self, subscription: DirectorySubscription):
+        with self._lock:
+            self._remove(subscription, subscription.paths)
+
+    def _remove(self, subscription: DirectorySubscription, paths: Iterable[str]):
+        for path in paths:
+            subscribers = self._subscribers.get(path)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[path]
+                self._batches.pop(path, None)
+                self._deadlines.pop(path, None)
+                self.watch_manager.unwatch(path, self._on_events)
+
+    def _on_events(self, path: str, events):
+        # Runs on the inotify thread: only record, the flusher does the rest.
+        # path is the one subscribed to, even when a symlinked alias of it is
+        # watched too, so each alias gets its own batches.
+        with self._lock:
+            if path not in self._subscribers:
+                return
+            batch = self._batches.get(path)
+            if batch is None:
+                batch = self._batches[path] = ChangeBatch()
+                self._deadlines[path] = time.monotonic() + self.debounce
+                self._lock.notify()
+            for event in events:
+                batch.add(event)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='directory-watch', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._deadlines:
+                    self._lock.wait()
+                now = time.monotonic()
+                due = [path for path, deadline in self._deadlines.items() if deadline <= now]
+                if not due:
+                    self._lock.wait(min(self._deadlines.values()) - now)
+                    continue
+                ready = []
+                for path in due:
+                    del self._deadlines[path]
+                    batch = self._batches.pop(path)
+                    ready.append((path, batch, list(self._subscribers.get(path, ()))))
+                    if batch.gone and self._subscribers.pop(path, None) is not None:
+                        # Forget the directory; after a move (no IN_IGNORED) the watch is still live
+                        self.watch_manager.unwatch(path, self._on_events)
+
+            for path, batch, subscribers in ready:
+                payload = batch.payload(path)
+                if payload['type'] == 'changes' and not payload['changes']:
+                    continue
+                for change in payload['changes']:
+                    change['path'] = os.path.join(path, change['name'])
+                frame = _frame(payload)
+                for subscription in subscribers:
+                    subscription.offer(path, frame)
@@ -0,0 +1,280 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, Tuple
+
+# (mtime_ns, scanned_at, disk_bytes, apparent_bytes, files, subdirectory names)
+DirInfo = Tuple[int, float, int, int, int, Tuple[str, ...]]
+# (mtime_ns, oldest scanned_at inside, disk_bytes, apparent_bytes, files, dirs) of a whole subtree
+SubtreeInfo = Tuple[int, float, int, int, int, int]
+
+
+class DiskUsageAnalyzer:
+    """du-style recursive sizes with a per-directory cache
+
+    The cache is keyed on (st_dev, st_ino) and validated by the directory's
+    mtime. That mtime only changes when entries are added, removed or renamed,
+    so an unchanged directory is not listed again, but its subdirectories are
+    still visited. Files that grow in place do not touch the mtime; they are
+    picked up when an entry expires after `ttl` seconds, or when a scan is
+    run with fresh=True.
+
+    Below the depth of the returned tree, whole subtrees are cached too: a
+    directory whose mtime is unchanged is not descended into while its
+    totals are younger than `ttl`, so changes deeper down show up with the
+    same delay as files growing in place. Both caches evict the least
+    recently used entries past `max_entries`.
+
+    Sizes are disk usage (st_blocks * 512) with the apparent size alongside.
+    Scans stay on the starting filesystem and count hard links once per link,
+    like `du -xl`.
+    """
+
+    def __init__(self, workers: int = 8, ttl: float = 600.0, max_entries: int = 500000,
+                 progress_interval: float = 0.5):
+        self.workers = workers
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.progress_interval = progress_interval
+        self._cache = OrderedDict()
+        self._subtrees = OrderedDict()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='disk-usage')
+            return self._pool
+
+    def _lookup(self, cache: OrderedDict, key, mtime_ns: int):
+        with self._lock:
+            cached = cache.get(key)
+            if cached is None or cached[0] != mtime_ns or time.time() - cached[1] >= self.ttl:
+                return None
+            cache.move_to_end(key)
+            return cached
+
+    def _remember(self, cache: OrderedDict, key, info):
+        with self._lock:
+            cache[key] = info
+            cache.move_to_end(key)
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+
+    def _forget_ancestors(self, path: str):
+        """Drop the subtree totals that include path, which just changed"""
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+            path = parent
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            with self._lock:
+                self._subtrees.pop((stat.st_dev, stat.st_ino), None)
+
+    def _scan_dir(self, path: str, device: int, fresh: bool, whole: bool):
+        """Return (key, kind, info) for one directory, or None to skip it
+
+        kind is 'subtree' (info is a SubtreeInfo, only when whole is true),
+        'cached' or 'scanned' (info is a DirInfo).
+        """
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return None
+        if stat.st_dev != device:
+            return None
+        key = (stat.st_dev, stat.st_ino)
+        if not fresh:
+            subtree = self._lookup(self._subtrees, key, stat.st_mtime_ns) if whole else None
+            if subtree is not None:
+                return key, 'subtree', subtree
+            cached = self._lookup(self._cache, key, stat.st_mtime_ns)
+            if cached is not None:
+                return key, 'cached', cached
+
+        # The directory's own blocks count towards its usage, as in du
+        disk_bytes = stat.st_blocks * 512
+        apparent = stat.st_size
+        files = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                            continue
+                        entry_stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    disk_bytes += entry_stat.st_blocks * 512
+                    apparent += entry_stat.st_size
+                    files += 1
+        except OSError:
+            return None
+
+        info = (stat.st_mtime_ns, time.time(), disk_bytes, apparent, files, tuple(subdirs))
+        self._remember(self._cache, key, info)
+        return key, 'scanned', info
+
+    def scan(self, path: str, depth: int = 2, fresh: bool = False, max_children: int = 50) -> Iterator[Dict[str, Any]]:
+        """Yield progress events while scanning, then one 'result' event
+
+        Every event carries a treemap-ready tree cut at `depth`; in progress
+        events the totals are the part of the tree scanned so far.
+        """
+        path = os.path.abspath(path)
+        device = os.lstat(path).st_dev
+        pool = self._executor()
+        started = time.monotonic()
+        # Per tree node (directories up to `depth`): [disk, apparent, files, dirs]
+        totals = {path: [0, 0, 0, 0]}
+        own = {}
+        children = {path: []}
+        # Per directory whose subtree is still being scanned:
+        # [disk, apparent, files, dirs, unfinished subdirectories, parent, key, mtime_ns, oldest scanned_at]
+        subtrees = {}
+        stats = {'dirs_scanned': 0, 'dirs_cached': 0, 'dirs_skipped': 0, 'subtrees_cached': 0}
+
+        def complete(directory):
+            """Store the totals of a subtree whose directories have all come in"""
+            disk_bytes, apparent, files, dirs, _, _, key, mtime_ns, since = subtrees.pop(directory)
+            self._remember(self._subtrees, key, (mtime_ns, since, disk_bytes, apparent, files, dirs))
+            return [disk_bytes, apparent, files, dirs, since]
+
+        def fold(parent, sums):
+            """Add a finished subtree to its parent, completing every ancestor it was the last one of"""
+            while parent is not None:
+                node = subtrees[parent]
+                for i in range(4):
+                    node[i] += sums[i]
+                node[8] = min(node[8], sums[4])
+                node[4] -= 1
+                if node[4]:
+                    return
+                sums = complete(parent)
+                parent = node[5]
+
+        queue = deque([(path, 0, (path,), None)])
+        in_flight = {}
+        last_progress = started
+        try:
+            while queue or in_flight:
+                # A bounded number of directories in flight keeps memory flat on huge trees
+                while queue and len(in_flight) < self.workers * 4:
+                    item = queue.popleft()
+                    in_flight[pool.submit(self._scan_dir, item[0], device, fresh, item[1] >= depth)] = item
+                done, _ = wait(in_flight, timeout=self.progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory, level, chain, parent = in_flight.pop(future)
+                    result = future.result()
+                    if result is None:
+                        # Unreadable, vanished, or a mount point of another filesystem
+                        stats['dirs_skipped'] += 1
+                        fold(parent, [0, 0, 0, 0, time.time()])
+                        continue
+                    key, kind, info = result
+                    if kind == 'subtree':
+                        # Nothing below it changed: no need to go down
+                        mtime_ns, since, disk_bytes, apparent, files, dirs = info
+                        stats['subtrees_cached'] += 1
+                        stats['dirs_cached'] += dirs
+                        for node in chain:
+                            total = totals[node]
+                            total[0] += disk_bytes
+                            total[1] += apparent
+                            total[2] += files
+                            total[3] += dirs
+                        fold(parent, [disk_bytes, apparent, files, dirs, since])
+                        continue
+                    stats['dirs_' + kind] += 1
+                    mtime_ns, scanned_at, disk_bytes, apparent, files, subdirs = info
+                    if level < depth:
+                        own[directory] = (disk_bytes, apparent, files)
+                    for node in chain:
+                        total = totals[node]
+                        total[0] += disk_bytes
+                        total[1] += apparent
+                        total[2] += files
+                        total[3] += 1
+                    subtrees[directory] = [disk_bytes, apparent, files, 1, len(subdirs), parent,
+                                           key, mtime_ns, scanned_at]
+                    for name in subdirs:
+                        child = os.path.join(directory, name)
+                        child_chain = chain
+                        if level + 1 <= depth:
+                            totals[child] = [0, 0, 0, 0]
+                            children[child] = []
+                            children[directory].append(child)
+                            child_chain = chain + (child,)
+                        queue.append((child, level + 1, child_chain, directory))
+                    if not subdirs:
+                        fold(parent, complete(directory))
+
+                now = time.monotonic()
+                if (queue or in_flight) and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    yield dict(stats, type='progress', elapsed=round(now - started, 3),
+                               tree=self._tree(path, totals, own, children, max_children))
+
+            if stats['dirs_scanned']:
+                self._forget_ancestors(path)
+            yield dict(stats, type='result', elapsed=round(time.monotonic() - started, 3),
+                       tree=self._tree(path, totals, own, children, max_children))
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def analyze(self, path: str, depth: int = 2, fresh: bool = False, max_children: int = 50) -> Dict[str, Any]:
+        """Run a scan to completion and return its result event"""
+        result = None
+        for event in self.scan(path, depth, fresh, max_children):
+            result = event
+        return result
+
+    def _tree(self, path: str, totals, own, children, max_children: int) -> Dict[str, Any]:
+        def node(directory: str) -> Dict[str, Any]:
+            disk_bytes, apparent, files, dirs = totals[directory]
+            result = {
+                'name': os.path.basename(directory) or directory,
+                'path': directory,
+                'size': disk_bytes,
+                'apparent_size': apparent,
+                'files': files,
+                'dirs': dirs
+            }
+            if directory in children and directory in own:
+                kids = sorted((node(child) for child in children[directory]),
+                              key=lambda item: item['size'], reverse=True)
+                if len(kids) > max_children:
+                    rest = kids[max_children:]
+                    kids = kids[:max_children] + [{
+                        'name': f'({len(rest)} more)',
+                        'size': sum(item['size'] for item in rest),
+                        'apparent_size': sum(item['apparent_size'] for item in rest),
+                        'files': sum(item['files'] for item in rest),
+                        'dirs': sum(item['dirs'] for item in rest),
+                        'other': True
+                    }]
+                own_bytes, own_apparent, own_files = own[directory]
+                if own_files:
+                    # Files directly in this directory, so children add up to the parent
+                    kids.append({
+                        'name': '(files)',
+                        'size': own_bytes,
+                        'apparent_size': own_apparent,
+                        'files': own_files,
+                        'dirs': 0,
+                        'other': True
+                    })
+                result['children'] = kids
+            return result
+
+        return node(path)
@@ -0,0 +1,175 @@
+import codecs
+import hashlib
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+SNIFF_BYTES = 8192
+BLOCK_SIZE = 64 * 1024
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# Encodings in which b'\n' always means a line break
+LINE_SAFE_ENCODINGS = {'utf-8', 'latin-1', 'ascii'}
+# Control characters that do not appear in text files
+_BINARY_BYTES = bytes(set(range(32)) - {7, 8, 9, 10, 12, 13, 27})
+
+
+def detect_encoding(prefix: bytes) -> Tuple[Optional[str], int]:
+    """Guess (encoding, bom_length) from the first bytes of a file
+
+    Returns (None, 0) for binary data: a NUL byte, or more than 10% of
+    control characters that never show up in text.
+    """
+    for bom, encoding in BOMS:
+        if prefix.startswith(bom):
+            return encoding, len(bom)
+    if not prefix:
+        return 'utf-8', 0
+    if b'\0' in prefix:
+        return None, 0
+    if len(prefix.translate(None, _BINARY_BYTES)) < len(prefix) * 0.9:
+        return None, 0
+    try:
+        # final=False tolerates a multibyte character cut off by the prefix
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8', 0
+    except UnicodeDecodeError:
+        return 'latin-1', 0
+
+
+class LineIndex:
+    """Sparse line index: the line number at the start of every 64 KiB block
+
+    Finding where line N starts is a bisect over the blocks plus a scan of
+    at most one block, however large the file is.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = array('q')
+        self.offsets = array('q')
+        self.size = 0
+        self.newlines = 0
+        self.identity = None
+        self.tail_digest = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _identity(stat):
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _digest(self, mm, end: int) -> bytes:
+        return hashlib.blake2b(mm[max(0, end - 4096):end], digest_size=16).digest()
+
+    def update(self, stat) -> 'LineIndex':
+        """Index the file, continuing from the last run if it was only appended to"""
+        identity = self._identity(stat)
+        if identity == self.identity:
+            return self
+        with open(self.path, 'rb') as f:
+            # Describe the file actually read, which may have changed since stat
+            stat = os.fstat(f.fileno())
+            identity = self._identity(stat)
+            size = stat.st_size
+            if size == 0:
+                self.lines, self.offsets = array('q'), array('q')
+                self.size = self.newlines = 0
+                self.identity, self.tail_digest = identity, None
+                return self
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                appended = (self.identity is not None and self.identity[:2] == identity[:2]
+                            and size > self.size and self._digest(mm, self.size) == self.tail_digest)
+                if not appended:
+                    self.lines, self.offsets = array('q'), array('q')
+                    self.size = self.newlines = 0
+                # Resume at the last (possibly partial) block boundary
+                if self.offsets and self.offsets[-1] + BLOCK_SIZE > self.size:
+                    start = self.offsets.pop()
+                    self.newlines = self.lines.pop()
+                else:
+                    start = self.size
+                newlines = self.newlines
+                for block in range(start, size, BLOCK_SIZE):
+                    self.offsets.append(block)
+                    self.lines.append(newlines)
+                    newlines += mm[block:block + BLOCK_SIZE].count(b'\n')
+                self.newlines = newlines
+                self.size = size
+                self.tail_digest = self._digest(mm, size)
+        self.identity = identity
+        return self
+
+    @property
+    def total_lines(self) -> int:
+        """Number of lines, counting a last line without a trailing newline"""
+        if self.size == 0:
+            return 0
+        return self.newlines + (0 if self._ends_with_newline else 1)
+
+    @property
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            return os.pread(f.fileno(), 1, self.size - 1) == b'\n'
+
+    def line_offset(self, fd: int, line: int) -> int:
+        """Byte offset where 1-based line starts (the file size past the end)"""
+        wanted = line - 1
+        if wanted <= 0:
+            return 0
+        if wanted > self.newlines:
+            return self.size
+        block = bisect_right(self.lines, wanted - 1) - 1
+        # lines[block] newlines lie before this block; skip the remaining ones
+        remaining = wanted - self.lines[block]
+        position = self.offsets[block]
+        while True:
+            data = os.pread(fd, BLOCK_SIZE, position)
+            if not data:
+                # Truncated since it was indexed: the line is past the end now
+                return min(position, os.fstat(fd).st_size)
+            count = data.count(b'\n')
+            if count < remaining:
+                remaining -= count
+                position += len(data)
+                continue
+            index = -1
+            for _ in range(remaining):
+                index = data.index(b'\n', index + 1)
+            return position + index + 1
+
+
+class LineIndexCache:
+    """Small LRU of line indexes, revalidated by (inode, mtime, size)"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat) -> LineIndex:
+        with self._lock:
+            index = self._entries.get(path)
+            if index is None:
+                index = LineIndex(path)
+                self._entries[path] = index
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        # Per-file lock: two requests never index the same file twice, other files are not blocked
+        with index.lock:
+            return index.update(stat)
+
+    def discard(self, path: str):
+        """Forget the index of a file that changed while it was being read"""
+        with self._lock:
+            self._entries.pop(path, None)
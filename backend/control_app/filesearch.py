@@ -0,0 +1,561 @@
+import fcntl
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from .inotify import IN_Q_OVERFLOW, WatchManager
+
+logger = logging.getLogger(__name__)
+
+# Index file layout:
+#   header | offsets (count x uint64) | paths | lowercased paths
+# Paths are sorted, each preceded by a NUL and directories end in '/'.
+# The lowercased copy is made with fold(), which keeps the byte length, so
+# an offset found in one section is valid in the other.
+MAGIC = b'SSFIDX02'
+HEADER = struct.Struct('<8sQQd')
+
+GLOB_CHARS = set('*?[')
+
+Layout = namedtuple('Layout', ['mm', 'count', 'built_at', 'data_start', 'lower_start', 'data_len'])
+
+
+class _FoldTable(dict):
+    """str.translate() table lowering each character whose lowercase has the same UTF-8 length"""
+
+    def __missing__(self, codepoint: int) -> str:
+        char = chr(codepoint)
+        lower = char.lower()
+        if len(lower) != 1 or len(lower.encode('utf-8', 'surrogatepass')) != len(char.encode('utf-8', 'surrogatepass')):
+            # e.g. 'İ' lowers to two characters and KELVIN SIGN to a shorter 'k'
+            lower = char
+        self[codepoint] = lower
+        return lower
+
+
+_FOLD = _FoldTable()
+
+
+def fold(raw: bytes) -> bytes:
+    """Case-fold encoded paths (and queries) without changing their byte length"""
+    lowered = raw.lower()
+    if lowered.isascii():
+        return lowered
+    return lowered.decode('utf-8', 'surrogateescape').translate(_FOLD).encode('utf-8', 'surrogateescape')
+
+
+def write_index(index_path: str, paths: Iterable[bytes]) -> int:
+    """Write a sorted path index atomically; returns the number of paths"""
+    paths = sorted(paths)
+    offsets = array('Q')
+    data = bytearray()
+    for path in paths:
+        data += b'\0'
+        offsets.append(len(data))
+        data += path
+    data += b'\0'
+    if offsets.itemsize != 8:
+        raise RuntimeError('uint64 array support is required')
+
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(offsets), len(data), time.time()))
+        f.write(offsets.tobytes())
+        f.write(data)
+        f.write(fold(bytes(data)))
+    # Readers keep their mapping of the old inode until they notice the swap
+    os.replace(tmp_path, index_path)
+    return len(offsets)
+
+
+def glob_regex(pattern: str) -> 're.Pattern':
+    """Translate a case-insensitive glob into a regex matching one index record
+
+    Patterns without a '/' match the basename. Patterns with one match a
+    path suffix starting at a directory boundary, or the whole path when
+    they start with '/'.
+    """
+    whole_path = '/' in pattern
+    any_byte = b'[^\0]' if whole_path else b'[^/\0]'
+    # One character: an ASCII byte or a whole multibyte sequence (a stray
+    # continuation byte of an undecodable name counts as one too)
+    ascii_char = b'[\x01-\x7f]' if whole_path else b'[\x01-\x2e\x30-\x7f]'
+    one_char = (b'(?:' + ascii_char + b'|[\xc0-\xdf][\x80-\xbf]|[\xe0-\xef][\x80-\xbf]{2}'
+                b'|[\xf0-\xf7][\x80-\xbf]{3}|[\x80-\xbf])')
+    out = []
+    i = 0
+    raw = fold(os.fsencode(pattern))
+    while i < len(raw):
+        char = raw[i:i + 1]
+        if char == b'*':
+            out.append(any_byte + b'*')
+        elif char == b'?':
+            out.append(one_char)
+        elif char == b'[':
+            end = raw.find(b']', i + 2)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                body = raw[i + 1:end]
+                if body.startswith(b'!'):
+                    body = b'^' + body[1:]
+                out.append(b'[' + body.replace(b'\\', b'\\\\') + b']')
+                i = end
+        else:
+            out.append(re.escape(char))
+        i += 1
+    prefix = b'' if raw.startswith(b'/') else b'(?:[^\0]*/)?'
+    return re.compile(prefix + b''.join(out))
+
+
+def glob_literal(pattern: str) -> bytes:
+    """Longest wildcard-free run of a glob, used to find candidates quickly"""
+    pieces = re.split(rb'\*|\?|\[[^\]]*\]', fold(os.fsencode(pattern)))
+    return max(pieces, key=len)
+
+
+class FilenameIndex:
+    """Read-only view of an index file, shared between workers through mmap"""
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._layout = None
+        self._identity = None
+
+    def _open(self) -> bool:
+        """(Re)map the index if the file was replaced since the last call"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return self._layout is not None
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self._identity:
+            return True
+        with open(self.index_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, data_len, built_at = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            return self._layout is not None
+        # A search still running on the previous mapping keeps its own reference
+        data_start = HEADER.size + count * 8
+        self._layout = Layout(mm, count, built_at, data_start, data_start + data_len, data_len)
+        self._identity = identity
+        return True
+
+    @staticmethod
+    def _offset(layout: 'Layout', i: int) -> int:
+        return struct.unpack_from('<Q', layout.mm, HEADER.size + i * 8)[0]
+
+    def _path_at(self, layout: 'Layout', i: int) -> bytes:
+        start = layout.data_start + self._offset(layout, i)
+        return layout.mm[start:layout.mm.find(b'\0', start)]
+
+    def _range(self, layout: 'Layout', root: Optional[str]):
+        """Data offsets [start, end) covering the paths under root"""
+        count = layout.count
+        if not root:
+            return 0, layout.data_len
+        prefix = os.fsencode(root.rstrip('/')) + b'/'
+
+        def lower_bound(key):
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._path_at(layout, mid) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        first = lower_bound(prefix)
+        # '0' is the byte after '/', so this is the first path past the subtree
+        last = lower_bound(prefix[:-1] + b'0')
+        start = self._offset(layout, first) - 1 if first < count else layout.data_len
+        end = self._offset(layout, last) - 1 if last < count else layout.data_len
+        return start, end
+
+    def search(self, query: str, limit: int = 100, root: Optional[str] = None) -> Dict[str, Any]:
+        """Substring (or glob, if query contains * ? [) match on indexed paths"""
+        with self._lock:
+            if not self._open():
+                return {'results': [], 'truncated': False, 'indexed': 0, 'built_at': None, 'ready': False}
+            layout = self._layout
+        mm = layout.mm
+        lower = layout.lower_start
+        data = layout.data_start
+        start, end = self._range(layout, root)
+
+        if GLOB_CHARS & set(query):
+            hits = self._glob_all(mm, query, lower + start, lower + end)
+        else:
+            hits = self._find_all(mm, fold(os.fsencode(query)), lower + start, lower + end,
+                                  basename='/' not in query)
+
+        results = []
+        truncated = False
+        for hit in hits:
+            if len(results) >= limit:
+                truncated = True
+                break
+            record = mm.rfind(b'\0', lower, hit) + 1
+            record_end = mm.find(b'\0', hit)
+            path = mm[record - lower + data:record_end - lower + data]
+            is_dir = path.endswith(b'/') and len(path) > 1
+            results.append({'path': os.fsdecode(path[:-1] if is_dir else path), 'is_dir': is_dir})
+        return {
+            'results': results,
+            'truncated': truncated,
+            'indexed': layout.count,
+            'built_at': layout.built_at,
+            'ready': True
+        }
+
+    @classmethod
+    def _glob_all(cls, mm, pattern: str, start: int, end: int):
+        """Yield one hit per record matching a glob"""
+        regex = glob_regex(pattern)
+        literal = glob_literal(pattern)
+        if literal:
+            # Only records containing the longest literal run can match
+            candidates = cls._find_all(mm, literal, start, end, basename='/' not in pattern)
+        else:
+            candidates = cls._records(mm, start, end)
+        for position in candidates:
+            record = mm.rfind(b'\0', start, position + 1) + 1
+            record_end = mm.find(b'\0', position, end + 1)
+            if record_end - record > 1 and mm[record_end - 1:record_end] == b'/':
+                record_end -= 1
+            if record_end > record and regex.fullmatch(mm[record:record_end]):
+                yield record
+
+    @staticmethod
+    def _records(mm, start: int, end: int):
+        position = mm.find(b'\0', start, end)
+        while position != -1:
+            yield position + 1
+            position = mm.find(b'\0', position + 1, end)
+
+    @staticmethod
+    def _find_all(mm, needle: bytes, start: int, end: int, basename: bool = True):
+        """Yield one hit per record containing needle (in its basename, if asked)"""
+        if not needle:
+            return
+        position = mm.find(needle, start, end)
+        while position != -1:
+            record_end = mm.find(b'\0', position, end + 1)
+            if record_end == -1:
+                return
+            if basename:
+                name_end = record_end - 1 if mm[record_end - 1:record_end] == b'/' else record_end
+                slash = mm.rfind(b'/', position, name_end)
+                if slash != -1:
+                    # Matched a parent directory; only the basename counts
+                    position = mm.find(needle, slash + 1, end)
+                    continue
+            yield position
+            position = mm.find(needle, record_end, end)
+
+
+class FilenameIndexer:
+    """Crawl roots in the background and keep the index file current
+
+    Only one process (the holder of an flock on '<index>.lock') crawls; other
+    gunicorn workers just map whatever file it last wrote. A rebuild reuses
+    the listing of every directory whose mtime did not change, so after the
+    first crawl only changed directories are read. Up to max_watches of the
+    shallowest directories are also watched through inotify; their changes
+    are applied by update(), which lists just those directories (and any new
+    subtree) and merges the difference into the previous index. Anything
+    deeper is caught by the periodic full pass.
+    """
+
+    def __init__(self, roots: Sequence[str], index_path: str, exclude: Sequence[str] = (),
+                 interval: float = 300.0, debounce: float = 10.0, max_watches: int = 4096,
+                 watch_manager: Optional[WatchManager] = None):
+        self.roots = [os.path.abspath(os.path.expanduser(root)) for root in roots]
+        self.index_path = index_path
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.debounce = debounce
+        self.max_watches = max_watches
+        self.watch_manager = watch_manager
+        self._dirty = threading.Event()
+        self._changed = set()
+        self._overflowed = False
+        self._changed_lock = threading.Lock()
+        self._watched = set()
+        self._state = None
+        self._lock_file = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.last_build = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='filename-indexer', daemon=True)
+                self._thread.start()
+
+    def _acquire(self) -> bool:
+        if self._lock_file is None:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            self._lock_file = open(f'{self.index_path}.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _take_changes(self) -> Optional[set]:
+        """Directories reported changed since the last call, or None if events were lost"""
+        with self._changed_lock:
+            changed = None if self._overflowed else self._changed
+            self._changed = set()
+            self._overflowed = False
+        return changed
+
+    def _run(self):
+        # Workers that lose the race retry now and then in case the builder exits
+        while not self._acquire():
+            time.sleep(self.interval)
+        full = True
+        while True:
+            self._dirty.clear()
+            changed = self._take_changes()
+            try:
+                if full or changed is None:
+                    self.build()
+                else:
+                    self.update(changed)
+            except Exception:
+                logger.exception('Filename index build failed')
+            full = not self._dirty.wait(self.interval)
+            if not full:
+                # Let a burst of changes settle before applying them
+                time.sleep(self.debounce)
+
+    def _load_state(self) -> Dict[bytes, tuple]:
+        if self._state is not None:
+            return self._state
+        try:
+            with open(f'{self.index_path}.state', 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+
+    def _save_state(self, state: Dict[bytes, tuple]):
+        tmp_path = f'{self.index_path}.state.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, f'{self.index_path}.state')
+        self._state = state
+
+    def _load_paths(self) -> Optional[List[bytes]]:
+        """The sorted paths of the current index file"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                magic, count, data_len, _ = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC:
+                    return None
+                f.seek(count * 8, os.SEEK_CUR)
+                data = f.read(data_len)
+        except (OSError, struct.error):
+            return None
+        return data[1:-1].split(b'\0') if count else []
+
+    @staticmethod
+    def _list(directory: bytes):
+        files, subdirs = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        return files, subdirs
+
+    def _crawl(self, start: bytes, device: int, previous: Dict[bytes, tuple], state: Dict[bytes, tuple],
+               paths: List[bytes], watch_candidates: List[bytes]) -> int:
+        """Walk the tree under start into state and paths; returns how many listings were reused"""
+        exclude = {os.fsencode(name) for name in self.exclude}
+        reused = 0
+        queue = deque([start])
+        while queue:
+            # Breadth first, so the watched directories are the shallowest ones
+            directory = queue.popleft()
+            try:
+                stat = os.stat(directory)
+            except OSError:
+                continue
+            if stat.st_dev != device:
+                # Do not wander into other mounts (network shares, /proc, ...)
+                continue
+            cached = previous.get(directory)
+            if cached is not None and cached[0] == stat.st_mtime_ns:
+                files, subdirs = cached[1], cached[2]
+                reused += 1
+            else:
+                try:
+                    files, subdirs = self._list(directory)
+                except OSError:
+                    continue
+            state[directory] = (stat.st_mtime_ns, files, subdirs)
+            if len(watch_candidates) < self.max_watches:
+                watch_candidates.append(directory)
+
+            prefix = directory.rstrip(b'/') + b'/'
+            for name in files:
+                paths.append(prefix + name)
+            for name in subdirs:
+                if name in exclude:
+                    continue
+                paths.append(prefix + name + b'/')
+                queue.append(prefix + name)
+        return reused
+
+    def build(self) -> int:
+        """Crawl the roots and rewrite the index; returns the number of paths"""
+        started = time.monotonic()
+        previous = self._load_state()
+        state = {}
+        paths = []
+        reused = 0
+        watch_candidates = []
+
+        for root in self.roots:
+            root = os.fsencode(root)
+            try:
+                device = os.stat(root).st_dev
+            except OSError:
+                continue
+            paths.append(root + b'/')
+            reused += self._crawl(root, device, previous, state, paths, watch_candidates)
+
+        count = write_index(self.index_path, paths)
+        self._save_state(state)
+        self._update_watches(watch_candidates)
+        self.last_build = {
+            'paths': count,
+            'directories': len(state),
+            'directories_reused': reused,
+            'seconds': round(time.monotonic() - started, 3),
+            'watched': len(self._watched),
+            'incremental': False
+        }
+        logger.info(f'Filename index rebuilt: {self.last_build}')
+        return count
+
+    def update(self, changed: Iterable[bytes]) -> int:
+        """Apply changes inside the given directories to the index; returns the number of paths
+
+        Only those directories are listed again, plus any subdirectory that
+        appeared in them. Falls back to build() without a previous index.
+        """
+        started = time.monotonic()
+        state = self._load_state()
+        paths = self._load_paths()
+        if not state or paths is None:
+            return self.build()
+        try:
+            count, listed = self._apply_changes(state, paths, changed)
+        except BaseException:
+            # The listings may be partly updated; start over from the saved ones
+            self._state = None
+            raise
+        self.last_build = {
+            'paths': count,
+            'directories': len(state),
+            'directories_listed': listed,
+            'seconds': round(time.monotonic() - started, 3),
+            'watched': len(self._watched),
+            'incremental': True
+        }
+        logger.info(f'Filename index updated: {self.last_build}')
+        return count
+
+    def _apply_changes(self, state: Dict[bytes, tuple], paths: List[bytes], changed: Iterable[bytes]):
+        exclude = {os.fsencode(name) for name in self.exclude}
+        added = []
+        removed = set()
+        gone = []
+        new_dirs = []
+        listed = 0
+
+        for directory in sorted(changed):
+            old = state.get(directory)
+            if old is None:
+                # Not indexed (excluded, another mount) or gone with a parent
+                continue
+            try:
+                stat = os.stat(directory)
+                files, subdirs = self._list(directory)
+            except OSError:
+                # Removed; the change is applied when its parent is listed
+                continue
+            listed += 1
+            state[directory] = (stat.st_mtime_ns, files, subdirs)
+            prefix = directory.rstrip(b'/') + b'/'
+            old_files, new_files = set(old[1]), set(files)
+            removed.update(prefix + name for name in old_files - new_files)
+            added.extend(prefix + name for name in new_files - old_files)
+            old_subdirs, new_subdirs = set(old[2]) - exclude, set(subdirs) - exclude
+            for name in old_subdirs - new_subdirs:
+                removed.add(prefix + name + b'/')
+                gone.append(prefix + name + b'/')
+            for name in new_subdirs - old_subdirs:
+                added.append(prefix + name + b'/')
+                self._crawl(prefix + name, stat.st_dev, {}, state, added, new_dirs)
+
+        gone = tuple(gone)
+        if gone:
+            for directory in [directory for directory in state if (directory + b'/').startswith(gone)]:
+                del state[directory]
+        count = len(paths)
+        if added or removed:
+            paths = [path for path in paths if path not in removed and not (gone and path.startswith(gone))]
+            # Both runs are sorted, so write_index's sort only has to merge them
+            paths += sorted(added)
+            count = write_index(self.index_path, paths)
+        self._save_state(state)
+        if gone or new_dirs:
+            watched = [os.fsencode(path) for path in self._watched]
+            self._update_watches([directory for directory in watched if directory in state] + new_dirs)
+        return count, listed
+
+    def _update_watches(self, directories: List[bytes]):
+        if self.watch_manager is None:
+            return
+        wanted = {os.fsdecode(directory) for directory in directories[:self.max_watches]}
+        watched = set()
+        for path in self._watched:
+            if path in wanted:
+                watched.add(path)
+            else:
+                self.watch_manager.unwatch(path, self._on_change)
+        for path in wanted - self._watched:
+            if self.watch_manager.watch(path, self._on_change):
+                watched.add(path)
+            elif self.watch_manager.limit_reached:
+                break
+        self._watched = watched
+
+    def _on_change(self, path: str, events):
+        with self._changed_lock:
+            if any(event.mask & IN_Q_OVERFLOW for event in events):
+                self._overflowed = True
+            else:
+                self._changed.add(os.fsencode(path))
+        self._dirty.set()
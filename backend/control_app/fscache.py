@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from .inotify import IN_Q_OVERFLOW, WatchManager
+
+# Rough per-row overhead of a cached (name, path, is_dir, size, mtime) tuple
+ROW_OVERHEAD = 200
+
+
+class DirectoryCache:
+    """LRU cache of directory listings bounded by an approximate byte budget
+
+    Cached directories are kept exact by an inotify watch each; any create,
+    delete, rename, attribute or content change inside drops the entry.
+    When no watch can be added (no inotify, or the watch limit is used up)
+    the entry is validated against the directory's mtime on every lookup
+    instead, which notices added, removed and renamed entries.
+    """
+
+    def __init__(self, max_bytes: int, watcher: Optional[WatchManager] = None):
+        self.max_bytes = max_bytes
+        self.watcher = watcher
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _validator(path: str):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_ctime_ns
+
+    @staticmethod
+    def _estimate(rows: List[tuple]) -> int:
+        return sum(ROW_OVERHEAD + len(row[0]) + len(row[1]) for row in rows)
+
+    def get(self, path: str, load: Callable[[], List[tuple]]) -> List[tuple]:
+        """Return the cached rows of path, calling load() on a miss"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                rows, size, validator = entry
+                try:
+                    valid = validator is None or validator == self._validator(path)
+                except OSError:
+                    valid = False
+                if valid:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return rows
+                self._drop(path)
+                self.invalidations += 1
+            self.misses += 1
+            generation = self._generations.get(path, 0)
+
+        # Watch before reading so a change during the scan is never missed
+        watched = self.watcher is not None and self.watcher.watch(path, self._on_change)
+        validator = None if watched else self._validator(path)
+        try:
+            rows = load()
+        except Exception:
+            if watched:
+                self.watcher.unwatch(path, self._on_change)
+            raise
+
+        size = self._estimate(rows)
+        with self._lock:
+            if self._generations.get(path, 0) != generation or size > self.max_bytes or path in self._entries:
+                # Changed while loading, too big to keep, or another request won the race
+                if watched:
+                    self.watcher.unwatch(path, self._on_change)
+                return rows
+            self._entries[path] = (rows, size, validator)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+        return rows
+
+    def _drop(self, path: str):
+        """Remove an entry and release its watch; caller holds the lock"""
+        rows, size, validator = self._entries.pop(path)
+        self._bytes -= size
+        if validator is None and self.watcher is not None:
+            self.watcher.unwatch(path, self._on_change)
+
+    def _on_change(self, path: str, events):
+        with self._lock:
+            self._generations[path] = self._generations.get(path, 0) + 1
+            if path in self._entries:
+                self._drop(path)
+                self.invalidations += 1
+            if any(event.mask & IN_Q_OVERFLOW for event in events):
+                # Events were lost; nothing cached can be trusted
+                for other in list(self._entries):
+                    self._drop(other)
+                    self.invalidations += 1
+
+    def invalidate(self, path: str):
+        """Drop the cached listing of path (e.g. after this process changed it)"""
+        with self._lock:
+            self._generations[path] = self._generations.get(path, 0) + 1
+            if path in self._entries:
+                self._drop(path)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'watched': sum(1 for entry in self._entries.values() if entry[2] is None),
+                'mtime_checked': sum(1 for entry in self._entries.values() if entry[2] is not None),
+                'watch_limit_reached': bool(self.watcher and self.watcher.limit_reached)
+            }
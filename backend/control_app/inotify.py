@@ -0,0 +1,222 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from collections import namedtuple
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Everything that changes what a directory listing (or a file's size) looks like
+DEFAULT_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB |
+                IN_MODIFY | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+Event = namedtuple('Event', ['wd', 'mask', 'cookie', 'name'])
+
+_EVENT_HEADER = struct.Struct('iIII')
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def is_available() -> bool:
+    """Whether the platform supports inotify"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class Inotify:
+    """Minimal ctypes binding for one inotify instance"""
+
+    def __init__(self):
+        libc = _get_libc()
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int = DEFAULT_MASK) -> int:
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        _get_libc().inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: Optional[float] = None) -> List[Event]:
+        """Wait up to timeout seconds and return the queued events"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class WatchManager:
+    """Share one inotify watch per path between any number of callbacks
+
+    Callbacks run on the manager's thread as callback(path, events) and must
+    be quick. On a queue overflow every callback is invoked with an event
+    carrying IN_Q_OVERFLOW, meaning "assume anything changed".
+    """
+
+    def __init__(self, mask: int = DEFAULT_MASK):
+        self.mask = mask
+        self._inotify = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._watches = {}
+        self.limit_reached = False
+
+    def _ensure_started(self) -> bool:
+        if self._inotify is not None:
+            return True
+        if not is_available():
+            return False
+        try:
+            self._inotify = Inotify()
+        except OSError as e:
+            logger.warning(f"inotify unavailable: {e}")
+            return False
+        self._thread = threading.Thread(target=self._run, name='inotify-watch', daemon=True)
+        self._thread.start()
+        return True
+
+    def watch(self, path: str, callback: Callable[[str, List[Event]], None]) -> bool:
+        """Subscribe callback to changes of path; returns False if it cannot be watched"""
+        with self._lock:
+            wd = self._paths.get(path)
+            if wd is None:
+                if not self._ensure_started():
+                    return False
+                try:
+                    wd = self._inotify.add_watch(path, self.mask)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        # fs.inotify.max_user_watches exhausted; callers fall back to polling
+                        if not self.limit_reached:
+                            logger.warning("inotify watch limit reached; falling back to mtime checks")
+                        self.limit_reached = True
+                    return False
+                self._paths[path] = wd
+            # Two paths (a symlink and its target) can resolve to one inode and
+            # share a wd; each alias keeps its own callbacks and is reported
+            # under the path it was registered with
+            self._watches.setdefault(wd, {}).setdefault(path, []).append(callback)
+            return True
+
+    def unwatch(self, path: str, callback: Callable[[str, List[Event]], None]):
+        """Drop one subscription; the watch is removed with its last subscriber"""
+        with self._lock:
+            wd = self._paths.get(path)
+            aliases = self._watches.get(wd)
+            if aliases is None:
+                return
+            callbacks = aliases.get(path, [])
+            try:
+                callbacks.remove(callback)
+            except ValueError:
+                pass
+            if callbacks:
+                return
+            aliases.pop(path, None)
+            del self._paths[path]
+            if not aliases:
+                del self._watches[wd]
+                self._inotify.rm_watch(wd)
+                self.limit_reached = False
+
+    def watched_count(self) -> int:
+        return len(self._paths)
+
+    def _run(self):
+        while True:
+            try:
+                events = self._inotify.read_events(timeout=None)
+            except OSError:
+                logger.exception("Failed to read inotify events")
+                continue
+            grouped = {}
+            overflow = False
+            for event in events:
+                if event.mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                grouped.setdefault(event.wd, []).append(event)
+
+            with self._lock:
+                if overflow:
+                    targets = [(path, list(callbacks), [Event(wd, IN_Q_OVERFLOW, 0, '')])
+                               for wd, aliases in self._watches.items()
+                               for path, callbacks in aliases.items()]
+                else:
+                    targets = [(path, list(callbacks), wd_events)
+                               for wd, wd_events in grouped.items()
+                               for path, callbacks in self._watches.get(wd, {}).items()]
+                for wd, wd_events in grouped.items():
+                    # The kernel dropped the watch (path deleted or unmounted)
+                    if any(event.mask & IN_IGNORED for event in wd_events) and wd in self._watches:
+                        for path in self._watches.pop(wd):
+                            self._paths.pop(path, None)
+
+            for path, callbacks, path_events in targets:
+                for callback in callbacks:
+                    try:
+                        callback(path, path_events)
+                    except Exception:
+                        logger.exception(f"inotify callback failed for {path}")
@@ -0,0 +1,348 @@
+import heapq
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import psutil
+
+
+BASIC_FIELDS = ('pid', 'name', 'username', 'cpu_percent', 'memory_percent')
+
+SORT_KEYS = {
+    'cpu': (lambda row: row['cpu_percent'] or 0.0, 'desc'),
+    'mem': (lambda row: row['memory_percent'] or 0.0, 'desc'),
+    'pid': (lambda row: row['pid'], 'asc'),
+    'name': (lambda row: (row['name'] or '').lower(), 'asc'),
+}
+
+
+def query_processes(rows: List[Dict[str, Any]], sort: Optional[str] = None, order: Optional[str] = None,
+                    user: Optional[str] = None, name_pattern: Optional[str] = None,
+                    top: Optional[int] = None, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Filter, sort and page process rows"""
+    if sort is not None and sort not in SORT_KEYS:
+        return {'error': f"Invalid sort '{sort}'", 'sort_keys': list(SORT_KEYS)}
+    if order not in (None, 'asc', 'desc'):
+        return {'error': "order must be 'asc' or 'desc'"}
+
+    if user:
+        rows = [row for row in rows if row.get('username') == user]
+    if name_pattern:
+        try:
+            pattern = re.compile(name_pattern, re.IGNORECASE)
+        except re.error as e:
+            return {'error': f'Invalid name pattern: {e}'}
+        rows = [row for row in rows if row['name'] and pattern.search(row['name'])]
+
+    total = len(rows)
+    if top is not None:
+        # top=N is shorthand for the first page of N, sorted by CPU unless told otherwise
+        sort = sort or 'cpu'
+        offset, limit = 0, top
+    if sort is not None:
+        key, default_order = SORT_KEYS[sort]
+        descending = (order or default_order) == 'desc'
+        if limit is not None:
+            # Only the requested window needs ordering: heap select offset+limit rows
+            select = heapq.nlargest if descending else heapq.nsmallest
+            rows = select(offset + limit, rows, key=key)
+        else:
+            rows = sorted(rows, key=key, reverse=descending)
+
+    end = None if limit is None else offset + limit
+    return {
+        'processes': rows[offset:end],
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    }
+
+
+class ProcessRegistry:
+    """Long-lived psutil.Process objects keyed by (pid, create_time)
+
+    Reusing the same Process object between samples is what makes
+    cpu_percent(interval=None) meaningful: psutil computes it against the
+    CPU times stored on that object by the previous call. Static attributes
+    (name, username) are resolved once per process instead of per request.
+    """
+
+    def __init__(self, min_interval: float = 0.5, warmup: float = 0.1):
+        self.min_interval = min_interval
+        self.warmup = warmup
+        self._entries = {}
+        self._rows = []
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def _entry(self, pid: int, verify: bool = True):
+        """Return the cached entry for pid, replacing it if the PID was reused"""
+        entry = self._entries.get(pid)
+        if entry is not None:
+            if not verify or entry['process'].is_running():
+                return entry
+            del self._entries[pid]
+        process = psutil.Process(pid)
+        with process.oneshot():
+            entry = {
+                'process': process,
+                'key': (pid, process.create_time()),
+                'name': process.name(),
+                'username': self._username(process),
+                'primed': True
+            }
+            # First call only primes the counters
+            process.cpu_percent(interval=None)
+        self._entries[pid] = entry
+        return entry
+
+    @staticmethod
+    def _username(process):
+        try:
+            return process.username()
+        except (psutil.AccessDenied, KeyError):
+            return None
+
+    def get(self, pid: int) -> psutil.Process:
+        """Return the shared Process object for pid"""
+        with self._lock:
+            try:
+                return self._entry(int(pid))['process']
+            except psutil.NoSuchProcess:
+                self._entries.pop(int(pid), None)
+                raise
+
+    def refresh(self, details: bool = False) -> List[Dict[str, Any]]:
+        """Sample every process and evict the ones that exited
+
+        With details=True each row also carries ppid, cmdline, threads and
+        rss, all read inside one oneshot() per process.
+        """
+        with self._lock:
+            now = time.monotonic()
+            fresh = self._refreshed_at is not None and now - self._refreshed_at < self.min_interval
+            if fresh and not details:
+                return self._rows
+            # Reuse recent CPU figures rather than measuring over a few milliseconds
+            recent_cpu = {row['pid']: row['cpu_percent'] for row in self._rows} if fresh else None
+
+            first_run = not self._entries
+            pids = psutil.pids()
+            for pid in pids:
+                try:
+                    # (pid, create_time) is checked once per sample below
+                    self._entry(pid, verify=False)
+                except psutil.Error:
+                    pass
+            if first_run and self.warmup:
+                # Without a short window the very first sample is all zeros
+                time.sleep(self.warmup)
+                for entry in self._entries.values():
+                    entry['primed'] = False
+
+            # memory_percent() reads /proc/meminfo for every process; do it once
+            total_memory = psutil.virtual_memory().total
+            live = set(pids)
+            rows = []
+            for pid, entry in list(self._entries.items()):
+                if pid not in live:
+                    del self._entries[pid]
+                    continue
+                process = entry['process']
+                try:
+                    # create_time() is cached per Process object; a new one reads it again
+                    if psutil.Process(pid).create_time() != entry['key'][1]:
+                        # This PID now belongs to another process
+                        del self._entries[pid]
+                        entry = self._entry(pid, verify=False)
+                        process = entry['process']
+                    with process.oneshot():
+                        if entry['primed']:
+                            # Counters primed during this refresh span no meaningful interval
+                            entry['primed'] = False
+                            cpu_percent = None
+                        elif recent_cpu is not None and pid in recent_cpu:
+                            cpu_percent = recent_cpu[pid]
+                        else:
+                            cpu_percent = process.cpu_percent(interval=None)
+                        rss = process.memory_info().rss
+                        row = {
+                            'pid': pid,
+                            'name': entry['name'],
+                            'username': entry['username'],
+                            'cpu_percent': cpu_percent,
+                            'memory_percent': rss * 100.0 / total_memory if total_memory else 0.0
+                        }
+                        if details:
+                            row['ppid'] = process.ppid()
+                            row['threads'] = process.num_threads()
+                            row['rss'] = rss
+                            try:
+                                row['cmdline'] = ' '.join(process.cmdline())
+                            except psutil.AccessDenied:
+                                row['cmdline'] = ''
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    # Already gone if the PID was reused and the new process exited too
+                    self._entries.pop(pid, None)
+                    continue
+                except psutil.AccessDenied:
+                    continue
+                rows.append(row)
+
+            if details:
+                if not fresh:
+                    self._rows = [{field: row[field] for field in BASIC_FIELDS} for row in rows]
+                    self._refreshed_at = time.monotonic()
+            else:
+                self._rows = rows
+                self._refreshed_at = time.monotonic()
+            return rows
+
+
+def build_process_tree(rows: List[Dict[str, Any]], root: Optional[int] = None,
+                       max_depth: Optional[int] = None) -> Dict[str, Any]:
+    """Build a parent/child tree from detailed process rows
+
+    Every node carries 'totals' for its whole subtree (cpu_percent, rss,
+    threads, processes), so a client can collapse any subtree and still
+    show what it costs. Nodes deeper than max_depth are left out; their
+    parent is marked 'collapsed' with the number of direct children.
+    """
+    nodes = {row['pid']: dict(row) for row in rows}
+    children = {}
+    roots = []
+    for pid, node in nodes.items():
+        ppid = node.get('ppid')
+        if ppid in nodes and ppid != pid:
+            children.setdefault(ppid, []).append(pid)
+        else:
+            roots.append(pid)
+
+    if root is not None:
+        if root not in nodes:
+            return {'error': f'Process {root} not found'}
+        roots = [root]
+
+    # Iterative DFS: parents are listed before their children, so walking the
+    # order backwards folds every subtree into its parent in one pass
+    order = []
+    depth = {pid: 0 for pid in roots}
+    stack = sorted(roots, reverse=True)
+    while stack:
+        pid = stack.pop()
+        order.append(pid)
+        for child in sorted(children.get(pid, ()), reverse=True):
+            if child not in depth:
+                depth[child] = depth[pid] + 1
+                stack.append(child)
+
+    for pid in reversed(order):
+        node = nodes[pid]
+        totals = {
+            'cpu_percent': node.get('cpu_percent') or 0.0,
+            'rss': node.get('rss') or 0,
+            'threads': node.get('threads') or 0,
+            'processes': 1
+        }
+        kids = [nodes[child] for child in sorted(children.get(pid, ())) if child in depth]
+        for child in kids:
+            for field, value in child['totals'].items():
+                totals[field] += value
+        totals['cpu_percent'] = round(totals['cpu_percent'], 1)
+        node['totals'] = totals
+        if max_depth is not None and depth[pid] >= max_depth:
+            node['children'] = []
+            node['collapsed'] = bool(kids)
+            node['child_count'] = len(kids)
+        else:
+            node['children'] = kids
+
+    return {
+        'tree': [nodes[pid] for pid in sorted(roots)],
+        'count': len(order)
+    }
+
+
+class ProcessSnapshotLog:
+    """Keep recent versions of the process table to answer delta requests
+
+    Versions look like '<epoch>-<n>'. The epoch is random per worker process,
+    so a version issued by another gunicorn worker (or before a restart) is
+    never mistaken for a local one and simply yields a full snapshot.
+    """
+
+    def __init__(self, collect: Callable[[], List[Dict[str, Any]]], history: int = 16,
+                 min_interval: float = 1.0):
+        self.collect = collect
+        self.history = history
+        self.min_interval = min_interval
+        self.epoch = uuid.uuid4().hex[:8]
+        self._counter = 0
+        self._snapshots = OrderedDict()
+        self._taken_at = 0.0
+        self._lock = threading.Lock()
+
+    def _normalise(self, rows: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        table = {}
+        for row in rows:
+            row = dict(row)
+            # Round away jitter that would otherwise show up as a change on every poll
+            if row.get('cpu_percent') is not None:
+                row['cpu_percent'] = round(row['cpu_percent'], 1)
+            if row.get('memory_percent') is not None:
+                row['memory_percent'] = round(row['memory_percent'], 2)
+            table[row['pid']] = row
+        return table
+
+    def current(self):
+        """Return (version, table), collecting a new snapshot if the last one is stale"""
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshots and now - self._taken_at < self.min_interval:
+                version = next(reversed(self._snapshots))
+                return version, self._snapshots[version]
+            table = self._normalise(self.collect())
+            self._counter += 1
+            version = f'{self.epoch}-{self._counter}'
+            self._snapshots[version] = table
+            self._taken_at = now
+            while len(self._snapshots) > self.history:
+                self._snapshots.popitem(last=False)
+            return version, table
+
+    def changes(self, since: Optional[str] = None) -> Dict[str, Any]:
+        """Return what changed since a version, or a full snapshot if it is unknown"""
+        version, table = self.current()
+        with self._lock:
+            previous = self._snapshots.get(since) if since else None
+
+        if previous is None:
+            return {
+                'version': version,
+                'full': True,
+                'processes': list(table.values())
+            }
+
+        added = []
+        changed = []
+        for pid, row in table.items():
+            old = previous.get(pid)
+            if old is None:
+                added.append(row)
+            elif old != row:
+                diff = {'pid': pid}
+                diff.update((field, value) for field, value in row.items() if old.get(field) != value)
+                changed.append(diff)
+        removed = [pid for pid in previous if pid not in table]
+
+        return {
+            'version': version,
+            'since': since,
+            'full': False,
+            'added': added,
+            'removed': removed,
+            'changed': changed
+        }
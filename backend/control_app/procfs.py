@@ -0,0 +1,149 @@
+import os
+import pwd
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# (pid, name, state, ppid, cpu_ticks, starttime, vms_pages, rss_pages)
+ProcRow = Tuple[int, str, str, int, int, int, int, int]
+
+
+def is_available(proc_root: str = '/proc') -> bool:
+    """Check whether a Linux-style /proc is mounted"""
+    return os.path.exists(os.path.join(proc_root, 'self', 'stat'))
+
+
+def _read(path: str) -> bytes:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+
+def parse_stat(data: bytes) -> Tuple[str, str, int, int, int]:
+    """Parse /proc/[pid]/stat into (name, state, ppid, cpu_ticks, starttime)"""
+    # comm may itself contain spaces and parentheses; it ends at the last ')'
+    open_paren = data.find(b'(')
+    close_paren = data.rfind(b')')
+    name = data[open_paren + 1:close_paren].decode('utf-8', 'replace')
+    fields = data[close_paren + 2:].split(None, 20)
+    return (
+        name,
+        fields[0].decode(),
+        int(fields[1]),
+        int(fields[11]) + int(fields[12]),
+        int(fields[19])
+    )
+
+
+def read_proc_table(proc_root: str = '/proc') -> List[ProcRow]:
+    """Read stat and statm for every process into compact tuples"""
+    rows = []
+    append = rows.append
+    with os.scandir(proc_root) as entries:
+        for entry in entries:
+            name = entry.name
+            if not name.isdigit():
+                continue
+            base = entry.path
+            try:
+                stat = _read(base + '/stat')
+                statm = _read(base + '/statm')
+            except OSError:
+                # The process exited between listing and reading
+                continue
+            comm, state, ppid, ticks, starttime = parse_stat(stat)
+            vms, rss = statm.split(None, 2)[:2]
+            append((int(name), comm, state, ppid, ticks, starttime, int(vms), int(rss)))
+    return rows
+
+
+def read_total_memory(proc_root: str = '/proc') -> int:
+    """Read MemTotal from /proc/meminfo in bytes"""
+    with open(os.path.join(proc_root, 'meminfo'), 'rb') as f:
+        for line in f:
+            if line.startswith(b'MemTotal:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class ProcfsSampler:
+    """Process list backed by read_proc_table with CPU% from consecutive samples"""
+
+    def __init__(self, proc_root: str = '/proc', min_interval: float = 0.5, warmup: float = 0.1):
+        self.proc_root = proc_root
+        self.min_interval = min_interval
+        self.warmup = warmup
+        self._previous = {}
+        self._previous_at = None
+        self._owners = {}
+        self._usernames = {}
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def _username(self, pid: int, starttime: int):
+        key = (pid, starttime)
+        uid = self._owners.get(key)
+        if uid is None:
+            try:
+                uid = os.stat(f'{self.proc_root}/{pid}').st_uid
+            except OSError:
+                return None
+            self._owners[key] = uid
+        name = self._usernames.get(uid)
+        if name is None:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = str(uid)
+            self._usernames[uid] = name
+        return name
+
+    def _sample(self):
+        table = read_proc_table(self.proc_root)
+        return table, time.monotonic()
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        """Return rows shaped like ProcessRegistry.refresh()"""
+        with self._lock:
+            now = time.monotonic()
+            if self._previous_at is not None and now - self._previous_at < self.min_interval:
+                return self._rows
+            if self._previous_at is None and self.warmup:
+                table, sampled_at = self._sample()
+                self._previous = {(row[0], row[5]): row[4] for row in table}
+                self._previous_at = sampled_at
+                time.sleep(self.warmup)
+
+            table, sampled_at = self._sample()
+            total_memory = read_total_memory(self.proc_root)
+            elapsed = sampled_at - self._previous_at if self._previous_at is not None else 0.0
+            previous = self._previous
+            ticks_to_percent = 100.0 / (CLOCK_TICKS * elapsed) if elapsed > 0 else 0.0
+            memory_scale = PAGE_SIZE * 100.0 / total_memory if total_memory else 0.0
+
+            current = {}
+            rows = []
+            for pid, name, state, ppid, ticks, starttime, vms, rss in table:
+                key = (pid, starttime)
+                current[key] = ticks
+                before = previous.get(key)
+                rows.append({
+                    'pid': pid,
+                    'name': name,
+                    'username': self._username(pid, starttime),
+                    'cpu_percent': (ticks - before) * ticks_to_percent if before is not None else 0.0,
+                    'memory_percent': rss * memory_scale
+                })
+
+            # Drop owner cache entries of processes that are gone
+            if len(self._owners) > len(current):
+                self._owners = {key: uid for key, uid in self._owners.items() if key in current}
+            self._previous = current
+            self._previous_at = sampled_at
+            self._rows = rows
+            return rows
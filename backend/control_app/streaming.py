@@ -0,0 +1,93 @@
+"""Make streaming responses stream under both WSGI and ASGI
+
+Django serves a synchronous iterator under ASGI, and an asynchronous one
+under WSGI, by collecting it into a list first: a 20 GB archive would be
+built in memory and an endless event stream would never send a byte.
+stream_content() converts a response body to the kind the server consumes,
+one chunk at a time.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIRequest
+
+_DONE = object()
+
+
+async def iterate_in_thread(iterator):
+    """Async iterator over a sync one; each step runs off the event loop
+
+    A single worker thread per stream keeps the steps in order and makes
+    the final close() (client gone, or finished) wait for a step in flight
+    instead of failing with "generator already executing".
+    """
+    iterator = iter(iterator)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stream')
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            executor.submit(close)
+        executor.shutdown(wait=False)
+
+
+def iterate_on_loop(aiterator):
+    """Sync iterator over an async one, driven by an event loop on its own thread"""
+    aiterator = aiter(aiterator)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name='stream-loop', daemon=True)
+    thread.start()
+
+    async def step():
+        try:
+            return await aiterator.__anext__()
+        except StopAsyncIteration:
+            return _DONE
+
+    try:
+        while True:
+            chunk = asyncio.run_coroutine_threadsafe(step(), loop).result()
+            if chunk is _DONE:
+                return
+            yield chunk
+    finally:
+        aclose = getattr(aiterator, 'aclose', None)
+        if aclose is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(aclose(), loop).result(timeout=5)
+            except Exception:
+                pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def _under_asgi(request) -> bool:
+    # DRF wraps the Django request
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def stream_content(request, content):
+    """Wrap a response body so the server serving request consumes it incrementally
+
+    Call it on the generator before building the response: the response
+    then closes the wrapper, which closes the generator in the right thread.
+    """
+    is_async = hasattr(content, '__aiter__')
+    if _under_asgi(request):
+        return content if is_async else iterate_in_thread(content)
+    return iterate_on_loop(content) if is_async else content
+
+
+def adapt_stream(request, response):
+    """The same for a FileResponse, whose file the response closes itself"""
+    if response.streaming and not response.is_async and _under_asgi(request):
+        response.streaming_content = iterate_in_thread(response.streaming_content)
+    return response
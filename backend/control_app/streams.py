@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+
+from .agent import (
+    get_system_info,
+    get_running_processes,
+    get_active_windows,
+    get_music_players,
+    watch_manager,
+)
+from .dirwatch import DirectoryWatcher
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Per-client mailbox holding the newest frame of each subscribed topic"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, topics: Iterable[str]):
+        self.loop = loop
+        self.topics = frozenset(topics)
+        self._pending = {}
+        self._event = asyncio.Event()
+
+    def _deliver(self, topic: str, frame: bytes):
+        # Runs on the event loop; a slow client only ever sees the latest frame
+        self._pending[topic] = frame
+        self._event.set()
+
+    def offer(self, topic: str, frame: bytes):
+        """Hand a frame over from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, topic, frame)
+        except RuntimeError:
+            # The client's loop is already closed
+            pass
+
+    async def get(self, timeout: Optional[float] = None) -> Dict[str, bytes]:
+        """Wait for frames; returns an empty dict on timeout"""
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return {}
+        self._event.clear()
+        frames, self._pending = self._pending, {}
+        return frames
+
+
+class TopicHub:
+    """Collect each topic once per interval and fan it out to every subscriber"""
+
+    def __init__(self, collectors: Dict[str, Callable[[], Any]], interval: Optional[float] = None):
+        self.collectors = collectors
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._last_frames = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def interval(self) -> float:
+        if self._interval is None:
+            self._interval = float(getattr(settings, 'STREAM_INTERVAL',
+                                           getattr(settings, 'TELEMETRY_INTERVAL', 2.0)))
+        return self._interval
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """Subscribe the running event loop to topics"""
+        unknown = set(topics) - set(self.collectors)
+        if unknown:
+            raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+        subscription = Subscription(asyncio.get_running_loop(), topics)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            last_frames = dict(self._last_frames)
+            self._ensure_thread()
+        # New clients get the last known state straight away
+        for topic in subscription.topics:
+            if topic in last_frames:
+                subscription.offer(topic, last_frames[topic])
+        if not subscription.topics <= set(last_frames):
+            self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, topic: str, payload: Any):
+        """Encode payload once and offer it to every subscriber of topic"""
+        frame = f"event: {topic}\ndata: {json.dumps(payload, default=str)}\n\n".encode()
+        with self._lock:
+            if self._last_frames.get(topic) == frame:
+                return
+            self._last_frames[topic] = frame
+            subscribers = [s for s in self._subscriptions if topic in s.topics]
+        for subscription in subscribers:
+            subscription.offer(topic, frame)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='topic-hub', daemon=True)
+            self._thread.start()
+
+    def _active_topics(self):
+        with self._lock:
+            topics = set()
+            for subscription in self._subscriptions:
+                topics |= subscription.topics
+            if not self._subscriptions:
+                self._last_frames.clear()
+            return topics
+
+    def _run(self):
+        while True:
+            topics = self._active_topics()
+            if not topics:
+                # Nobody listening: sleep until the next subscribe
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            started = time.monotonic()
+            for topic in topics:
+                try:
+                    self.publish(topic, self.collectors[topic]())
+                except Exception:
+                    logger.exception(f"Failed to collect stream topic {topic}")
+            self._wakeup.wait(max(0.0, self.interval - (time.monotonic() - started)))
+            self._wakeup.clear()
+
+
+hub = TopicHub({
+    'system': get_system_info,
+    'processes': get_running_processes,
+    'active_windows': get_active_windows,
+    'music': get_music_players,
+})
+
+directory_watcher = DirectoryWatcher(watch_manager, getattr(settings, 'WATCH_DEBOUNCE', 0.1))
@@ -0,0 +1,462 @@
+"""Directory sync: manifests with cached hashes, diffs and journaled batch apply
+
+A sync round is three calls. The client fetches (or skips) the host's
+manifest, posts its own manifest to get a plan, then posts the plan with
+the new file contents in one multipart request. The plan is applied as a
+unit. Everything is first staged in a directory inside the sync root (so
+every move is a same-filesystem rename), and the moves that touch the live
+tree are journaled: a failure, or a crash picked up by the next sync of
+that root, undoes them in reverse. Applies to one root hold its lock file
+from the conflict check to the commit, so they run one at a time.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .uploads import BLOCK_SIZE, UploadError
+
+STAGING_PREFIX = '.shellsync-sync-'
+# Starts with STAGING_PREFIX so walks and client paths already leave it out
+LOCK_NAME = STAGING_PREFIX + 'lock'
+JOURNAL = 'journal'
+COMMITTED = 'committed'
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _identity(stat: os.stat_result) -> Tuple[int, int, int, int]:
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+@contextmanager
+def root_lock(root: str, blocking: bool = True):
+    """Hold root's sync lock; yields False when non-blocking and another apply has it"""
+    with open(os.path.join(root, LOCK_NAME), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def clean_relative_path(path: str) -> str:
+    """Normalize a client path relative to the sync root, rejecting anything that escapes it"""
+    if not isinstance(path, str) or not path or '\0' in path or path.startswith('/'):
+        raise UploadError(f'Invalid path {path!r}')
+    normalized = os.path.normpath(path)
+    parts = normalized.split('/')
+    if normalized == '.' or '..' in parts or parts[0].startswith(STAGING_PREFIX):
+        raise UploadError(f'Invalid path {path!r}')
+    return normalized
+
+
+class HashIndex:
+    """Persistent sha256 cache keyed by path, valid while dev/ino/size/mtime match"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=30) as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, '
+                           'size INTEGER, mtime_ns INTEGER, sha256 TEXT)')
+            self._ready = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def under(self, root: str) -> Dict[str, Tuple[Tuple[int, int, int, int], str]]:
+        prefix = root.rstrip('/') + '/'
+        with self._connect() as db:
+            rows = db.execute('SELECT path, dev, ino, size, mtime_ns, sha256 FROM hashes '
+                              'WHERE path >= ? AND path < ?', (prefix, prefix[:-1] + '0')).fetchall()
+        return {path: ((dev, ino, size, mtime_ns), sha256) for path, dev, ino, size, mtime_ns, sha256 in rows}
+
+    def update(self, entries: Iterable[Tuple[str, os.stat_result, str]], removed: Iterable[str] = ()):
+        with self._connect() as db:
+            db.executemany('DELETE FROM hashes WHERE path = ?', ((path,) for path in removed))
+            db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                           ((path, *_identity(stat), sha256) for path, stat, sha256 in entries))
+
+
+class DirectorySync:
+    def __init__(self, index_path: str, workers: int = 4):
+        self.index = HashIndex(os.path.expanduser(index_path))
+        self.workers = workers
+
+    def _walk(self, root: str):
+        """Yield (relative path, DirEntry) for directories and regular files; symlinks are skipped"""
+        stack = ['']
+        while stack:
+            relative = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(root, relative) if relative else root))
+            except OSError:
+                continue
+            for entry in entries:
+                if not relative and entry.name.startswith(STAGING_PREFIX):
+                    continue
+                path = os.path.join(relative, entry.name) if relative else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield path, entry
+                        stack.append(path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield path, entry
+                except OSError:
+                    continue
+
+    def manifest(self, root: str) -> Dict[str, Any]:
+        """Every directory and file under root with size, mtime and sha256
+
+        Hashes come from the index unless the file changed since it was
+        hashed; changed files are hashed on a thread pool.
+        """
+        root = os.path.abspath(os.path.expanduser(root))
+        if not os.path.isdir(root):
+            raise UploadError('Path is not a directory', 404)
+        self.recover(root)
+        cached = self.index.under(root)
+        entries = []
+        stale = []
+        for path, entry in self._walk(root):
+            if entry.is_dir(follow_symlinks=False):
+                entries.append({'path': path, 'type': 'dir'})
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            item = {'path': path, 'type': 'file', 'size': stat.st_size, 'mtime': stat.st_mtime_ns / 1e9}
+            known = cached.get(entry.path)
+            if known and known[0] == _identity(stat):
+                item['sha256'] = known[1]
+            else:
+                stale.append((item, entry.path, stat))
+            entries.append(item)
+
+        def hash_entry(job):
+            item, path, stat = job
+            try:
+                return job, hash_file(path)
+            except OSError:
+                return job, None
+
+        fresh = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (item, path, stat), sha256 in pool.map(hash_entry, stale):
+                item['sha256'] = sha256
+                if sha256 is not None:
+                    fresh.append((path, stat, sha256))
+        seen = {os.path.join(root, item['path']) for item in entries}
+        self.index.update(fresh, removed=[path for path in cached if path not in seen])
+        entries = [item for item in entries if item['type'] == 'dir' or item['sha256'] is not None]
+        entries.sort(key=lambda item: item['path'])
+        return {'root': root, 'entries': entries, 'hashed': len(fresh)}
+
+    def diff(self, root: str, client_entries: List[Dict[str, Any]], delete: bool = True) -> Dict[str, Any]:
+        """Plan that turns root into the client's tree, reusing content already on the host
+
+        Files whose content exists elsewhere under root are renamed (if the
+        old path goes away) or copied instead of uploaded. `expect` holds
+        the hashes the plan was computed against; apply refuses to run if
+        any of those files has changed since.
+        """
+        manifest = self.manifest(root)
+        server = {item['path']: item for item in manifest['entries']}
+        client = {}
+        for item in client_entries:
+            path = clean_relative_path(item.get('path'))
+            if item.get('type', 'file') == 'dir':
+                client[path] = {'path': path, 'type': 'dir'}
+            else:
+                sha256 = str(item.get('sha256', '')).lower()
+                if len(sha256) != 64:
+                    raise UploadError(f'{path}: sha256 is required for files')
+                client[path] = {'path': path, 'type': 'file', 'sha256': sha256,
+                                'size': int(item.get('size', 0)), 'mtime': item.get('mtime')}
+        for path in list(client):
+            # Parents of client files are implied directories
+            parent = os.path.dirname(path)
+            while parent and parent not in client:
+                client[parent] = {'path': parent, 'type': 'dir'}
+                parent = os.path.dirname(parent)
+
+        by_hash = {}
+        for item in server.values():
+            if item['type'] == 'file':
+                by_hash.setdefault(item['sha256'], []).append(item['path'])
+
+        mkdir, upload, copy, rename, removals = [], [], [], [], set()
+        expect = {}
+        renamed = set()
+        for path, item in sorted(client.items()):
+            existing = server.get(path)
+            if item['type'] == 'dir':
+                if existing is None:
+                    mkdir.append(path)
+                elif existing['type'] == 'file':
+                    removals.add(path)
+                    expect[path] = existing['sha256']
+                    mkdir.append(path)
+                continue
+            if existing is not None and existing['type'] == 'file' and existing['sha256'] == item['sha256']:
+                continue
+            if existing is not None and existing['type'] == 'dir':
+                removals.add(path)
+            elif existing is not None:
+                # Replaced in place; apply keeps the old copy until the batch commits
+                expect[path] = existing['sha256']
+            sources = by_hash.get(item['sha256'], [])
+            movable = [source for source in sources
+                       if delete and source not in client and source not in renamed]
+            if movable:
+                renamed.add(movable[0])
+                rename.append([movable[0], path])
+                expect[movable[0]] = item['sha256']
+            elif sources:
+                copy.append([sources[0], path])
+                expect[sources[0]] = item['sha256']
+            else:
+                upload.append({'path': path, 'sha256': item['sha256'], 'size': item['size'],
+                               'mtime': item['mtime']})
+
+        delete_paths = []
+        if delete:
+            for path, existing in server.items():
+                if path not in client and path not in renamed:
+                    removals.add(path)
+                    if existing['type'] == 'file':
+                        expect[path] = existing['sha256']
+        # Renamed-away files are removed by the rename itself
+        for path in sorted(removals):
+            parent = os.path.dirname(path)
+            while parent and parent not in removals:
+                parent = os.path.dirname(parent)
+            if not parent:
+                delete_paths.append(path)
+
+        return {
+            'path': manifest['root'],
+            'mkdir': mkdir,
+            'upload': upload,
+            'copy': copy,
+            'rename': rename,
+            'delete': delete_paths,
+            'expect': expect,
+            'upload_bytes': sum(item['size'] for item in upload),
+        }
+
+    def recover(self, root: str):
+        """Roll back (or finish cleaning up) applies that were interrupted under root"""
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return
+        if not any(name.startswith(STAGING_PREFIX) and name != LOCK_NAME for name in names):
+            # Nothing to recover; reading a root must not leave a lock file in it
+            return
+        try:
+            with root_lock(root, blocking=False) as locked:
+                # A running apply recovers the root itself before it starts
+                if locked:
+                    self._recover(root)
+        except OSError:
+            # Read-only root: nothing can have been applied there
+            return
+
+    def _recover(self, root: str):
+        """recover() for a caller holding the root lock: every staging directory is an orphan"""
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return
+        for name in names:
+            staging = os.path.join(root, name)
+            if not name.startswith(STAGING_PREFIX) or name == LOCK_NAME:
+                continue
+            if not os.path.exists(os.path.join(staging, COMMITTED)):
+                self._undo(staging)
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _undo(self, staging: str):
+        try:
+            with open(os.path.join(staging, JOURNAL)) as f:
+                records = [json.loads(line) for line in f if line.endswith('\n')]
+        except FileNotFoundError:
+            return
+        for kind, source, target in reversed(records):
+            try:
+                if kind == 'move' and os.path.lexists(target):
+                    os.rename(target, source)
+                elif kind == 'mkdir':
+                    os.rmdir(source)
+            except OSError:
+                continue
+
+    def apply(self, root: str, plan: Dict[str, Any], files: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a diff() plan; files maps each uploaded path to an iterable of byte chunks
+
+        Nothing in the live tree is touched until every upload is staged and
+        checked against its sha256 and every expected hash still matches.
+        """
+        root = os.path.abspath(os.path.expanduser(root))
+        if not os.path.isdir(root):
+            raise UploadError('Path is not a directory', 404)
+        with root_lock(root):
+            return self._apply(root, plan, files)
+
+    def _apply(self, root: str, plan: Dict[str, Any], files: Dict[str, Any]) -> Dict[str, Any]:
+        self._recover(root)
+
+        mkdir = [clean_relative_path(path) for path in plan.get('mkdir', [])]
+        upload = [dict(item, path=clean_relative_path(item.get('path'))) for item in plan.get('upload', [])]
+        copy = [(clean_relative_path(source), clean_relative_path(target)) for source, target in plan.get('copy', [])]
+        rename = [(clean_relative_path(source), clean_relative_path(target))
+                  for source, target in plan.get('rename', [])]
+        delete = [clean_relative_path(path) for path in plan.get('delete', [])]
+        expect = {clean_relative_path(path): str(sha256).lower() for path, sha256 in plan.get('expect', {}).items()}
+        missing = [item['path'] for item in upload if item['path'] not in files]
+        if missing:
+            raise UploadError('Files missing from the request', 400, missing=missing)
+
+        # Conflict check against the state the plan was computed from
+        cached = self.index.under(root)
+        conflicts = []
+        for path, sha256 in expect.items():
+            absolute = os.path.join(root, path)
+            try:
+                stat = os.stat(absolute)
+                known = cached.get(absolute)
+                current = known[1] if known and known[0] == _identity(stat) else hash_file(absolute)
+            except OSError:
+                current = None
+            if current != sha256:
+                conflicts.append(path)
+        # Everything else the plan places must still be absent, unless the plan deletes
+        # it first (a directory replaced by a file)
+        deleted = set(delete)
+
+        def is_deleted(path):
+            while path:
+                if path in deleted:
+                    return True
+                path = os.path.dirname(path)
+            return False
+
+        for target in [item['path'] for item in upload] + [target for _, target in copy + rename]:
+            if target not in expect and os.path.lexists(os.path.join(root, target)) and not is_deleted(target):
+                conflicts.append(target)
+        if conflicts:
+            raise UploadError('Files changed since the plan was made', 409, conflicts=conflicts)
+
+        staging = os.path.join(root, f'{STAGING_PREFIX}{uuid.uuid4().hex}')
+        os.mkdir(staging, 0o700)
+        journal = open(os.path.join(staging, JOURNAL), 'w')
+        placed = []
+        moves = 0
+
+        def record(kind, source, target=None):
+            journal.write(json.dumps([kind, source, target]) + '\n')
+            journal.flush()
+
+        def move(source, target):
+            nonlocal moves
+            record('move', source, target)
+            os.rename(source, target)
+            moves += 1
+
+        def stage_path():
+            return os.path.join(staging, f'{len(placed)}-{uuid.uuid4().hex}')
+
+        try:
+            # Stage: uploads and copies land in the staging directory first
+            for item in upload:
+                staged = stage_path()
+                digest = hashlib.sha256()
+                with open(staged, 'wb') as f:
+                    for chunk in files[item['path']]:
+                        digest.update(chunk)
+                        f.write(chunk)
+                if digest.hexdigest() != item['sha256']:
+                    raise UploadError(f"{item['path']}: checksum mismatch", 422,
+                                      expected=item['sha256'], actual=digest.hexdigest())
+                if item.get('mtime') is not None:
+                    mtime_ns = int(float(item['mtime']) * 1e9)
+                    os.utime(staged, ns=(mtime_ns, mtime_ns))
+                placed.append((staged, item['path'], item['sha256']))
+            for source, target in copy:
+                staged = stage_path()
+                shutil.copy2(os.path.join(root, source), staged)
+                placed.append((staged, target, expect.get(source)))
+
+            # Commit: every change to the live tree is a journaled rename
+            for index, (source, target) in enumerate(rename):
+                staged = os.path.join(staging, f'rename-{index}')
+                move(os.path.join(root, source), staged)
+                placed.append((staged, target, expect.get(source)))
+            for index, path in enumerate(delete):
+                absolute = os.path.join(root, path)
+                if os.path.lexists(absolute):
+                    move(absolute, os.path.join(staging, f'delete-{index}'))
+            for path in mkdir + [os.path.dirname(target) for _, target, _ in placed]:
+                missing_dirs = []
+                parent = path
+                while parent and not os.path.isdir(os.path.join(root, parent)):
+                    missing_dirs.append(parent)
+                    parent = os.path.dirname(parent)
+                for directory in reversed(missing_dirs):
+                    record('mkdir', os.path.join(root, directory))
+                    os.mkdir(os.path.join(root, directory))
+            for staged, target, _ in placed:
+                absolute = os.path.join(root, target)
+                if os.path.isdir(absolute) and not os.path.islink(absolute):
+                    raise UploadError(f'{target}: a directory is in the way', 409)
+                if os.path.lexists(absolute):
+                    # Overwritten files go to the staging directory so they can be restored
+                    move(absolute, stage_path() + '-old')
+                move(staged, absolute)
+            open(os.path.join(staging, COMMITTED), 'w').close()
+        except BaseException:
+            self._undo(staging)
+            shutil.rmtree(staging, ignore_errors=True)
+            journal.close()
+            raise
+        shutil.rmtree(staging, ignore_errors=True)
+        journal.close()
+
+        # Hashes of everything placed are already known
+        indexed = []
+        for _, target, sha256 in placed:
+            absolute = os.path.join(root, target)
+            if sha256:
+                indexed.append((absolute, os.stat(absolute), sha256))
+        self.index.update(indexed)
+        return {
+            'status': 'success',
+            'uploaded': len(upload),
+            'copied': len(copy),
+            'renamed': len(rename),
+            'deleted': len(delete),
+            'created_dirs': len(mkdir),
+            'moves': moves,
+        }
@@ -0,0 +1,153 @@
+import asyncio
+import codecs
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from .inotify import WatchManager
+
+BLOCK_SIZE = 64 * 1024
+
+
+def read_last_lines(fd: int, size: int, count: int, max_bytes: int) -> Tuple[bytes, int]:
+    """Return (data, offset) holding the last `count` lines, reading backwards from EOF"""
+    if count <= 0 or size == 0:
+        return b'', size
+    position = size
+    chunks = []
+    newlines = 0
+    # A newline that ends the file terminates the last line rather than starting a new one
+    wanted = count + (1 if os.pread(fd, 1, size - 1) == b'\n' else 0)
+    while position > 0 and size - position < max_bytes:
+        step = min(BLOCK_SIZE, position)
+        position -= step
+        chunk = os.pread(fd, step, position)
+        chunks.append(chunk)
+        newlines += chunk.count(b'\n')
+        if newlines >= wanted:
+            break
+    data = b''.join(reversed(chunks))
+    extra = newlines - wanted
+    if extra >= 0:
+        # Drop whole lines before the first one asked for
+        cut = -1
+        for _ in range(extra + 1):
+            cut = data.index(b'\n', cut + 1)
+        data = data[cut + 1:]
+        position = size - len(data)
+    if len(data) > max_bytes:
+        data = data[-max_bytes:]
+        position = size - len(data)
+    return data, position
+
+
+class FileFollower:
+    """Follow a file like `tail -F`, yielding appended text in batches
+
+    The parent directory is watched rather than the file itself, so the
+    follower also notices the file being replaced (log rotation) or
+    recreated. Without inotify it polls every `poll_interval` seconds.
+    """
+
+    def __init__(self, path: str, offset: int, watch_manager: Optional[WatchManager] = None,
+                 poll_interval: float = 1.0, batch_interval: float = 0.2, max_batch: int = 256 * 1024):
+        self.path = path
+        self.offset = offset
+        self.watch_manager = watch_manager
+        self.poll_interval = poll_interval
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self._directory = os.path.dirname(path) or '.'
+        self._name = os.path.basename(path)
+        self._file = None
+        self._inode = None
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._loop = None
+        self._wakeup = None
+        self.watching = False
+
+    def _on_events(self, path: str, events):
+        if any(event.name == self._name or not event.name for event in events):
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _read_available(self, fd: int) -> bytes:
+        size = os.fstat(fd).st_size
+        if size <= self.offset:
+            return b''
+        data = os.pread(fd, min(size - self.offset, self.max_batch), self.offset)
+        self.offset += len(data)
+        return data
+
+    def _check(self):
+        """Return (events, more_pending) describing what changed since the last check"""
+        events = []
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+
+        if self._file is None:
+            if stat is None:
+                return events, False
+            self._open()
+            self.offset = 0
+            events.append({'type': 'reopened'})
+        elif stat is None or stat.st_ino != self._inode:
+            # Rotated: drain what was written to the old file, then switch over
+            data = self._read_available(self._file.fileno())
+            if data:
+                events.append({'type': 'data', 'text': self._decoder.decode(data), 'offset': self.offset})
+                return events, True
+            self._file.close()
+            self._file = None
+            self._decoder.reset()
+            events.append({'type': 'rotated'})
+            if stat is not None:
+                self._open()
+                self.offset = 0
+        elif stat.st_size < self.offset:
+            events.append({'type': 'truncated', 'size': stat.st_size})
+            self.offset = 0
+            self._decoder.reset()
+
+        if self._file is None:
+            return events, False
+        data = self._read_available(self._file.fileno())
+        if data:
+            events.append({'type': 'data', 'text': self._decoder.decode(data), 'offset': self.offset})
+        return events, len(data) == self.max_batch
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield event dicts until the consumer stops iterating"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._open()
+        if self.watch_manager is not None:
+            self.watching = self.watch_manager.watch(self._directory, self._on_events)
+        try:
+            more = True
+            while True:
+                if not more:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                        # Let a burst of writes accumulate into one batch
+                        await asyncio.sleep(self.batch_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                events, more = self._check()
+                for event in events:
+                    yield event
+                if not events:
+                    yield {'type': 'idle'}
+        finally:
+            if self.watching:
+                self.watch_manager.unwatch(self._directory, self._on_events)
+            if self._file is not None:
+                self._file.close()
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 2.0
+
+
+class TelemetrySampler:
+    """Collect host telemetry on a background thread and keep the latest snapshot"""
+
+    def __init__(self, collect: Callable[[], Dict[str, Any]], prime: Optional[Callable[[], None]] = None,
+                 interval: Optional[float] = None):
+        self.collect = collect
+        self.prime = prime
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._snapshot = None
+        self._sampled_at = None
+        self._listeners = []
+
+    @property
+    def interval(self) -> float:
+        if self._interval is None:
+            self._interval = float(getattr(settings, 'TELEMETRY_INTERVAL', DEFAULT_INTERVAL))
+        return self._interval
+
+    def start(self):
+        """Start the sampling thread once per process"""
+        # Threads do not survive a fork, so gunicorn workers started from a
+        # preloaded master need their own sampler thread.
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name='telemetry-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._stop.set()
+
+    def subscribe(self, listener: Callable[[Dict[str, Any], float], None]):
+        """Call listener(snapshot, sampled_at) from the sampler thread after every sample"""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def sample(self) -> Dict[str, Any]:
+        """Collect one snapshot and publish it"""
+        snapshot = self.collect()
+        sampled_at = time.time()
+        with self._lock:
+            self._snapshot = snapshot
+            self._sampled_at = sampled_at
+        self._ready.set()
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot, sampled_at)
+            except Exception:
+                logger.exception("Telemetry listener failed")
+        return snapshot
+
+    def latest(self, timeout: float = 1.0) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        """Return the latest snapshot and its age in seconds"""
+        self.start()
+        if not self._ready.is_set():
+            self._ready.wait(timeout)
+        with self._lock:
+            snapshot, sampled_at = self._snapshot, self._sampled_at
+        if snapshot is None:
+            return None, None
+        return snapshot, max(0.0, time.time() - sampled_at)
+
+    def _run(self):
+        if self.prime:
+            try:
+                self.prime()
+            except Exception:
+                logger.exception("Failed to prime telemetry counters")
+            # Give the rate-based counters a short window for the first sample
+            self._stop.wait(0.1)
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Telemetry sample failed")
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval - elapsed))
@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from control_app.applications import (
+    ApplicationIndex, ApplicationSearchIndex, is_listed, locale_variants, parse_desktop_entry, xdg_application_dirs,
+)
+
+EDITOR = '''# comment
+[Desktop Entry]
+Type=Application
+Name=Editor
+Name[de]=Bearbeiter
+Name[de_AT]=Editor (AT)
+Comment=Edit\\stext\\nfiles
+Exec=editor %F
+Keywords=text;notes\\;todo;
+Categories=Utility;TextEditor;
+Terminal=true
+
+[Desktop Action new-window]
+Name=New Window
+Exec=editor --new-window
+'''
+
+
+class DesktopEntryTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_only_the_entry_group_is_read(self):
+        entry = parse_desktop_entry(self.write('editor.desktop', EDITOR))
+        self.assertEqual((entry['name'], entry['exec']), ('Editor', 'editor %F'))
+        self.assertEqual(entry['description'], 'Edit text\nfiles')
+        self.assertEqual(entry['keywords'], ['text', 'notes;todo'])
+        self.assertEqual(entry['categories'], ['Utility', 'TextEditor'])
+        self.assertTrue(entry['terminal'])
+        self.assertTrue(is_listed(entry))
+
+    def test_localized_values(self):
+        path = self.write('editor.desktop', EDITOR)
+        self.assertEqual(parse_desktop_entry(path, locale_variants('de_AT.UTF-8'))['name'], 'Editor (AT)')
+        self.assertEqual(parse_desktop_entry(path, locale_variants('de_CH'))['name'], 'Bearbeiter')
+        self.assertEqual(parse_desktop_entry(path, locale_variants('fr_FR'))['name'], 'Editor')
+
+    def test_locale_variants(self):
+        self.assertEqual(locale_variants('sr_RS.UTF-8@latin'), ['sr_RS@latin', 'sr_RS', 'sr@latin', 'sr'])
+        self.assertEqual(locale_variants('C'), [])
+
+    def test_unlisted_entries(self):
+        hidden = parse_desktop_entry(self.write('a.desktop', '[Desktop Entry]\nExec=a\nNoDisplay=true\n'))
+        missing = parse_desktop_entry(self.write('b.desktop', '[Desktop Entry]\nExec=b\nTryExec=/nonexistent/b\n'))
+        link = parse_desktop_entry(self.write('c.desktop', '[Desktop Entry]\nType=Link\nExec=c\n'))
+        self.assertEqual([is_listed(entry) for entry in (hidden, missing, link)], [False, False, False])
+        self.assertIsNone(parse_desktop_entry(self.write('d.desktop', '[Other]\nExec=d\n')))
+
+    def test_xdg_directories(self):
+        environment = {'XDG_DATA_HOME': '/home/u/.data', 'XDG_DATA_DIRS': '/opt/share:/usr/share'}
+        with mock.patch.dict(os.environ, environment):
+            directories = xdg_application_dirs()
+        self.assertEqual(directories[:3], ['/home/u/.data/applications', '/opt/share/applications',
+                                           '/usr/share/applications'])
+
+
+class ApplicationIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.apps = os.path.join(self.tmp, 'applications')
+        os.mkdir(self.apps)
+        self.cache_path = os.path.join(self.tmp, 'cache', 'apps.json')
+        self.parsed = []
+        self.write('editor.desktop', 'editor')
+        self.write('hidden.desktop', '')
+        self.write('notes.txt', 'ignored')
+
+    def write(self, name, command):
+        path = os.path.join(self.apps, name)
+        with open(path, 'w') as f:
+            f.write(command)
+        self.touch_directory()
+        return path
+
+    def touch_directory(self):
+        # Directory mtimes can be coarse; move it forward explicitly
+        stat = os.stat(self.apps)
+        os.utime(self.apps, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    def parse(self, path):
+        self.parsed.append(os.path.basename(path))
+        with open(path) as f:
+            return {'name': os.path.basename(path), 'exec': f.read(), 'path': path}
+
+    def index(self):
+        return ApplicationIndex(lambda: [self.apps], self.parse, cache_path=self.cache_path)
+
+    def names(self, index):
+        return [entry['name'] for entry in index.entries()]
+
+    def test_only_changed_files_are_parsed_again(self):
+        index = self.index()
+        self.assertEqual(self.names(index), ['editor.desktop'])
+        self.assertEqual(sorted(self.parsed), ['editor.desktop', 'hidden.desktop'])
+
+        self.parsed.clear()
+        self.assertEqual(self.names(index), ['editor.desktop'])
+        self.assertEqual(self.parsed, [])
+
+        self.write('browser.desktop', 'browser')
+        self.assertEqual(self.names(index), ['browser.desktop', 'editor.desktop'])
+        self.assertEqual(self.parsed, ['browser.desktop'])
+
+        os.unlink(os.path.join(self.apps, 'editor.desktop'))
+        self.touch_directory()
+        self.assertEqual(self.names(index), ['browser.desktop'])
+
+    def test_restart_starts_from_the_cache(self):
+        self.index().entries()
+        self.parsed.clear()
+        index = self.index()
+        self.assertEqual(self.names(index), ['editor.desktop'])
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(index.get(os.path.join(self.apps, 'editor.desktop'))['exec'], 'editor')
+
+    def test_invalidate_rescans(self):
+        index = self.index()
+        index.entries()
+        path = os.path.join(self.apps, 'editor.desktop')
+        with open(path, 'w') as f:
+            f.write('editor --new')
+        self.assertEqual(index.get(path)['exec'], 'editor')
+        index.invalidate(self.apps)
+        self.assertEqual(index.get(path)['exec'], 'editor --new')
+
+    def test_higher_roots_shadow_lower_ones(self):
+        user = os.path.join(self.tmp, 'user')
+        os.makedirs(os.path.join(user, 'kde'))
+        with open(os.path.join(user, 'editor.desktop'), 'w') as f:
+            f.write('')
+        with open(os.path.join(user, 'kde', 'konsole.desktop'), 'w') as f:
+            f.write('konsole')
+        index = ApplicationIndex(lambda: [user, self.apps], self.parse)
+        entries = index.entries()
+        # The user's empty copy hides the system entry with the same ID
+        self.assertEqual([entry['id'] for entry in entries], ['kde-konsole.desktop'])
+
+    def test_missing_directory_has_no_entries(self):
+        index = self.index()
+        index.entries()
+        shutil.rmtree(self.apps)
+        self.assertEqual(index.entries(), [])
+
+
+CATALOG = [
+    {'name': 'Firefox', 'generic_name': 'Web Browser', 'keywords': ['internet', 'www'], 'exec': 'firefox %u'},
+    {'name': 'Files', 'generic_name': 'File Manager', 'keywords': ['folder'], 'exec': 'nautilus'},
+    {'name': 'Terminal', 'generic_name': '', 'keywords': ['shell', 'prompt'], 'exec': '/usr/bin/gnome-terminal'},
+    {'name': 'Text Editor', 'generic_name': '', 'keywords': ['notepad'], 'exec': 'gedit %F'},
+]
+
+
+class ApplicationSearchTests(SimpleTestCase):
+    def setUp(self):
+        self.index = ApplicationSearchIndex()
+
+    def names(self, query, limit=10):
+        return [entry['name'] for entry in self.index.search(CATALOG, query, limit)]
+
+    def test_prefixes_of_every_field(self):
+        self.assertEqual(self.names('fi')[:2], ['Files', 'Firefox'])
+        self.assertEqual(self.names('browser'), ['Firefox'])
+        self.assertEqual(self.names('shell'), ['Terminal'])
+        self.assertEqual(self.names('gnome'), ['Terminal'])
+
+    def test_terms_match_together(self):
+        self.assertEqual(self.names('text edit', limit=1), ['Text Editor'])
+        self.assertEqual(self.names('file manager', limit=1), ['Files'])
+
+    def test_name_outranks_other_fields(self):
+        catalog = [{'name': 'Notes', 'keywords': ['terminal'], 'exec': 'notes'},
+                   {'name': 'Terminal', 'keywords': [], 'exec': 'term'}]
+        self.assertEqual([entry['name'] for entry in self.index.search(catalog, 'term')], ['Terminal', 'Notes'])
+
+    def test_typos_fall_back_to_trigrams(self):
+        self.assertEqual(self.names('firefx', limit=1), ['Firefox'])
+
+    def test_empty_query_lists_by_name(self):
+        self.assertEqual(self.names('', limit=2), ['Files', 'Firefox'])
+
+    def test_index_is_rebuilt_for_a_new_catalog(self):
+        self.names('fire')
+        catalog = CATALOG + [{'name': 'Fireworks', 'keywords': [], 'exec': 'fw'}]
+        self.assertIn('Fireworks', [entry['name'] for entry in self.index.search(catalog, 'fire')])
@@ -0,0 +1,154 @@
+import io
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from control_app import archives
+from control_app.archives import gzip_compressor, stream_tar, stream_zip, walk_tree, zstd_compressor
+
+
+def local_headers(data):
+    """Yield (flags, compression, extra) for every local file header"""
+    position = data.find(b'PK\x03\x04')
+    while position != -1:
+        flags, compression = struct.unpack_from('<HH', data, position + 6)
+        name_length, extra_length = struct.unpack_from('<HH', data, position + 26)
+        start = position + 30 + name_length
+        yield flags, compression, data[start:start + extra_length]
+        position = data.find(b'PK\x03\x04', start)
+
+
+class StreamZipTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'project')
+        self.write('README.md', b'hello\n' * 1000)
+        self.write('docs/photo.jpg', os.urandom(5000))
+        self.write('docs/deep/notes.txt', b'notes')
+        os.makedirs(os.path.join(self.root, 'empty'))
+        os.symlink(os.path.join(self.root, 'README.md'), os.path.join(self.root, 'link.md'))
+        os.symlink(os.path.join(self.root, 'docs'), os.path.join(self.root, 'docs-link'))
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def archive(self, **kwargs):
+        return b''.join(stream_zip(self.root, **kwargs))
+
+    def test_archive_round_trips(self):
+        with zipfile.ZipFile(io.BytesIO(self.archive())) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [
+                'project/', 'project/README.md', 'project/link.md', 'project/docs/', 'project/docs/photo.jpg',
+                'project/docs/deep/', 'project/docs/deep/notes.txt', 'project/empty/'])
+            self.assertEqual(archive.read('project/link.md'), b'hello\n' * 1000)
+            self.assertEqual(archive.getinfo('project/README.md').compress_type, zipfile.ZIP_DEFLATED)
+            # Already compressed formats are stored as they are
+            self.assertEqual(archive.getinfo('project/docs/photo.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def test_entries_use_data_descriptors(self):
+        data = self.archive()
+        headers = list(local_headers(data))
+        self.assertEqual(len(headers), 8)
+        for flags, _, _ in headers:
+            self.assertTrue(flags & 0x08)
+        self.assertEqual(data.count(b'PK\x07\x08'), 8)
+
+    def test_large_entries_switch_to_zip64(self):
+        # A lower limit stands in for files over 4 GiB
+        with mock.patch.object(zipfile, 'ZIP64_LIMIT', 4096):
+            data = self.archive()
+        zip64 = [extra for _, _, extra in local_headers(data) if extra[:2] == struct.pack('<H', 1)]
+        # README.md, the link to it and the photo
+        self.assertEqual(len(zip64), 3)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            info = archive.getinfo('project/README.md')
+            self.assertEqual(info.file_size, 6000)
+            self.assertEqual(struct.unpack_from('<H', info.extra)[0], 1)
+            self.assertEqual(len(archive.read('project/docs/photo.jpg')), 5000)
+
+    def test_output_is_flushed_in_chunks(self):
+        with mock.patch.multiple(archives, CHUNK_SIZE=1024, FLUSH_SIZE=1024):
+            chunks = list(stream_zip(self.root))
+        # The stored 5000 byte photo alone is drained every 1024 bytes
+        self.assertGreaterEqual(len(chunks), 5)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+
+    def test_walk_tree_skips_unreadable_entries(self):
+        os.symlink(os.path.join(self.tmp, 'missing'), os.path.join(self.root, 'dangling'))
+        names = [name for _, name, _ in walk_tree(self.root)]
+        self.assertNotIn('project/dangling', names)
+        self.assertNotIn('project/docs-link/', names)
+        self.assertEqual(walk_tree('/').__next__()[1], 'root/')
+
+
+class StreamTarTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'project')
+        os.makedirs(os.path.join(self.root, 'docs'))
+        self.files = {'project/a.txt': b'a' * 1000, 'project/docs/ü.bin': os.urandom(3000)}
+        for name, data in self.files.items():
+            with open(os.path.join(self.tmp, name), 'wb') as f:
+                f.write(data)
+        os.chmod(os.path.join(self.root, 'a.txt'), 0o640)
+
+    def read(self, data, mode):
+        with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as archive:
+            members = archive.getmembers()
+            contents = {member.name: archive.extractfile(member).read() for member in members if member.isfile()}
+        return members, contents
+
+    def test_tar_gz(self):
+        data = b''.join(stream_tar(self.root, gzip_compressor()))
+        members, contents = self.read(data, 'r:gz')
+        self.assertEqual([member.name for member in members],
+                         ['project', 'project/a.txt', 'project/docs', 'project/docs/ü.bin'])
+        self.assertEqual(contents, self.files)
+        self.assertEqual(members[1].mode, 0o640)
+        self.assertEqual(members[1].mtime, int(os.stat(os.path.join(self.root, 'a.txt')).st_mtime))
+        self.assertTrue(members[0].isdir())
+
+    def test_archive_is_padded_to_whole_records(self):
+        compressor = mock.Mock(compress=lambda data: data, flush=lambda: b'')
+        with mock.patch.multiple(archives, CHUNK_SIZE=512, FLUSH_SIZE=512):
+            chunks = list(stream_tar(self.root, compressor))
+        self.assertGreater(len(chunks), 2)
+        data = b''.join(chunks)
+        self.assertEqual(len(data) % tarfile.RECORDSIZE, 0)
+        self.assertEqual(self.read(data, 'r:')[1], self.files)
+
+    def test_file_that_shrinks_is_padded(self):
+        path = os.path.join(self.root, 'a.txt')
+        entries = [(path, 'a.txt', os.stat(path))]
+        with open(path, 'wb') as f:
+            f.write(b'short')
+        with mock.patch.object(archives, 'walk_tree', lambda root: iter(entries)):
+            data = b''.join(stream_tar(self.root, gzip_compressor()))
+        _, contents = self.read(data, 'r:gz')
+        self.assertEqual(contents, {'a.txt': b'short' + bytes(995)})
+
+    @unittest.skipIf(archives.zstandard is None, 'zstandard is not installed')
+    def test_tar_zst(self):
+        data = b''.join(stream_tar(self.root, zstd_compressor(threads=2)))
+        raw = archives.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        self.assertEqual(self.read(raw, 'r:')[1], self.files)
+
+    def test_zstd_is_optional(self):
+        with mock.patch.object(archives, 'zstandard', None):
+            with self.assertRaises(RuntimeError):
+                zstd_compressor()
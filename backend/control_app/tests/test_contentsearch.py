@@ -0,0 +1,81 @@
+import os
+import re
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from control_app.contentsearch import ContentSearcher, iter_files, search_batch
+
+
+class ContentSearchTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, path, data):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        return path
+
+    def files(self, **kwargs):
+        return sorted(os.path.relpath(path, self.root) for path, _ in iter_files(self.root, 1024, **kwargs))
+
+    def test_matches_carry_line_and_column(self):
+        path = self.write('a.txt', 'first\nsecond Needle needle\n\nneedle')
+        searched, matches = search_batch([path], 'needle', re.IGNORECASE, 10)
+        self.assertEqual(searched, 1)
+        self.assertEqual([(m['line'], m['column'], m['text']) for m in matches],
+                         [(2, 8, 'second Needle needle'), (4, 1, 'needle')])
+        self.assertEqual(len(search_batch([path], 'needle', re.IGNORECASE, 1)[1]), 1)
+
+    def test_binary_files_are_skipped(self):
+        path = self.write('a.bin', b'needle\0')
+        self.assertEqual(search_batch([path], 'needle', 0, 10), (0, []))
+
+    def test_gitignore_and_skipped_files(self):
+        self.write('.gitignore', '*.log\nbuild/\n!keep.log\n')
+        self.write('app.log', 'x')
+        self.write('keep.log', 'x')
+        self.write('build/out.txt', 'x')
+        self.write('src/build', 'a file, not the ignored directory')
+        self.write('src/main.py', 'x')
+        self.write('.git/config', 'x')
+        self.write('empty.txt', '')
+        self.write('large.txt', 'x' * 2048)
+        self.assertEqual(self.files(), ['.gitignore', 'keep.log', 'src/build', 'src/main.py'])
+        self.assertIn('build/out.txt', self.files(use_gitignore=False))
+
+    def test_anchored_gitignore_patterns(self):
+        self.write('.gitignore', '/top.txt\ndocs/*.md\n**/tmp\nlogs/**\n!logs/keep.txt\na/**/z.txt\n\\#hash\n')
+        for path in ('top.txt', 'sub/top.txt', 'docs/a.md', 'docs/deep/b.md', 'other/docs/a.md',
+                     'tmp/x', 'sub/tmp/x', 'logs/old.txt', 'logs/keep.txt', 'a/z.txt', 'a/b/c/z.txt',
+                     'b/a/z.txt', '#hash'):
+            self.write(path, 'x')
+        self.assertEqual(self.files(), ['.gitignore', 'b/a/z.txt', 'docs/deep/b.md', 'logs/keep.txt',
+                                        'other/docs/a.md', 'sub/top.txt'])
+
+    def test_nested_gitignore_applies_below_its_directory(self):
+        self.write('.gitignore', '*.tmp\n')
+        self.write('sub/.gitignore', '/only.txt\n!keep.tmp\nnested/\n')
+        for path in ('a.tmp', 'keep.tmp', 'only.txt', 'sub/a.tmp', 'sub/keep.tmp', 'sub/only.txt',
+                     'sub/deeper/only.txt', 'sub/nested/x', 'sub/deeper/nested/x', 'nested/x'):
+            self.write(path, 'x')
+        self.assertEqual(self.files(), ['.gitignore', 'nested/x', 'only.txt', 'sub/.gitignore',
+                                        'sub/deeper/only.txt', 'sub/keep.tmp'])
+
+    def test_search_streams_matches_then_a_summary(self):
+        for i in range(5):
+            self.write(f'dir{i}/file.txt', 'alpha\nneedle here\n')
+        searcher = ContentSearcher(workers=1, batch_files=2)
+        self.addCleanup(lambda: searcher._pool and searcher._pool.shutdown())
+        results = list(searcher.search(self.root, 'NEEDLE', limit=3))
+        *matches, summary = results
+        self.assertEqual(len(matches), 3)
+        self.assertEqual(matches[0]['line'], 2)
+        self.assertEqual(summary['done'], True)
+        self.assertTrue(summary['truncated'])
+        with self.assertRaises(re.error):
+            searcher.search(self.root, '(', regex=True)
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from control_app.dedup import MAX_CHUNK, MIN_CHUNK, DedupTransfer, chunk_digest, iter_chunks
+from control_app.uploads import UploadError
+
+
+def chunks_of(data):
+    return list(iter_chunks(io.BytesIO(data)))
+
+
+class ChunkingTests(SimpleTestCase):
+    def setUp(self):
+        self.data = random.Random(0).randbytes(3 * 1024 * 1024)
+
+    def test_chunks_cover_the_data(self):
+        chunks = chunks_of(self.data)
+        position = 0
+        for offset, length, digest in chunks:
+            self.assertEqual(offset, position)
+            self.assertLessEqual(length, MAX_CHUNK)
+            self.assertEqual(digest, chunk_digest(self.data[offset:offset + length]))
+            position += length
+        self.assertEqual(position, len(self.data))
+        self.assertTrue(all(length >= MIN_CHUNK for _, length, _ in chunks[:-1]))
+        self.assertEqual(chunks_of(b''), [])
+
+    def test_insertion_only_changes_nearby_chunks(self):
+        middle = len(self.data) // 2
+        edited = self.data[:middle] + b'inserted' + self.data[middle:]
+        before = {digest for _, _, digest in chunks_of(self.data)}
+        after = [digest for _, _, digest in chunks_of(edited)]
+        self.assertLessEqual(len([digest for digest in after if digest not in before]), 2)
+
+
+class DedupTransferTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.target = os.path.join(self.tmp, 'target')
+        os.mkdir(self.target)
+        self.transfer = DedupTransfer(os.path.join(self.tmp, 'state'))
+        self.data = random.Random(1).randbytes(2 * 1024 * 1024)
+
+    def start(self, data, name='file.bin'):
+        chunks = chunks_of(data)
+        session = self.transfer.create(self.target, name, len(data), hashlib.sha256(data).hexdigest(),
+                                       [[digest, length] for _, length, digest in chunks])
+        if session['indexing']:
+            # The file being replaced is chunked in the background
+            self.transfer._wait_for_index(session['path'])
+            session = self.transfer.status(session['upload_id'])
+        return session, {digest: data[offset:offset + length] for offset, length, digest in chunks}
+
+    def upload(self, data, name='file.bin'):
+        session, pieces = self.start(data, name)
+        for digest in session['missing']:
+            self.transfer.put_chunk(session['upload_id'], digest, io.BytesIO(pieces[digest]), len(pieces[digest]))
+        result = self.transfer.commit(session['upload_id'])
+        with open(result['path'], 'rb') as f:
+            self.assertEqual(f.read(), data)
+        return session, result
+
+    def test_upload_then_new_version_reuses_chunks(self):
+        session, result = self.upload(self.data)
+        self.assertEqual(session['missing_bytes'], len(self.data))
+        self.assertEqual(result['reused_bytes'], 0)
+        # Expire the uploaded chunks, as the TTL would: only the file itself is left to reuse
+        self.transfer.store.prune(-1)
+
+        middle = len(self.data) // 2
+        edited = self.data[:middle] + b'patched' + self.data[middle + 7:]
+        session, result = self.upload(edited)
+        self.assertLess(session['missing_bytes'], 2 * MAX_CHUNK)
+        self.assertEqual(result['reused_bytes'] + session['missing_bytes'], len(edited))
+        self.assertEqual(sorted(os.listdir(self.target)), ['file.bin'])
+
+    def test_existing_target_is_indexed_on_create(self):
+        # A file that was copied here some other way still serves as a source
+        with open(os.path.join(self.target, 'file.bin'), 'wb') as f:
+            f.write(self.data)
+        session, result = self.upload(self.data + b'tail')
+        self.assertLess(session['missing_bytes'], 2 * MAX_CHUNK)
+        self.assertGreater(result['reused_bytes'], len(self.data) - 2 * MAX_CHUNK)
+
+    def test_manifest_lists_chunks(self):
+        self.upload(self.data)
+        manifest = self.transfer.manifest(os.path.join(self.target, 'file.bin'))
+        self.assertEqual(manifest['size'], len(self.data))
+        self.assertEqual([[digest, offset, length] for offset, length, digest in chunks_of(self.data)],
+                         manifest['chunks'])
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.manifest(os.path.join(self.target, 'nothing'))
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_missing_chunks_block_commit(self):
+        session, _ = self.start(self.data)
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.commit(session['upload_id'])
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(set(raised.exception.details['missing']), set(session['missing']))
+        self.assertEqual(os.listdir(self.target), [])
+
+    def test_chunk_must_match_its_digest(self):
+        session, pieces = self.start(b'abc')
+        digest = session['missing'][0]
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.put_chunk(session['upload_id'], digest, io.BytesIO(b'abd'), 3)
+        self.assertEqual(raised.exception.status, 422)
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.put_chunk(session['upload_id'], chunk_digest(b'other'), io.BytesIO(b'other'), 5)
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_file_checksum_is_verified(self):
+        chunks = chunks_of(b'abc')
+        session = self.transfer.create(self.target, 'file.bin', 3, '0' * 64,
+                                       [[digest, length] for _, length, digest in chunks])
+        self.transfer.put_chunk(session['upload_id'], chunks[0][2], io.BytesIO(b'abc'), 3)
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.commit(session['upload_id'])
+        self.assertEqual(raised.exception.status, 422)
+        self.assertEqual(os.listdir(self.target), [])
+
+    def test_abort_forgets_the_session(self):
+        session, pieces = self.start(b'abc')
+        digest = session['missing'][0]
+        self.transfer.put_chunk(session['upload_id'], digest, io.BytesIO(b'abc'), 3)
+        self.assertEqual(self.transfer.abort(session['upload_id']), {'status': 'success'})
+        with self.assertRaises(UploadError) as raised:
+            self.transfer.status(session['upload_id'])
+        self.assertEqual(raised.exception.status, 404)
+        # Chunks are left to the TTL: other sessions may share them
+        self.assertTrue(self.transfer.store.has(digest))
+        self.transfer.ttl = -1
+        self.transfer.prune()
+        self.assertFalse(self.transfer.store.has(digest))
+        self.assertEqual(os.listdir(self.transfer.sessions_dir), [])
+
+    def test_sessions_share_chunks(self):
+        first, pieces = self.start(self.data, 'first.bin')
+        second, _ = self.start(self.data, 'second.bin')
+        for digest in first['missing']:
+            self.transfer.put_chunk(first['upload_id'], digest, io.BytesIO(pieces[digest]), len(pieces[digest]))
+        self.transfer.commit(first['upload_id'])
+        self.assertEqual(self.transfer.status(second['upload_id'])['missing'], [])
+        self.transfer.commit(second['upload_id'])
+        with open(os.path.join(self.target, 'second.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_concurrent_commits_assemble_the_file_once(self):
+        session, pieces = self.start(self.data)
+        for digest in session['missing']:
+            self.transfer.put_chunk(session['upload_id'], digest, io.BytesIO(pieces[digest]), len(pieces[digest]))
+        outcomes = []
+
+        def commit():
+            try:
+                outcomes.append(self.transfer.commit(session['upload_id'])['status'])
+            except UploadError as e:
+                outcomes.append(e.status)
+
+        threads = [threading.Thread(target=commit) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(sorted(outcomes, key=str), [404, 'success'])
+        self.assertEqual(os.listdir(self.target), ['file.bin'])
+
+    def test_short_writes_are_completed(self):
+        pwrite = os.pwrite
+        with mock.patch('control_app.dedup.os.pwrite', lambda fd, data, offset: pwrite(fd, data[:1000], offset)):
+            self.upload(self.data)
+
+    def test_create_leaves_indexing_and_pruning_to_the_background(self):
+        with open(os.path.join(self.target, 'file.bin'), 'wb') as f:
+            f.write(self.data)
+        release = threading.Event()
+        index_file = self.transfer.index_file
+
+        def slow_index(path):
+            release.wait(5)
+            return index_file(path)
+
+        with mock.patch.object(self.transfer, 'index_file', slow_index), \
+                mock.patch.object(self.transfer, 'prune') as prune:
+            session = self.transfer.create(self.target, 'file.bin', 3, '0' * 64, [[chunk_digest(b'abc'), 3]])
+            self.assertTrue(session['indexing'])
+            self.transfer.create(self.target, 'other.bin', 3, '0' * 64, [[chunk_digest(b'abc'), 3]])
+            release.set()
+            self.transfer._wait_for_index(session['path'])
+            self.transfer._executor().submit(lambda: None).result()
+        self.assertFalse(self.transfer.status(session['upload_id'])['indexing'])
+        self.assertIsNotNone(self.transfer.index.file_chunks(session['path']))
+        # At most once per prune_interval
+        self.assertEqual(prune.call_count, 1)
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import SimpleTestCase
+
+from control_app import inotify
+from control_app.dirwatch import ChangeBatch, DirectoryWatcher
+from control_app.inotify import (
+    IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_ISDIR, IN_MODIFY, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW,
+    Event, WatchManager,
+)
+
+
+def decode(frames):
+    return [json.loads(frame.decode().split('data: ', 1)[1]) for frame in frames]
+
+
+def batch(*events):
+    result = ChangeBatch()
+    for mask, name, cookie in events:
+        result.add(Event(1, mask, cookie, name))
+    return result.payload('/dir')
+
+
+class ChangeBatchTests(SimpleTestCase):
+    def changes(self, *events):
+        return {change['name']: change['type'] for change in batch(*events)['changes']}
+
+    def test_coalescing(self):
+        self.assertEqual(self.changes((IN_CREATE, 'a', 0), (IN_MODIFY, 'a', 0)), {'a': 'created'})
+        self.assertEqual(self.changes((IN_CREATE, 'a', 0), (IN_DELETE, 'a', 0)), {})
+        self.assertEqual(self.changes((IN_DELETE, 'a', 0), (IN_CREATE, 'a', 0)), {'a': 'modified'})
+        self.assertEqual(self.changes((IN_MODIFY, 'a', 0), (IN_DELETE, 'a', 0)), {'a': 'deleted'})
+
+    def test_moves_are_paired_by_cookie(self):
+        payload = batch((IN_MOVED_FROM | IN_ISDIR, 'old', 7), (IN_MOVED_TO | IN_ISDIR, 'new', 7))
+        self.assertEqual(payload['changes'], [{'type': 'moved', 'name': 'new', 'old_name': 'old', 'is_dir': True}])
+        # Only one half seen: a plain delete or create
+        self.assertEqual(self.changes((IN_MOVED_FROM, 'out', 8)), {'out': 'deleted'})
+        self.assertEqual(self.changes((IN_MOVED_TO, 'in', 9)), {'in': 'created'})
+        # Moved in and deleted again: the old name went away
+        self.assertEqual(self.changes((IN_MOVED_FROM, 'a', 1), (IN_MOVED_TO, 'b', 1), (IN_DELETE, 'b', 0)),
+                         {'a': 'deleted'})
+
+    def test_overflow_and_removal(self):
+        self.assertEqual(batch((IN_CREATE, 'a', 0), (IN_Q_OVERFLOW, '', 0))['type'], 'rescan')
+        self.assertEqual(batch((IN_DELETE_SELF, '', 0))['type'], 'gone')
+
+
+@unittest.skipUnless(inotify.is_available(), 'inotify is not available')
+class DirectoryWatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.real = os.path.join(self.root, 'real')
+        self.link = os.path.join(self.root, 'link')
+        os.mkdir(self.real)
+        os.symlink(self.real, self.link)
+        self.watch_manager = WatchManager()
+        self.watcher = DirectoryWatcher(self.watch_manager, debounce=0.05)
+
+    async def collect(self, subscription, paths):
+        payloads = []
+        while {payload['path'] for payload in payloads} < set(paths):
+            frames = await subscription.get(timeout=2)
+            if not frames:
+                break
+            payloads.extend(decode(frames))
+        return payloads
+
+    def test_changes_are_batched(self):
+        async def run():
+            subscription = self.watcher.subscribe([self.real])
+            try:
+                for name in ('a', 'b', 'c'):
+                    open(os.path.join(self.real, name), 'w').close()
+                os.rename(os.path.join(self.real, 'c'), os.path.join(self.real, 'd'))
+                return await self.collect(subscription, [self.real])
+            finally:
+                self.watcher.unsubscribe(subscription)
+
+        payloads = asyncio.run(run())
+        changes = {change['name']: change['type'] for payload in payloads for change in payload['changes']}
+        self.assertEqual(changes, {'a': 'created', 'b': 'created', 'd': 'created'})
+        self.assertEqual(self.watch_manager.watched_count(), 0)
+
+    def test_symlinked_alias_gets_events(self):
+        async def run():
+            first = self.watcher.subscribe([self.real])
+            second = self.watcher.subscribe([self.link])
+            try:
+                open(os.path.join(self.real, 'new.txt'), 'w').close()
+                return (await self.collect(first, [self.real]), await self.collect(second, [self.link]))
+            finally:
+                self.watcher.unsubscribe(first)
+                self.watcher.unsubscribe(second)
+
+        real, link = asyncio.run(run())
+        self.assertEqual([change['name'] for payload in real for change in payload['changes']], ['new.txt'])
+        self.assertEqual([payload['path'] for payload in link], [self.link])
+        self.assertEqual(link[0]['changes'][0]['path'], os.path.join(self.link, 'new.txt'))
+        self.assertEqual(self.watch_manager.watched_count(), 0)
+
+    def test_moved_directory_is_gone_and_unwatched(self):
+        async def run():
+            subscription = self.watcher.subscribe([self.real])
+            try:
+                os.rename(self.real, self.real + '-moved')
+                return await self.collect(subscription, [self.real])
+            finally:
+                self.watcher.unsubscribe(subscription)
+
+        payloads = asyncio.run(run())
+        self.assertEqual(payloads[-1]['type'], 'gone')
+        self.assertEqual(self.watch_manager.watched_count(), 0)
+
+    def test_stream_can_be_consumed_on_another_loop(self):
+        # Under WSGI the view subscribes on a loop that is closed before the stream starts
+        async def subscribe():
+            subscription = self.watcher.subscribe([self.real])
+            open(os.path.join(self.real, 'early.txt'), 'w').close()
+            return subscription
+
+        subscription = asyncio.run(subscribe())
+        try:
+            async def consume():
+                payloads = await self.collect(subscription, [self.real])
+                open(os.path.join(self.real, 'late.txt'), 'w').close()
+                return payloads + await self.collect(subscription, [self.real])
+
+            payloads = asyncio.run(consume())
+        finally:
+            self.watcher.unsubscribe(subscription)
+        names = [change['name'] for payload in payloads for change in payload['changes']]
+        self.assertEqual(names, ['early.txt', 'late.txt'])
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from control_app.diskusage import DiskUsageAnalyzer
+
+
+class DiskUsageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.write('top.bin', 1000)
+        self.write('big/a.bin', 50000)
+        self.write('big/deep/b.bin', 30000)
+        self.write('small/c.bin', 10)
+        self.analyzer = DiskUsageAnalyzer(workers=2, progress_interval=60)
+        self.addCleanup(lambda: self.analyzer._pool and self.analyzer._pool.shutdown())
+
+    def write(self, path, size):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+    def test_totals_add_up(self):
+        tree = self.analyzer.analyze(self.root, depth=1)['tree']
+        self.assertEqual(tree['files'], 4)
+        self.assertEqual(tree['dirs'], 4)
+        self.assertGreaterEqual(tree['apparent_size'], 81010)
+        names = [child['name'] for child in tree['children']]
+        self.assertEqual(names[0], 'big')
+        self.assertIn('(files)', names)
+        big = tree['children'][0]
+        self.assertEqual((big['files'], big['dirs']), (2, 2))
+        # Cut at depth 1: big's own children are not expanded
+        self.assertNotIn('children', big)
+        # The directory's own entry counts with its files
+        self.assertEqual(sum(child['apparent_size'] for child in tree['children']), tree['apparent_size'])
+
+    def test_unchanged_directories_come_from_the_cache(self):
+        first = self.analyzer.analyze(self.root)
+        self.assertEqual((first['dirs_scanned'], first['dirs_cached']), (4, 0))
+        self.write('small/new.bin', 10)
+        second = self.analyzer.analyze(self.root)
+        self.assertEqual((second['dirs_scanned'], second['dirs_cached']), (1, 3))
+        self.assertEqual(second['tree']['files'], 5)
+        self.assertEqual(self.analyzer.analyze(self.root, fresh=True)['dirs_scanned'], 4)
+
+    def test_other_children_are_grouped(self):
+        for i in range(4):
+            self.write(f'many/d{i}/f', 100000 * (i + 1))
+        tree = self.analyzer.analyze(os.path.join(self.root, 'many'), max_children=2)['tree']
+        names = [child['name'] for child in tree['children']]
+        self.assertEqual(names, ['d3', 'd2', '(2 more)'])
+
+    def test_progress_events_precede_the_result(self):
+        self.analyzer.progress_interval = 0
+        events = list(self.analyzer.scan(self.root))
+        self.assertEqual(events[-1]['type'], 'result')
+        self.assertTrue(all(event['type'] == 'progress' for event in events[:-1]))
+
+    def test_unchanged_subtrees_are_not_descended_into(self):
+        first = self.analyzer.analyze(self.root, depth=1)
+        second = self.analyzer.analyze(self.root, depth=1)
+        # big and small are below the tree's depth: only the root is looked at
+        self.assertEqual((second['dirs_scanned'], second['subtrees_cached'], second['dirs_cached']), (0, 2, 4))
+        self.assertEqual(second['tree'], first['tree'])
+
+        # Expired totals are counted again
+        self.analyzer.ttl = 0
+        self.assertEqual(self.analyzer.analyze(self.root, depth=1)['subtrees_cached'], 0)
+
+    def test_scanning_a_changed_directory_drops_its_ancestors_totals(self):
+        self.analyzer.analyze(self.root, depth=0)
+        self.write('big/deep/new.bin', 10)
+        self.assertEqual(self.analyzer.analyze(os.path.join(self.root, 'big'))['dirs_scanned'], 1)
+        result = self.analyzer.analyze(self.root, depth=0)
+        # The root's totals are gone; big was re-totalled by the scan that saw the change
+        self.assertEqual((result['dirs_scanned'], result['subtrees_cached']), (0, 2))
+        self.assertEqual(result['tree']['files'], 5)
+
+    def test_cache_evicts_the_least_recently_used(self):
+        self.analyzer.max_entries = 2
+        cache = self.analyzer._cache
+        info = (1, time.time(), 0, 0, 0, ())
+        self.analyzer._remember(cache, 'a', info)
+        self.analyzer._remember(cache, 'b', info)
+        self.assertIsNotNone(self.analyzer._lookup(cache, 'a', 1))
+        self.analyzer._remember(cache, 'c', info)
+        self.assertEqual(list(cache), ['a', 'c'])
+
+        tree = self.analyzer.analyze(self.root, depth=1)['tree']
+        self.assertLessEqual(len(cache), 2)
+        self.assertLessEqual(len(self.analyzer._subtrees), 2)
+        self.assertEqual((tree['files'], tree['dirs']), (4, 4))
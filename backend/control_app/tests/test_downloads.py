@@ -0,0 +1,127 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.handlers.asgi import ASGIRequest
+from django.test import RequestFactory, SimpleTestCase
+from django.utils.http import http_date
+
+from control_app import downloads
+from control_app.downloads import parse_range, serve_file
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), [(0, 100)])
+        self.assertEqual(parse_range('bytes=900-', 1000), [(900, 1000)])
+        self.assertEqual(parse_range('bytes=-100', 1000), [(900, 1000)])
+        # Past the end is clamped, a suffix longer than the file is all of it
+        self.assertEqual(parse_range('bytes=990-2000', 1000), [(990, 1000)])
+        self.assertEqual(parse_range('bytes=-5000', 1000), [(0, 1000)])
+        self.assertEqual(parse_range(' Bytes = 1-1', 10), [(1, 2)])
+
+    def test_ranges_are_sorted_and_merged(self):
+        self.assertEqual(parse_range('bytes=500-599,0-99,50-149,150-199', 1000), [(0, 200), (500, 600)])
+        self.assertEqual(parse_range('bytes=0-9, 20-29', 1000), [(0, 10), (20, 30)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range('bytes=-0', 1000), [])
+        self.assertEqual(parse_range('bytes=0-', 0), [])
+        # Unsatisfiable parts are dropped when others remain
+        self.assertEqual(parse_range('bytes=2000-3000,0-0', 1000), [(0, 1)])
+
+    def test_ignored_headers(self):
+        for header in ('items=0-1', 'bytes=', 'bytes=5', 'bytes=a-b', 'bytes=9-1',
+                       'bytes=' + ','.join(['0-0'] * (downloads.MAX_RANGES + 1))):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'data.txt')
+        self.data = bytes(range(256)) * 4
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        self.stat = os.stat(self.path)
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        response = serve_file(self.factory.get('/download', **headers), self.path)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], downloads.file_etag(self.stat))
+        self.assertEqual(self.body(response), self.data)
+
+    def test_single_range(self):
+        response = self.serve(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.data[10:20])
+
+    def test_multiple_ranges(self):
+        response = self.serve(HTTP_RANGE='bytes=0-1,-2')
+        self.assertEqual(response.status_code, 206)
+        boundary = response['Content-Type'].split('boundary=')[1]
+        body = self.body(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertIn(b'Content-Range: bytes 0-1/1024\r\n\r\n' + self.data[:2], parts[1])
+        self.assertIn(b'Content-Range: bytes 1022-1023/1024\r\n\r\n' + self.data[-2:], parts[2])
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_if_range(self):
+        etag = downloads.file_etag(self.stat)
+        last_modified = http_date(int(self.stat.st_mtime))
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE=last_modified).status_code, 206)
+        # A stale validator gets the whole, current file
+        for stale in ('"other"', http_date(int(self.stat.st_mtime) - 60)):
+            with self.subTest(if_range=stale):
+                response = self.serve(HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE=stale)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.body(response), self.data)
+
+    def test_conditional_requests(self):
+        etag = downloads.file_etag(self.stat)
+        mtime = int(self.stat.st_mtime)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='W/' + etag).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_MODIFIED_SINCE=http_date(mtime)).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self.serve(HTTP_IF_MATCH='"other"').status_code, 412)
+        self.assertEqual(self.serve(HTTP_IF_UNMODIFIED_SINCE=http_date(mtime - 60)).status_code, 412)
+        self.assertEqual(self.serve(HTTP_IF_MATCH=etag, HTTP_RANGE='bytes=0-0').status_code, 206)
+
+    def test_file_streams_off_the_event_loop_under_asgi(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'',
+                 'headers': [(b'range', b'bytes=0-9')]}
+        response = serve_file(ASGIRequest(scope, io.BytesIO()), self.path)
+        self.addCleanup(response.close)
+        self.assertTrue(response.is_async)
+
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(asyncio.run(collect()), self.data[:10])
+        # Under WSGI the file is left to the server's sendfile()
+        self.assertFalse(self.serve().is_async)
@@ -0,0 +1,108 @@
+import codecs
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from control_app import filereader
+from control_app.filereader import LineIndex, LineIndexCache, detect_encoding
+
+
+class DetectEncodingTests(SimpleTestCase):
+    def test_boms(self):
+        self.assertEqual(detect_encoding(codecs.BOM_UTF8 + b'abc'), ('utf-8', 3))
+        self.assertEqual(detect_encoding(codecs.BOM_UTF16_LE + b'a\0'), ('utf-16-le', 2))
+        self.assertEqual(detect_encoding(codecs.BOM_UTF32_LE + b'a\0\0\0'), ('utf-32-le', 4))
+
+    def test_text_and_binary(self):
+        self.assertEqual(detect_encoding(b''), ('utf-8', 0))
+        self.assertEqual(detect_encoding('café\n'.encode()), ('utf-8', 0))
+        # A multibyte character cut off by the prefix is still UTF-8
+        self.assertEqual(detect_encoding('café'.encode()[:-1]), ('utf-8', 0))
+        self.assertEqual(detect_encoding(b'caf\xe9\n'), ('latin-1', 0))
+        self.assertEqual(detect_encoding(b'ELF\0\1\2'), (None, 0))
+        self.assertEqual(detect_encoding(b'\1\2\3\4abcdefg'), (None, 0))
+
+
+class LineIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'log.txt')
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, data, mode='wb'):
+        with open(self.path, mode) as f:
+            f.write(data)
+        return os.stat(self.path)
+
+    def offset(self, index, line):
+        with open(self.path, 'rb') as f:
+            return index.line_offset(f.fileno(), line)
+
+    def test_offsets_across_blocks(self):
+        lines = [b'%06d\n' % number for number in range(40000)]
+        index = LineIndex(self.path).update(self.write(b''.join(lines)))
+        self.assertGreater(index.size, 4 * filereader.BLOCK_SIZE)
+        self.assertEqual(len(index.offsets), 5)
+        self.assertEqual(index.total_lines, 40000)
+        for line in (1, 2, 10923, 10924, 25000, 40000):
+            self.assertEqual(self.offset(index, line), 7 * (line - 1))
+        self.assertEqual(self.offset(index, 40001), index.size)
+        self.assertEqual(self.offset(index, 50000), index.size)
+
+    def test_last_line_without_newline(self):
+        index = LineIndex(self.path).update(self.write(b'a\nb'))
+        self.assertEqual(index.total_lines, 2)
+        self.assertEqual(self.offset(index, 2), 2)
+        self.assertEqual(LineIndex(self.path).update(self.write(b'')).total_lines, 0)
+
+    def test_appends_are_indexed_incrementally(self):
+        index = LineIndex(self.path).update(self.write(b'x' * 99 + b'\n'))
+        index.update(self.write(b'y\n' * 10, 'ab'))
+        self.assertEqual(index.total_lines, 11)
+        self.assertEqual(self.offset(index, 11), 118)
+        # A rewrite that is not an append starts over
+        index.update(self.write(b'z\n'))
+        self.assertEqual((index.total_lines, index.size), (1, 2))
+
+    def test_truncated_file_ends_the_scan(self):
+        lines = b''.join(b'%06d\n' % number for number in range(40000))
+        index = LineIndex(self.path).update(self.write(lines))
+        self.write(b'short\n')
+        # The index still describes the long file; the scan stops at the new end
+        self.assertEqual(self.offset(index, 30000), 6)
+        self.assertEqual(self.offset(index, 2), 6)
+
+    def test_index_describes_the_file_it_read(self):
+        stale = self.write(b'a\n')
+        self.write(b'a\nb\nc\n')
+        index = LineIndex(self.path).update(stale)
+        self.assertEqual((index.size, index.total_lines), (6, 3))
+        self.assertEqual(index.identity, LineIndex._identity(os.stat(self.path)))
+
+    def test_unchanged_file_is_not_reindexed(self):
+        stat = self.write(b'a\nb\n')
+        index = LineIndex(self.path).update(stat)
+        index.newlines = 99
+        self.assertEqual(index.update(stat).newlines, 99)
+
+
+class LineIndexCacheTests(SimpleTestCase):
+    def test_least_recently_used_index_is_dropped(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        cache = LineIndexCache(max_entries=2)
+        paths = []
+        for name in 'abc':
+            path = os.path.join(tmp, name)
+            with open(path, 'wb') as f:
+                f.write(b'1\n')
+            paths.append(path)
+        first = cache.get(paths[0], os.stat(paths[0]))
+        cache.get(paths[1], os.stat(paths[1]))
+        self.assertIs(cache.get(paths[0], os.stat(paths[0])), first)
+        cache.get(paths[2], os.stat(paths[2]))
+        self.assertEqual(list(cache._entries), [paths[0], paths[2]])
+        cache.discard(paths[0])
+        self.assertIsNot(cache.get(paths[0], os.stat(paths[0])), first)
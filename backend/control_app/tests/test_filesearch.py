@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from control_app.filesearch import FilenameIndex, FilenameIndexer, fold, write_index
+from control_app.inotify import IN_Q_OVERFLOW, Event
+
+
+class FilenameIndexTests(SimpleTestCase):
+    paths = [
+        '/home/u/Über.txt',
+        '/home/u/Ärger.md',
+        '/home/u/docs/',
+        '/home/u/docs/Report.PDF',
+        '/home/u/docs/notes.md',
+        '/home/u/src/main.py',
+        '/home/u/src/İstanbul.py',
+        '/home/u/src/Kelvin.txt',
+        '/srv/other/main.py',
+    ]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'files.idx')
+        write_index(path, [os.fsencode(p) for p in self.paths] + [b'/home/u/bad\xff.bin'])
+        self.index = FilenameIndex(path)
+
+    def search(self, query, **kwargs):
+        return [result['path'] for result in self.index.search(query, **kwargs)['results']]
+
+    def test_fold_keeps_byte_length(self):
+        for name in self.paths + ['ẞ', 'bad\udcff']:
+            raw = os.fsencode(name)
+            self.assertEqual(len(fold(raw)), len(raw))
+        self.assertEqual(fold('ÜBER'.encode()), 'über'.encode())
+
+    def test_substring_is_case_insensitive(self):
+        self.assertEqual(self.search('report'), ['/home/u/docs/Report.PDF'])
+        self.assertEqual(self.search('MAIN'), ['/home/u/src/main.py', '/srv/other/main.py'])
+
+    def test_non_ascii_names(self):
+        for query in ('Über', 'über', 'ÜBER.TXT'):
+            self.assertEqual(self.search(query), ['/home/u/Über.txt'])
+        self.assertEqual(self.search('Ärger'), ['/home/u/Ärger.md'])
+        self.assertEqual(self.search('ärg'), ['/home/u/Ärger.md'])
+        self.assertEqual(self.search('İstanbul'), ['/home/u/src/İstanbul.py'])
+        self.assertEqual(self.search('bad\udcff'), ['/home/u/bad\udcff.bin'])
+
+    def test_basename_only_unless_query_has_slash(self):
+        self.assertEqual(self.search('docs'), ['/home/u/docs'])
+        self.assertEqual(self.search('docs/no'), ['/home/u/docs/notes.md'])
+
+    def test_glob(self):
+        self.assertEqual(self.search('*.MD'), ['/home/u/docs/notes.md', '/home/u/Ärger.md'])
+        self.assertEqual(self.search('ü*'), ['/home/u/Über.txt'])
+        self.assertEqual(self.search('src/*.py'), ['/home/u/src/main.py', '/home/u/src/İstanbul.py'])
+
+    def test_question_mark_is_one_character(self):
+        self.assertEqual(self.search('?rger.md'), ['/home/u/Ärger.md'])
+        self.assertEqual(self.search('??rger.md'), [])
+        self.assertEqual(self.search('/home/u/?ber.txt'), ['/home/u/Über.txt'])
+        self.assertEqual(self.search('?stanbul.py'), ['/home/u/src/İstanbul.py'])
+        self.assertEqual(self.search('u?docs'), [])
+
+    def test_root_and_limit(self):
+        self.assertEqual(self.search('main', root='/srv'), ['/srv/other/main.py'])
+        result = self.index.search('.', limit=2)
+        self.assertEqual(len(result['results']), 2)
+        self.assertTrue(result['truncated'])
+
+
+class FilenameIndexerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, 'root')
+        for directory in ('a/b', 'node_modules/pkg'):
+            os.makedirs(os.path.join(self.root, directory))
+        for name in ('a/one.txt', 'a/b/two.txt', 'node_modules/pkg/index.js'):
+            open(os.path.join(self.root, name), 'w').close()
+        self.index_path = os.path.join(self.tmp, 'files.idx')
+        self.indexer = FilenameIndexer([self.root], self.index_path, exclude=['node_modules'])
+
+    def search(self, query):
+        return [result['path'] for result in FilenameIndex(self.index_path).search(query)['results']]
+
+    def test_build_and_rebuild(self):
+        self.indexer.build()
+        self.assertEqual(self.search('.txt'), [os.path.join(self.root, 'a/b/two.txt'),
+                                               os.path.join(self.root, 'a/one.txt')])
+        self.assertEqual(self.search('index.js'), [])
+
+        open(os.path.join(self.root, 'a/b/three.txt'), 'w').close()
+        self.indexer.build()
+        self.assertIn(os.path.join(self.root, 'a/b/three.txt'), self.search('three'))
+        # Only the changed directory was read again
+        self.assertEqual(self.indexer.last_build['directories_reused'], 2)
+
+    def test_changed_directories_are_applied_as_a_delta(self):
+        self.indexer.build()
+        open(os.path.join(self.root, 'a/new.txt'), 'w').close()
+        os.makedirs(os.path.join(self.root, 'a/c/d'))
+        open(os.path.join(self.root, 'a/c/d/deep.txt'), 'w').close()
+        shutil.rmtree(os.path.join(self.root, 'a/b'))
+        self.indexer.update({os.fsencode(os.path.join(self.root, 'a'))})
+        self.assertEqual(self.search('.txt'), [os.path.join(self.root, 'a/c/d/deep.txt'),
+                                               os.path.join(self.root, 'a/new.txt'),
+                                               os.path.join(self.root, 'a/one.txt')])
+        self.assertEqual(self.search('two'), [])
+        self.assertEqual((self.indexer.last_build['incremental'], self.indexer.last_build['directories_listed']),
+                         (True, 1))
+
+        # The next full pass agrees with the delta
+        with open(self.index_path, 'rb') as f:
+            updated = f.read()[8:16]
+        self.indexer.build()
+        with open(self.index_path, 'rb') as f:
+            self.assertEqual(f.read()[8:16], updated)
+        self.assertEqual(self.indexer.last_build['directories_reused'], 4)
+
+    def test_lost_events_mean_a_full_build(self):
+        self.indexer._on_change(self.root, [Event(1, 0, 0, 'x')])
+        self.assertEqual(self.indexer._take_changes(), {os.fsencode(self.root)})
+        self.indexer._on_change(self.root, [Event(1, IN_Q_OVERFLOW, 0, '')])
+        self.assertIsNone(self.indexer._take_changes())
+        # Without an index to patch, update() crawls
+        self.indexer.update({os.fsencode(self.root)})
+        self.assertFalse(self.indexer.last_build['incremental'])
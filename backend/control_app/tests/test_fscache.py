@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from django.test import SimpleTestCase
+
+from control_app import inotify
+from control_app.fscache import DirectoryCache
+from control_app.inotify import WatchManager
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@unittest.skipUnless(inotify.is_available(), 'inotify is not available')
+class DirectoryCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.real = os.path.join(self.root, 'real')
+        self.link = os.path.join(self.root, 'link')
+        os.mkdir(self.real)
+        os.symlink(self.real, self.link)
+        self.watcher = WatchManager()
+        self.cache = DirectoryCache(1024 * 1024, self.watcher)
+
+    def listing(self, path):
+        return self.cache.get(path, lambda: sorted((name, os.path.join(path, name)) for name in os.listdir(path)))
+
+    def test_change_invalidates_listing(self):
+        self.assertEqual(self.listing(self.real), [])
+        self.assertEqual(self.listing(self.real), [])
+        self.assertEqual(self.cache.hits, 1)
+        open(os.path.join(self.real, 'new.txt'), 'w').close()
+        self.assertTrue(wait_for(lambda: self.cache.invalidations == 1))
+        self.assertEqual([row[0] for row in self.listing(self.real)], ['new.txt'])
+
+    def test_invalidate_and_stats(self):
+        self.listing(self.real)
+        self.cache.invalidate(self.real)
+        self.listing(self.real)
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['misses'], stats['invalidations'], stats['watched']), (1, 2, 1, 1))
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        cache = DirectoryCache(700, self.watcher)
+        rows = lambda name: [(name, name)]  # noqa: E731
+        for path in ('a', 'b', 'c'):
+            os.mkdir(os.path.join(self.root, path))
+            cache.get(os.path.join(self.root, path), lambda path=path: rows(path))
+        cache.get(os.path.join(self.root, 'a'), lambda: self.fail('a should still be cached'))
+        os.mkdir(os.path.join(self.root, 'd'))
+        cache.get(os.path.join(self.root, 'd'), lambda: rows('d'))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(list(cache._entries), [os.path.join(self.root, name) for name in ('c', 'a', 'd')])
+        # Evicted entries give their watch back
+        self.assertEqual(self.watcher.watched_count(), 3)
+
+
+    def test_symlink_alias_is_invalidated(self):
+        self.listing(self.real)
+        self.listing(self.link)
+        self.assertEqual(self.watcher.watched_count(), 2)
+        open(os.path.join(self.real, 'new.txt'), 'w').close()
+        self.assertTrue(wait_for(lambda: self.cache.invalidations == 2))
+        self.assertEqual([row[0] for row in self.listing(self.real)], ['new.txt'])
+        self.assertEqual([row[0] for row in self.listing(self.link)], ['new.txt'])
+
+    def test_removed_directory_drops_every_alias(self):
+        self.listing(self.real)
+        self.listing(self.link)
+        os.rmdir(self.real)
+        self.assertTrue(wait_for(lambda: self.watcher.watched_count() == 0))
+        os.mkdir(self.real)
+        open(os.path.join(self.real, 'again.txt'), 'w').close()
+        # Both aliases are watched afresh and stay exact
+        self.assertEqual([row[0] for row in self.listing(self.link)], ['again.txt'])
+        self.assertEqual([row[0] for row in self.listing(self.real)], ['again.txt'])
+        open(os.path.join(self.real, 'more.txt'), 'w').close()
+        self.assertTrue(wait_for(lambda: len(self.listing(self.link)) == 2))
+
+    def test_unwatch_one_alias_keeps_the_other(self):
+        calls = []
+        callback = lambda path, events: calls.append(path)  # noqa: E731
+        self.assertTrue(self.watcher.watch(self.real, callback))
+        self.assertTrue(self.watcher.watch(self.link, callback))
+        self.watcher.unwatch(self.real, callback)
+        open(os.path.join(self.real, 'x'), 'w').close()
+        self.assertTrue(wait_for(lambda: self.link in calls))
+        self.assertNotIn(self.real, calls)
+        self.watcher.unwatch(self.link, callback)
+        self.watcher.unwatch(self.link, callback)
+        self.assertEqual(self.watcher.watched_count(), 0)
+
+
+class UnwatchedDirectoryCacheTests(SimpleTestCase):
+    def test_mtime_is_checked_without_a_watcher(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        cache = DirectoryCache(1024 * 1024)
+        load = lambda: sorted(os.listdir(root))  # noqa: E731
+        self.assertEqual(cache.get(root, load), [])
+        open(os.path.join(root, 'new.txt'), 'w').close()
+        stat = os.stat(root)
+        os.utime(root, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        self.assertEqual(cache.get(root, load), ['new.txt'])
+        self.assertEqual(cache.stats()['mtime_checked'], 1)
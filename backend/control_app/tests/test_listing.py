@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import SimpleTestCase
+
+try:
+    from control_app import agent
+except ImportError:
+    # dbus, Pillow's ImageGrab and friends are only present on a desktop host
+    agent = None
+
+
+@unittest.skipIf(agent is None, 'the agent needs the desktop libraries')
+class DirectoryPageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, size in (('b.txt', 30), ('A.md', 10), ('.hidden', 5), ('c.txt', 20)):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(b'x' * size)
+        os.mkdir(os.path.join(self.root, 'zdir'))
+
+    def names(self, **kwargs):
+        return [item['name'] for item in agent.list_directory_page(self.root, **kwargs)['items']]
+
+    def test_sorting_keeps_directories_first(self):
+        self.assertEqual(self.names(sort='name'), ['zdir', '.hidden', 'A.md', 'b.txt', 'c.txt'])
+        self.assertEqual(self.names(sort='size', order='desc', show_hidden=False)[:3], ['b.txt', 'c.txt', 'A.md'])
+        self.assertEqual(self.names(sort='type', show_hidden=False), ['zdir', 'A.md', 'b.txt', 'c.txt'])
+
+    def test_pages(self):
+        page = agent.list_directory_page(self.root, sort='name', offset=1, limit=2)
+        self.assertEqual([item['name'] for item in page['items']], ['.hidden', 'A.md'])
+        self.assertEqual((page['total'], page['next_offset']), (5, 3))
+        last = agent.list_directory_page(self.root, sort='name', offset=3, limit=2)
+        self.assertIsNone(last['next_offset'])
+
+    def test_fields(self):
+        items = agent.list_directory_page(self.root, sort='name', fields=['name', 'is_dir'])['items']
+        self.assertEqual(items[0], {'name': 'zdir', 'is_dir': True})
+
+    def test_errors(self):
+        self.assertIn('sort_keys', agent.list_directory_page(self.root, sort='owner'))
+        self.assertIn('error', agent.list_directory_page(os.path.join(self.root, 'missing')))
+        self.assertEqual(len(agent.list_directory(self.root)), 5)
@@ -0,0 +1,185 @@
+import os
+import subprocess
+import sys
+from unittest import mock
+
+import psutil
+from django.test import SimpleTestCase
+
+from control_app.processes import ProcessRegistry, ProcessSnapshotLog, build_process_tree, query_processes
+
+
+ROWS = [
+    {'pid': 1, 'name': 'systemd', 'username': 'root', 'cpu_percent': 0.5, 'memory_percent': 0.2},
+    {'pid': 20, 'name': 'Firefox', 'username': 'alice', 'cpu_percent': 12.0, 'memory_percent': 8.0},
+    {'pid': 30, 'name': 'firefox-bin', 'username': 'alice', 'cpu_percent': 3.0, 'memory_percent': 4.0},
+    {'pid': 40, 'name': 'bash', 'username': 'bob', 'cpu_percent': None, 'memory_percent': 0.1},
+]
+
+
+class QueryProcessesTests(SimpleTestCase):
+    def pids(self, **filters):
+        return [row['pid'] for row in query_processes(ROWS, **filters)['processes']]
+
+    def test_sorting(self):
+        self.assertEqual(self.pids(sort='cpu'), [20, 30, 1, 40])
+        self.assertEqual(self.pids(sort='cpu', order='asc'), [40, 1, 30, 20])
+        self.assertEqual(self.pids(sort='name'), [40, 20, 30, 1])
+        self.assertEqual(self.pids(sort='mem', limit=2), [20, 30])
+
+    def test_filters_report_the_matching_total(self):
+        result = query_processes(ROWS, name_pattern='^fire', limit=1)
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(len(result['processes']), 1)
+        self.assertEqual(self.pids(user='bob'), [40])
+
+    def test_paging(self):
+        self.assertEqual(self.pids(sort='pid', offset=1, limit=2), [20, 30])
+        self.assertEqual(self.pids(sort='pid', offset=3, limit=5), [40])
+        self.assertEqual(self.pids(top=1), [20])
+        self.assertEqual(self.pids(top=2, sort='mem', order='asc'), [40, 1])
+
+    def test_invalid_arguments(self):
+        self.assertIn('sort_keys', query_processes(ROWS, sort='size'))
+        self.assertIn('error', query_processes(ROWS, order='up'))
+        self.assertIn('error', query_processes(ROWS, name_pattern='('))
+
+
+TREE = [
+    {'pid': 1, 'ppid': 0, 'cpu_percent': 1.0, 'rss': 100, 'threads': 1},
+    {'pid': 2, 'ppid': 1, 'cpu_percent': 2.0, 'rss': 200, 'threads': 2},
+    {'pid': 3, 'ppid': 2, 'cpu_percent': 3.04, 'rss': 300, 'threads': 3},
+    {'pid': 4, 'ppid': 1, 'cpu_percent': None, 'rss': 400, 'threads': 4},
+    {'pid': 5, 'ppid': 99, 'cpu_percent': 0.5, 'rss': 500, 'threads': 5},
+]
+
+
+class ProcessTreeTests(SimpleTestCase):
+    def test_subtree_totals(self):
+        tree = build_process_tree(TREE)
+        self.assertEqual(tree['count'], 5)
+        init, orphan = tree['tree']
+        self.assertEqual((init['pid'], orphan['pid']), (1, 5))
+        self.assertEqual(init['totals'], {'cpu_percent': 6.0, 'rss': 1000, 'threads': 10, 'processes': 4})
+        self.assertEqual([child['pid'] for child in init['children']], [2, 4])
+        self.assertEqual(init['children'][0]['children'][0]['totals']['cpu_percent'], 3.0)
+
+    def test_depth_limit_collapses_subtrees(self):
+        init = build_process_tree(TREE, max_depth=1)['tree'][0]
+        shell, other = init['children']
+        self.assertEqual((shell['children'], shell['collapsed'], shell['child_count']), ([], True, 1))
+        self.assertFalse(other['collapsed'])
+        self.assertEqual(init['totals']['processes'], 4)
+
+    def test_single_subtree(self):
+        tree = build_process_tree(TREE, root=2)
+        self.assertEqual([node['pid'] for node in tree['tree']], [2])
+        self.assertEqual(tree['count'], 2)
+        self.assertIn('error', build_process_tree(TREE, root=42))
+
+
+class ProcessSnapshotLogTests(SimpleTestCase):
+    def setUp(self):
+        self.tables = [
+            [{'pid': 1, 'name': 'init', 'cpu_percent': 0.0}, {'pid': 2, 'name': 'sh', 'cpu_percent': 1.04}],
+            [{'pid': 1, 'name': 'init', 'cpu_percent': 0.0}, {'pid': 2, 'name': 'sh', 'cpu_percent': 5.0},
+             {'pid': 3, 'name': 'new', 'cpu_percent': 0.0}],
+            [{'pid': 1, 'name': 'init', 'cpu_percent': 0.01}, {'pid': 3, 'name': 'new', 'cpu_percent': 0.0}],
+        ]
+        self.log = ProcessSnapshotLog(lambda: self.tables.pop(0), history=2, min_interval=0)
+
+    def test_unknown_version_gets_a_full_snapshot(self):
+        first = self.log.changes('someone-else-1')
+        self.assertTrue(first['full'])
+        self.assertEqual([row['cpu_percent'] for row in first['processes']], [0.0, 1.0])
+        self.assertTrue(first['version'].startswith(self.log.epoch + '-'))
+
+    def test_changes_since_a_version(self):
+        first = self.log.changes()
+        second = self.log.changes(first['version'])
+        self.assertFalse(second['full'])
+        self.assertEqual(second['added'], [{'pid': 3, 'name': 'new', 'cpu_percent': 0.0}])
+        self.assertEqual(second['changed'], [{'pid': 2, 'cpu_percent': 5.0}])
+        self.assertEqual(second['removed'], [])
+
+        # Rounding hides jitter; the removed PID is reported by number
+        third = self.log.changes(second['version'])
+        self.assertEqual((third['added'], third['changed'], third['removed']), ([], [], [2]))
+
+    def test_expired_versions_fall_back_to_full(self):
+        self.tables.append([])
+        first = self.log.changes()
+        self.log.changes()
+        self.log.changes()
+        self.assertTrue(self.log.changes(first['version'])['full'])
+
+    def test_polls_within_min_interval_share_a_snapshot(self):
+        log = ProcessSnapshotLog(lambda: self.tables.pop(0), min_interval=60)
+        self.assertEqual(log.current(), log.current())
+        self.assertEqual(len(self.tables), 2)
+
+
+class ProcessRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = ProcessRegistry(min_interval=0, warmup=0)
+
+    def row(self, rows, pid=None):
+        return next(row for row in rows if row['pid'] == (pid or os.getpid()))
+
+    def test_refresh_lists_this_process(self):
+        row = self.row(self.registry.refresh())
+        self.assertEqual(row['name'], psutil.Process().name())
+        # Counters primed by this very refresh have no figure yet
+        self.assertIsNone(row['cpu_percent'])
+        self.assertGreaterEqual(self.row(self.registry.refresh())['cpu_percent'], 0)
+
+    def test_warmup_gives_the_first_refresh_figures(self):
+        registry = ProcessRegistry(min_interval=0, warmup=0.05)
+        self.assertGreaterEqual(self.row(registry.refresh())['cpu_percent'], 0)
+
+    def test_refresh_details(self):
+        rows = self.registry.refresh(details=True)
+        row = next(row for row in rows if row['pid'] == os.getpid())
+        self.assertEqual(row['ppid'], os.getppid())
+        self.assertGreater(row['rss'], 0)
+        self.assertGreaterEqual(row['threads'], 1)
+        self.assertIn('python', row['cmdline'])
+        # The cached plain rows keep their usual shape
+        self.assertNotIn('ppid', self.registry._rows[0])
+
+    def test_process_objects_are_reused(self):
+        self.assertIs(self.registry.get(os.getpid()), self.registry.get(os.getpid()))
+        with self.assertRaises(psutil.NoSuchProcess):
+            self.registry.get(2 ** 22 + 1)
+
+    def test_exited_processes_are_evicted(self):
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        self.registry._entries[child.pid] = {'process': psutil.Process(os.getpid())}
+        self.registry.refresh()
+        self.assertNotIn(child.pid, self.registry._entries)
+
+    def test_reused_pid_gets_a_new_entry(self):
+        self.registry.refresh()
+        pid = os.getpid()
+        old = self.registry._entries[pid]
+        # Another create time under the same PID marks it as reused
+        old['key'] = (pid, old['key'][1] - 1000)
+        row = self.row(self.registry.refresh())
+        self.assertIsNone(row['cpu_percent'])
+        entry = self.registry._entries[pid]
+        self.assertIsNot(entry['process'], old['process'])
+        self.assertEqual(entry['key'], (pid, psutil.Process(pid).create_time()))
+        self.assertGreaterEqual(self.row(self.registry.refresh())['cpu_percent'], 0)
+
+    def test_reused_pid_whose_process_exited(self):
+        self.registry.refresh()
+        pid = os.getpid()
+        entry = self.registry._entries[pid]
+        entry['key'] = (pid, entry['key'][1] - 1000)
+
+        with mock.patch.object(self.registry, '_entry', side_effect=psutil.NoSuchProcess(pid)):
+            rows = self.registry.refresh()
+        self.assertNotIn(pid, [row['pid'] for row in rows])
+        self.assertNotIn(pid, self.registry._entries)
+        self.assertIn(pid, [row['pid'] for row in self.registry.refresh()])
@@ -0,0 +1,67 @@
+import itertools
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from control_app import procfs
+
+
+def stat_line(pid, name, ppid=1, utime=0, stime=0, starttime=100):
+    # pid (comm) state ppid pgrp session tty tpgid flags minflt cminflt majflt cmajflt utime stime ... starttime
+    fields = ['S', ppid, 0, 0, 0, 0, 0, 0, 0, 0, 0, utime, stime, 0, 0, 20, 0, 1, 0, starttime, 0]
+    return f"{pid} ({name}) {' '.join(map(str, fields))}\n".encode()
+
+
+class ProcfsTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, 'meminfo'), 'w') as f:
+            f.write('MemTotal:       1000 kB\nMemFree:         500 kB\n')
+        os.mkdir(os.path.join(self.root, 'self'))
+
+    def add(self, pid, name, rss_pages=10, **stat):
+        directory = os.path.join(self.root, str(pid))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'stat'), 'wb') as f:
+            f.write(stat_line(pid, name, **stat))
+        with open(os.path.join(directory, 'statm'), 'w') as f:
+            f.write(f'100 {rss_pages} 5 1 0 20 0\n')
+
+    def test_parse_stat_handles_odd_names(self):
+        self.assertEqual(procfs.parse_stat(stat_line(7, 'a) (b c', ppid=3, utime=5, stime=2, starttime=99)),
+                         ('a) (b c', 'S', 3, 7, 99))
+
+    def test_read_proc_table(self):
+        self.add(10, 'init', utime=1)
+        self.add(20, 'worker', ppid=10, rss_pages=3)
+        os.mkdir(os.path.join(self.root, '30'))  # exited between listing and reading
+        rows = sorted(procfs.read_proc_table(self.root))
+        self.assertEqual(rows, [(10, 'init', 'S', 1, 1, 100, 100, 10), (20, 'worker', 'S', 10, 0, 100, 100, 3)])
+        self.assertEqual(procfs.read_total_memory(self.root), 1024000)
+
+    def test_cpu_percent_from_tick_deltas(self):
+        self.add(10, 'busy', utime=0)
+        self.add(20, 'idle', utime=50)
+        sampler = procfs.ProcfsSampler(self.root, min_interval=0, warmup=0)
+        clock = itertools.count()
+        with mock.patch.object(procfs.time, 'monotonic', lambda: float(next(clock))):
+            sampler.refresh()
+            # Two clock seconds between the samples
+            self.add(10, 'busy', utime=procfs.CLOCK_TICKS)
+            # Same PID, new starttime: another process, no baseline
+            self.add(20, 'reused', utime=procfs.CLOCK_TICKS, starttime=500)
+            rows = {row['pid']: row for row in sampler.refresh()}
+        self.assertAlmostEqual(rows[10]['cpu_percent'], 50.0, delta=1)
+        self.assertEqual(rows[20]['cpu_percent'], 0.0)
+        self.assertAlmostEqual(rows[10]['memory_percent'], 10 * procfs.PAGE_SIZE * 100.0 / 1024000)
+        self.assertIsNotNone(rows[10]['username'])
+
+    def test_is_available(self):
+        self.assertFalse(procfs.is_available(self.root))
+        with open(os.path.join(self.root, 'self', 'stat'), 'wb') as f:
+            f.write(stat_line(1, 'self'))
+        self.assertTrue(procfs.is_available(self.root))
@@ -0,0 +1,67 @@
+import asyncio
+import io
+import threading
+
+from django.test import RequestFactory, SimpleTestCase
+from django.core.handlers.asgi import ASGIRequest
+
+from control_app.streaming import stream_content
+
+
+def asgi_request():
+    scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': []}
+    return ASGIRequest(scope, io.BytesIO())
+
+
+class StreamContentTests(SimpleTestCase):
+    def test_sync_generator_streams_under_asgi(self):
+        produced = []
+        closed = threading.Event()
+
+        def generate():
+            try:
+                for i in range(100):
+                    produced.append(i)
+                    yield b'%d\n' % i
+            finally:
+                closed.set()
+
+        async def read_two():
+            body = stream_content(asgi_request(), generate())
+            chunks = [await anext(body), await anext(body)]
+            await body.aclose()
+            return chunks
+
+        self.assertEqual(asyncio.run(read_two()), [b'0\n', b'1\n'])
+        self.assertTrue(closed.wait(2))
+        # Only what was asked for was produced, nothing was collected ahead
+        self.assertEqual(produced, [0, 1])
+
+    def test_async_generator_streams_under_wsgi(self):
+        closed = threading.Event()
+
+        async def generate():
+            try:
+                i = 0
+                while True:
+                    await asyncio.sleep(0)
+                    yield b'%d\n' % i
+                    i += 1
+            finally:
+                closed.set()
+
+        # An endless stream: collecting it first would never return
+        body = stream_content(RequestFactory().get('/'), generate())
+        self.assertEqual([next(body) for _ in range(3)], [b'0\n', b'1\n', b'2\n'])
+        body.close()
+        self.assertTrue(closed.is_set())
+
+    def test_matching_kinds_are_left_alone(self):
+        content = iter([b'a'])
+        self.assertIs(stream_content(RequestFactory().get('/'), content), content)
+
+        async def generate():
+            yield b'a'
+
+        agen = generate()
+        self.assertIs(stream_content(asgi_request(), agen), agen)
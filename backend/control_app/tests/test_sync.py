@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+
+from control_app.sync import COMMITTED, JOURNAL, LOCK_NAME, STAGING_PREFIX, DirectorySync, root_lock
+from control_app.uploads import UploadError
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def tree(root):
+    """Every file (with contents) and directory under root, leaving out sync's own entries"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(STAGING_PREFIX)]
+        relative = os.path.relpath(dirpath, root)
+        if relative != '.':
+            result[relative + '/'] = None
+        for name in filenames:
+            if name == LOCK_NAME:
+                continue
+            with open(os.path.join(dirpath, name), 'rb') as f:
+                result[os.path.normpath(os.path.join(relative, name))] = f.read()
+    return result
+
+
+class DirectorySyncTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.server = os.path.join(self.tmp, 'server')
+        self.client = os.path.join(self.tmp, 'client')
+        self.sync = DirectorySync(os.path.join(self.tmp, 'state', 'sync.sqlite3'))
+        self.write(self.server, 'keep.txt', b'same')
+        self.write(self.server, 'edit.txt', b'old')
+        self.write(self.server, 'old/big.bin', b'x' * 100000)
+        self.write(self.server, 'gone/a.txt', b'a')
+        shutil.copytree(self.server, self.client)
+        self.write(self.client, 'edit.txt', b'new')
+        os.makedirs(os.path.join(self.client, 'new'))
+        os.rename(os.path.join(self.client, 'old/big.bin'), os.path.join(self.client, 'new/big.bin'))
+        os.rmdir(os.path.join(self.client, 'old'))
+        shutil.rmtree(os.path.join(self.client, 'gone'))
+        self.write(self.client, 'copy.txt', b'same')
+        self.write(self.client, 'added/b.txt', b'b')
+
+    def write(self, root, path, data):
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def plan(self):
+        plan = self.sync.diff(self.server, self.sync.manifest(self.client)['entries'])
+        files = {}
+        for item in plan['upload']:
+            with open(os.path.join(self.client, item['path']), 'rb') as f:
+                files[item['path']] = [f.read()]
+        return plan, files
+
+    def staging_dirs(self):
+        return [name for name in os.listdir(self.server) if name.startswith(STAGING_PREFIX) and name != LOCK_NAME]
+
+    def test_apply_reuses_content_and_matches_client(self):
+        plan, files = self.plan()
+        self.assertEqual(plan['rename'], [['old/big.bin', 'new/big.bin']])
+        self.assertEqual(plan['copy'], [['keep.txt', 'copy.txt']])
+        self.assertEqual(sorted(item['path'] for item in plan['upload']), ['added/b.txt', 'edit.txt'])
+
+        result = self.sync.apply(self.server, plan, files)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(tree(self.server), tree(self.client))
+        self.assertEqual(self.staging_dirs(), [])
+
+        again, _ = self.plan()
+        self.assertEqual([again[key] for key in ('mkdir', 'upload', 'copy', 'rename', 'delete')], [[]] * 5)
+
+    def test_lock_file_is_not_part_of_the_manifest(self):
+        self.sync.apply(self.server, *self.plan())
+        self.assertTrue(os.path.exists(os.path.join(self.server, LOCK_NAME)))
+        paths = [item['path'] for item in self.sync.manifest(self.server)['entries']]
+        self.assertNotIn(LOCK_NAME, paths)
+        with self.assertRaises(UploadError):
+            self.sync.diff(self.server, [{'path': LOCK_NAME, 'sha256': '0' * 64}])
+
+    def test_reading_a_root_leaves_no_lock_file(self):
+        self.sync.manifest(self.server)
+        self.sync.diff(self.server, self.sync.manifest(self.client)['entries'])
+        self.assertNotIn(LOCK_NAME, os.listdir(self.server))
+
+    def test_file_created_at_a_target_is_a_conflict(self):
+        plan, files = self.plan()
+        self.write(self.server, 'added/b.txt', b'created on the server')
+        self.write(self.server, 'copy.txt', b'this one too')
+        before = tree(self.server)
+        with self.assertRaises(UploadError) as raised:
+            self.sync.apply(self.server, plan, files)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(sorted(raised.exception.details['conflicts']), ['added/b.txt', 'copy.txt'])
+        self.assertEqual(tree(self.server), before)
+
+    def test_directory_replaced_by_a_file_is_not_a_conflict(self):
+        self.write(self.client, 'gone', b'now a file')
+        plan, files = self.plan()
+        self.sync.apply(self.server, plan, files)
+        self.assertEqual(tree(self.server), tree(self.client))
+
+    def test_changed_file_is_a_conflict(self):
+        plan, files = self.plan()
+        self.write(self.server, 'gone/a.txt', b'edited on the server')
+        before = tree(self.server)
+        with self.assertRaises(UploadError) as raised:
+            self.sync.apply(self.server, plan, files)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(raised.exception.details['conflicts'], ['gone/a.txt'])
+        self.assertEqual(tree(self.server), before)
+
+    def test_checksum_mismatch_changes_nothing(self):
+        plan, files = self.plan()
+        files['edit.txt'] = [b'corrupted']
+        before = tree(self.server)
+        with self.assertRaises(UploadError) as raised:
+            self.sync.apply(self.server, plan, files)
+        self.assertEqual(raised.exception.status, 422)
+        self.assertEqual(tree(self.server), before)
+        self.assertEqual(self.staging_dirs(), [])
+
+    def test_failure_during_commit_is_rolled_back(self):
+        os.makedirs(os.path.join(self.server, 'blocked'))
+        plan = {'rename': [['keep.txt', 'moved.txt']], 'delete': ['gone'], 'mkdir': ['fresh/dir'],
+                'upload': [{'path': 'blocked', 'sha256': sha256(b'data'), 'size': 4}],
+                'expect': {'keep.txt': sha256(b'same')}}
+        before = tree(self.server)
+        with self.assertRaises(UploadError) as raised:
+            self.sync.apply(self.server, plan, {'blocked': [b'data']})
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(tree(self.server), before)
+        self.assertEqual(self.staging_dirs(), [])
+
+    def test_interrupted_apply_is_undone(self):
+        # What a process killed halfway through the commit leaves behind
+        staging = os.path.join(self.server, STAGING_PREFIX + 'crashed')
+        os.mkdir(staging)
+        source = os.path.join(self.server, 'edit.txt')
+        moved = os.path.join(staging, 'delete-0')
+        created = os.path.join(self.server, 'created')
+        with open(os.path.join(staging, JOURNAL), 'w') as journal:
+            journal.write(json.dumps(['move', source, moved]) + '\n')
+            journal.write(json.dumps(['mkdir', created, None]) + '\n')
+        os.rename(source, moved)
+        os.mkdir(created)
+
+        with root_lock(self.server):
+            # Left alone while an apply holds the root
+            self.sync.recover(self.server)
+            self.assertTrue(os.path.isdir(staging))
+        self.sync.manifest(self.server)
+        self.assertEqual(self.staging_dirs(), [])
+        self.assertFalse(os.path.exists(created))
+        with open(source, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+
+    def test_committed_apply_is_only_cleaned_up(self):
+        staging = os.path.join(self.server, STAGING_PREFIX + 'done')
+        os.mkdir(staging)
+        moved = os.path.join(staging, 'delete-0')
+        with open(os.path.join(staging, JOURNAL), 'w') as journal:
+            journal.write(json.dumps(['move', os.path.join(self.server, 'edit.txt'), moved]) + '\n')
+        os.rename(os.path.join(self.server, 'edit.txt'), moved)
+        open(os.path.join(staging, COMMITTED), 'w').close()
+        self.sync.recover(self.server)
+        self.assertEqual(self.staging_dirs(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.server, 'edit.txt')))
+
+    def test_applies_to_one_root_are_serialized(self):
+        plan, files = self.plan()
+        done = threading.Event()
+
+        def apply():
+            self.sync.apply(self.server, plan, files)
+            done.set()
+
+        with root_lock(self.server):
+            thread = threading.Thread(target=apply)
+            thread.start()
+            self.assertFalse(done.wait(0.3))
+            self.assertEqual(self.staging_dirs(), [])
+        thread.join(5)
+        self.assertTrue(done.is_set())
+        self.assertEqual(tree(self.server), tree(self.client))
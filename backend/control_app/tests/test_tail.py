@@ -0,0 +1,120 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from control_app import tail
+from control_app.tail import FileFollower, read_last_lines
+
+
+class ReadLastLinesTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def last_lines(self, data, count, max_bytes=1 << 20):
+        path = os.path.join(self.tmp, 'log')
+        with open(path, 'wb') as f:
+            f.write(data)
+        fd = os.open(path, os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        return read_last_lines(fd, len(data), count, max_bytes)
+
+    def test_last_lines(self):
+        self.assertEqual(self.last_lines(b'a\nb\nc\n', 2), (b'b\nc\n', 2))
+        self.assertEqual(self.last_lines(b'a\nb\nc', 2), (b'b\nc', 2))
+        self.assertEqual(self.last_lines(b'a\nb\n', 5), (b'a\nb\n', 0))
+        self.assertEqual(self.last_lines(b'a\n', 0), (b'', 2))
+        self.assertEqual(self.last_lines(b'', 3), (b'', 0))
+
+    def test_reads_back_across_blocks(self):
+        data = b''.join(b'%05d\n' % number for number in range(30000))
+        self.assertGreater(len(data), 2 * tail.BLOCK_SIZE)
+        lines, offset = self.last_lines(data, 20000)
+        self.assertEqual(offset, 6 * 10000)
+        self.assertTrue(lines.startswith(b'10000\n'))
+
+    def test_byte_limit(self):
+        lines, offset = self.last_lines(b'x' * 100 + b'\n', 1, max_bytes=10)
+        self.assertEqual((lines, offset), (b'x' * 9 + b'\n', 91))
+
+
+class FileFollowerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'app.log')
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.append(b'old\n')
+
+    def append(self, data, mode='ab'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def follower(self, **kwargs):
+        follower = FileFollower(self.path, os.path.getsize(self.path), **kwargs)
+        follower._open()
+        self.addCleanup(lambda: follower._file and follower._file.close())
+        return follower
+
+    def test_appended_data(self):
+        follower = self.follower()
+        self.assertEqual(follower._check(), ([], False))
+        self.append('né\n'.encode()[:2])
+        self.append('né\n'.encode()[2:])
+        self.assertEqual(follower._check(), ([{'type': 'data', 'text': 'né\n', 'offset': 8}], False))
+
+    def test_large_appends_come_in_batches(self):
+        follower = self.follower(max_batch=4)
+        self.append(b'abcdef')
+        self.assertEqual(follower._check(), ([{'type': 'data', 'text': 'abcd', 'offset': 8}], True))
+        self.assertEqual(follower._check(), ([{'type': 'data', 'text': 'ef', 'offset': 10}], False))
+
+    def test_truncation(self):
+        follower = self.follower()
+        self.append(b'', 'wb')
+        self.assertEqual(follower._check(), ([{'type': 'truncated', 'size': 0}], False))
+        self.append(b'new\n')
+        self.assertEqual(follower._check(), ([{'type': 'data', 'text': 'new\n', 'offset': 4}], False))
+        # Shrunk and rewritten between two checks
+        self.append(b'x\n', 'wb')
+        self.assertEqual(follower._check()[0], [{'type': 'truncated', 'size': 2},
+                                                {'type': 'data', 'text': 'x\n', 'offset': 2}])
+
+    def test_rotation_drains_the_old_file_first(self):
+        follower = self.follower()
+        self.append(b'last\n')
+        os.rename(self.path, self.path + '.1')
+        self.append(b'first\n')
+        self.assertEqual(follower._check(), ([{'type': 'data', 'text': 'last\n', 'offset': 9}], True))
+        self.assertEqual(follower._check()[0], [{'type': 'rotated'},
+                                                {'type': 'data', 'text': 'first\n', 'offset': 6}])
+
+    def test_removed_and_recreated(self):
+        follower = self.follower()
+        os.unlink(self.path)
+        self.assertEqual(follower._check(), ([{'type': 'rotated'}], False))
+        self.assertEqual(follower._check(), ([], False))
+        self.append(b'back\n')
+        self.assertEqual(follower._check()[0], [{'type': 'reopened'},
+                                                {'type': 'data', 'text': 'back\n', 'offset': 5}])
+
+    def test_follow_polls_without_a_watcher(self):
+        async def collect():
+            follower = FileFollower(self.path, 4, poll_interval=0.01, batch_interval=0)
+            events = []
+            stream = follower.follow()
+            async for event in stream:
+                events.append(event)
+                if event['type'] == 'idle' and len(events) == 1:
+                    self.append(b'more\n')
+                elif event['type'] == 'data':
+                    break
+            await stream.aclose()
+            return events, follower
+
+        events, follower = asyncio.run(collect())
+        self.assertEqual(events[-1], {'type': 'data', 'text': 'more\n', 'offset': 9})
+        self.assertFalse(follower.watching)
+        self.assertIsNone(follower.watch_manager)
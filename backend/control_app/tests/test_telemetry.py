@@ -0,0 +1,57 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from control_app.telemetry import TelemetrySampler
+
+
+class TelemetrySamplerTests(SimpleTestCase):
+    def sampler(self, **kwargs):
+        calls = []
+
+        def collect():
+            calls.append(threading.current_thread().name)
+            return {'sample': len(calls)}
+
+        sampler = TelemetrySampler(collect, interval=0.01, **kwargs)
+        self.addCleanup(sampler.stop)
+        return sampler, calls
+
+    def test_latest_is_served_from_the_sampler_thread(self):
+        primed = threading.Event()
+        sampler, calls = self.sampler(prime=primed.set)
+        snapshot, age = sampler.latest(timeout=2)
+        self.assertTrue(primed.is_set())
+        self.assertGreaterEqual(snapshot['sample'], 1)
+        self.assertGreaterEqual(age, 0)
+        self.assertEqual(set(calls), {'telemetry-sampler'})
+
+    def test_start_runs_one_thread(self):
+        sampler, _ = self.sampler()
+        sampler.start()
+        thread = sampler._thread
+        sampler.start()
+        self.assertIs(sampler._thread, thread)
+
+    def test_listeners_get_every_sample(self):
+        sampler, _ = self.sampler()
+        received = []
+
+        def failing(snapshot, sampled_at):
+            raise RuntimeError('listener bug')
+
+        sampler.subscribe(failing)
+        sampler.subscribe(lambda snapshot, sampled_at: received.append(snapshot))
+        with self.assertLogs('control_app.telemetry', 'ERROR'):
+            self.assertEqual(sampler.sample(), {'sample': 1})
+        # A failing listener neither stops the sample nor the other listeners
+        self.assertEqual(received, [{'sample': 1}])
+        sampler.unsubscribe(failing)
+        sampler.unsubscribe(failing)
+        sampler.sample()
+        self.assertEqual(received, [{'sample': 1}, {'sample': 2}])
+
+    def test_no_snapshot_before_the_first_sample(self):
+        sampler = TelemetrySampler(lambda: threading.Event().wait(1) or {}, interval=10)
+        self.addCleanup(sampler.stop)
+        self.assertEqual(sampler.latest(timeout=0.01), (None, None))
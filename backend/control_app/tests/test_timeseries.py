@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+
+from control_app.timeseries import MetricHistory
+
+
+class MetricHistoryTests(SimpleTestCase):
+    def setUp(self):
+        self.history = MetricHistory(4, {'cpu': ['total'], 'net': ['sent', 'recv']})
+
+    def test_memory_is_fixed_at_construction(self):
+        self.assertEqual(self.history.memory_usage(), 4 * (8 + 4 * 3))
+        for i in range(10):
+            self.history.append(float(i), {'cpu': [i]})
+        self.assertEqual(self.history.memory_usage(), 4 * (8 + 4 * 3))
+
+    def test_oldest_samples_are_overwritten(self):
+        for i in range(6):
+            self.history.append(float(i), {'cpu': [i * 10], 'net': [i, i + 1]})
+        self.assertEqual(len(self.history), 4)
+        result = self.history.query('net')
+        self.assertEqual(result['columns'], ['sent', 'recv'])
+        self.assertEqual(result['points'], [[2.0, 2, 3], [3.0, 3, 4], [4.0, 4, 5], [5.0, 5, 6]])
+
+    def test_missing_metrics_are_zero(self):
+        self.history.append(1.0, {'net': [7]})
+        self.assertEqual(self.history.query('cpu')['points'], [[1.0, 0]])
+        self.assertEqual(self.history.query('net')['points'], [[1.0, 7, 0]])
+
+    def test_time_range(self):
+        for i in range(4):
+            self.history.append(float(i), {'cpu': [i]})
+        points = self.history.query('cpu', since=1, until=2)['points']
+        self.assertEqual(points, [[1.0, 1], [2.0, 2]])
+        self.assertEqual(self.history.query('cpu', since=10)['points'], [])
+
+    def test_steps_average_buckets(self):
+        history = MetricHistory(100, {'cpu': ['total']})
+        for i in range(10):
+            history.append(float(i), {'cpu': [i]})
+        points = history.query('cpu', step=5)['points']
+        self.assertEqual(points, [[0.0, 2.0], [5.0, 7.0]])
+        self.assertEqual(history.query('cpu', since=3, until=6, step=5)['points'], [[0.0, 3.5], [5.0, 5.5]])
+
+    def test_unknown_metric(self):
+        with self.assertRaises(KeyError):
+            self.history.query('disk')
+        with self.assertRaises(ValueError):
+            MetricHistory(0, {})
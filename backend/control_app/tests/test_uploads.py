@@ -0,0 +1,180 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+
+from control_app.uploads import UploadError, UploadManager, add_range, missing_ranges
+
+
+class RangeTests(SimpleTestCase):
+    def test_add_range_merges_overlapping_and_adjacent(self):
+        ranges = []
+        for start, end in [(10, 20), (0, 5), (5, 8), (15, 30), (40, 50)]:
+            ranges = add_range(ranges, start, end)
+        self.assertEqual(ranges, [[0, 8], [10, 30], [40, 50]])
+        self.assertEqual(add_range(ranges, 8, 10), [[0, 30], [40, 50]])
+
+    def test_missing_ranges(self):
+        self.assertEqual(missing_ranges([], 10), [[0, 10]])
+        self.assertEqual(missing_ranges([[2, 4], [6, 10]], 12), [[0, 2], [4, 6], [10, 12]])
+        self.assertEqual(missing_ranges([[0, 12]], 12), [])
+
+
+class UploadManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.target = os.path.join(self.tmp, 'target')
+        os.mkdir(self.target)
+        self.manager = UploadManager(os.path.join(self.tmp, 'state'), chunk_size=4)
+        self.data = bytes(range(256)) * 40
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    def create(self, **kwargs):
+        return self.manager.create(self.target, 'file.bin', len(self.data), **kwargs)['upload_id']
+
+    def send(self, upload_id, start, end):
+        return self.manager.write(upload_id, start, io.BytesIO(self.data[start:end]), end - start)
+
+    def test_out_of_order_chunks_complete_the_file(self):
+        upload_id = self.create(sha256=self.sha256)
+        self.send(upload_id, 5000, len(self.data))
+        status = self.send(upload_id, 0, 2000)
+        self.assertEqual(status['missing'], [[2000, 5000]])
+        self.assertFalse(status['complete'])
+        self.assertTrue(self.send(upload_id, 2000, 5000)['complete'])
+
+        result = self.manager.finalize(upload_id)
+        self.assertEqual(result['sha256'], self.sha256)
+        with open(os.path.join(self.target, 'file.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(self.target), ['file.bin'])
+        with self.assertRaises(UploadError) as raised:
+            self.manager.status(upload_id)
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_cut_off_chunk_keeps_what_arrived(self):
+        upload_id = self.create()
+        with self.assertRaises(UploadError) as raised:
+            # The connection drops after 3000 of the announced 6000 bytes
+            self.manager.write(upload_id, 0, io.BytesIO(self.data[:3000]), 6000)
+        self.assertEqual(raised.exception.details['missing'], [[3000, len(self.data)]])
+        # Resume from where the status says the data stops
+        missing = self.manager.status(upload_id)['missing']
+        for start, end in missing:
+            self.send(upload_id, start, end)
+        self.manager.finalize(upload_id, sha256=self.sha256)
+        with open(os.path.join(self.target, 'file.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_incomplete_upload_cannot_be_finalized(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, 100)
+        with self.assertRaises(UploadError) as raised:
+            self.manager.finalize(upload_id)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(raised.exception.details['missing'], [[100, len(self.data)]])
+
+    def test_checksum_mismatch_resets_the_upload(self):
+        upload_id = self.create(sha256='0' * 64)
+        self.send(upload_id, 0, len(self.data))
+        with self.assertRaises(UploadError) as raised:
+            self.manager.finalize(upload_id)
+        self.assertEqual(raised.exception.status, 422)
+        self.assertEqual(raised.exception.details['actual'], self.sha256)
+        self.assertEqual(self.manager.status(upload_id)['missing'], [[0, len(self.data)]])
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'file.bin')))
+
+    def test_chunk_outside_the_file_is_rejected(self):
+        upload_id = self.create()
+        with self.assertRaises(UploadError) as raised:
+            self.manager.write(upload_id, len(self.data) - 1, io.BytesIO(b'ab'), 2)
+        self.assertEqual(raised.exception.status, 416)
+
+    def test_abort_removes_the_part_file(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, 100)
+        self.assertEqual(self.manager.abort(upload_id), {'status': 'success'})
+        self.assertEqual(os.listdir(self.target), [])
+        with self.assertRaises(UploadError) as raised:
+            self.manager.status(upload_id)
+        self.assertEqual(raised.exception.status, 404)
+
+    def test_finalize_waits_for_chunks_in_flight(self):
+        upload_id = self.create(sha256=self.sha256)
+        self.send(upload_id, 100, len(self.data))
+        release = threading.Event()
+        reading = threading.Event()
+        data = self.data
+
+        class SlowStream:
+            def read(self, size):
+                reading.set()
+                release.wait(5)
+                return data[:100]
+
+        writer = threading.Thread(target=self.manager.write, args=(upload_id, 0, SlowStream(), 100))
+        writer.start()
+        self.assertTrue(reading.wait(5))
+        result = {}
+        finalizer = threading.Thread(target=lambda: result.update(self.manager.finalize(upload_id)))
+        finalizer.start()
+        finalizer.join(0.3)
+        self.assertTrue(finalizer.is_alive())
+        # New chunks are turned away once finalizing started
+        with self.assertRaises(UploadError) as raised:
+            self.send(upload_id, 0, 100)
+        self.assertEqual(raised.exception.status, 409)
+        release.set()
+        writer.join(5)
+        finalizer.join(5)
+        self.assertEqual(result['sha256'], self.sha256)
+
+    def test_late_chunk_after_finalize_is_not_found(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, len(self.data))
+        self.manager.finalize(upload_id)
+        with self.assertRaises(UploadError) as raised:
+            self.send(upload_id, 0, 100)
+        self.assertEqual(raised.exception.status, 404)
+        with open(os.path.join(self.target, 'file.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_failed_finalize_accepts_chunks_again(self):
+        upload_id = self.create()
+        self.send(upload_id, 0, 100)
+        with self.assertRaises(UploadError):
+            self.manager.finalize(upload_id)
+        self.send(upload_id, 100, len(self.data))
+        self.assertEqual(self.manager.finalize(upload_id)['size'], len(self.data))
+
+    def test_lock_file_outlives_the_session_until_pruned(self):
+        upload_id = self.create()
+        self.manager.abort(upload_id)
+        lock_path = os.path.join(self.manager.state_dir, upload_id + '.lock')
+        self.assertTrue(os.path.exists(lock_path))
+        self.manager.prune()
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_invalid_ids_are_not_found(self):
+        for upload_id in ('', '../../etc/passwd', 'A' * 32):
+            with self.assertRaises(UploadError) as raised:
+                self.manager.status(upload_id)
+            self.assertEqual(raised.exception.status, 404)
+
+    def test_invalid_names_are_rejected(self):
+        for filename in ('', '..', 'a/b'):
+            with self.assertRaises(UploadError):
+                self.manager.create(self.target, filename, 1)
+
+    def test_stale_sessions_are_pruned(self):
+        upload_id = self.create()
+        self.manager.ttl = -1
+        self.manager.prune()
+        with self.assertRaises(UploadError):
+            self.manager.status(upload_id)
+        self.assertEqual(os.listdir(self.target), [])
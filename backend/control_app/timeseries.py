@@ -0,0 +1,102 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Optional, Sequence
+
+
+class MetricHistory:
+    """Fixed-capacity ring buffer of numeric samples sharing one time axis
+
+    Timestamps are stored as doubles and values as 32-bit floats in flat
+    preallocated arrays, so memory use is fixed at construction:
+    capacity * (8 + 4 * total_columns) bytes.
+    """
+
+    def __init__(self, capacity: int, metrics: Dict[str, Sequence[str]]):
+        if capacity < 1:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.columns = {name: tuple(cols) for name, cols in metrics.items()}
+        self._times = array('d', bytes(8 * capacity))
+        self._values = {
+            name: array('f', bytes(4 * capacity * len(cols)))
+            for name, cols in self.columns.items()
+        }
+        self._head = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def memory_usage(self) -> int:
+        """Bytes held by the sample arrays"""
+        total = self._times.buffer_info()[1] * self._times.itemsize
+        for values in self._values.values():
+            total += values.buffer_info()[1] * values.itemsize
+        return total
+
+    def append(self, timestamp: float, samples: Dict[str, Sequence[float]]):
+        """Record one sample; metrics missing from samples are stored as 0"""
+        with self._lock:
+            i = self._head
+            self._times[i] = timestamp
+            for name, values in self._values.items():
+                width = len(self.columns[name])
+                row = samples.get(name) or ()
+                base = i * width
+                for k in range(width):
+                    values[base + k] = row[k] if k < len(row) else 0.0
+            self._head = (i + 1) % self.capacity
+            if self._size < self.capacity:
+                self._size += 1
+
+    def _ordered(self, name: str):
+        """Copy the buffer into chronological order (oldest first)"""
+        width = len(self.columns[name])
+        values = self._values[name]
+        start = (self._head - self._size) % self.capacity
+        end = start + self._size
+        if end <= self.capacity:
+            return self._times[start:end], values[start * width:end * width]
+        wrap = end - self.capacity
+        return (self._times[start:] + self._times[:wrap],
+                values[start * width:] + values[:wrap * width])
+
+    def query(self, name: str, since: Optional[float] = None, until: Optional[float] = None,
+              step: Optional[float] = None) -> Dict[str, object]:
+        """Return samples of one metric in [since, until], averaged into step-second buckets"""
+        if name not in self.columns:
+            raise KeyError(name)
+        width = len(self.columns[name])
+        with self._lock:
+            times, values = self._ordered(name)
+
+        lo = bisect_left(times, since) if since is not None else 0
+        hi = bisect_right(times, until) if until is not None else len(times)
+        points = []
+        if step is None or step <= 0:
+            for i in range(lo, hi):
+                row = values[i * width:(i + 1) * width]
+                points.append([times[i]] + [round(v, 2) for v in row])
+        else:
+            i = lo
+            while i < hi:
+                bucket_start = (times[i] // step) * step
+                j = min(bisect_left(times, bucket_start + step, i, hi), hi)
+                if j <= i:
+                    j = i + 1
+                count = j - i
+                row = [bucket_start]
+                for k in range(width):
+                    # Strided slices keep the per-column sums in C
+                    row.append(round(sum(values[i * width + k:j * width:width]) / count, 2))
+                points.append(row)
+                i = j
+
+        return {
+            'metric': name,
+            'columns': list(self.columns[name]),
+            'step': step,
+            'points': points
+        }
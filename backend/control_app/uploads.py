@@ -0,0 +1,315 @@
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+BLOCK_SIZE = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+_SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def add_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Merge [start, end) into a sorted list of disjoint ranges"""
+    merged = []
+    for first, last in sorted(ranges + [[start, end]]):
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def preallocate(fd: int, size: int):
+    """Reserve size bytes up front so a full disk fails the upload at creation"""
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        # Filesystems without fallocate (tmpfs on old kernels, some FUSE/NFS)
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            raise
+        os.ftruncate(fd, size)
+
+
+class UploadManager:
+    """Resumable chunked uploads written in place with pwrite
+
+    A session preallocates a `.part` file next to its target (or in
+    state_dir when the move needs sudo) and records which byte ranges have
+    arrived in a small JSON file. Chunks may arrive in any order, in
+    parallel, and from any worker process; a chunk cut off mid-transfer
+    still counts for the bytes that reached the disk. Each chunk is copied
+    in BLOCK_SIZE pieces, so memory stays constant whatever the file size.
+
+    Writers hold a shared flock on the `.part` file while they copy.
+    finalize() marks the session as finalizing, so no new chunk is
+    accepted, and takes the exclusive flock to wait for the chunks already
+    in flight before it hashes and renames the file.
+    """
+
+    def __init__(self, state_dir: str, ttl: float = 24 * 3600, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.state_dir = os.path.expanduser(state_dir)
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+
+    def _path(self, upload_id: str, suffix: str) -> str:
+        if not _SESSION_ID.match(upload_id or ''):
+            raise UploadError('Upload not found', 404)
+        return os.path.join(self.state_dir, upload_id + suffix)
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """Yield the session's metadata under an exclusive lock shared by all workers"""
+        lock_path = self._path(upload_id, '.lock')
+        meta_path = self._path(upload_id, '.json')
+        if not os.path.exists(meta_path):
+            raise UploadError('Upload not found', 404)
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                raise UploadError('Upload not found', 404)
+            yield meta
+
+    def _save(self, meta: Dict[str, Any]):
+        meta['updated'] = time.time()
+        meta_path = self._path(meta['id'], '.json')
+        temp_path = meta_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, meta_path)
+
+    def _remove(self, meta: Dict[str, Any], keep_part: bool = False):
+        # The .lock file stays: another worker may be waiting on it. prune() drops it
+        # once the session is gone.
+        paths = [self._path(meta['id'], '.json')]
+        if not keep_part:
+            paths.append(meta['part_path'])
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _describe(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        received = sum(end - start for start, end in meta['received'])
+        missing = missing_ranges(meta['received'], meta['size'])
+        return {
+            'upload_id': meta['id'],
+            'path': meta['target_path'],
+            'size': meta['size'],
+            'chunk_size': meta['chunk_size'],
+            'received': received,
+            'missing': missing,
+            'complete': not missing,
+        }
+
+    def prune(self):
+        """Drop sessions that have not received data for longer than ttl"""
+        try:
+            names = os.listdir(self.state_dir)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - self.ttl
+        for name in names:
+            upload_id, extension = os.path.splitext(name)
+            if not _SESSION_ID.match(upload_id):
+                continue
+            if extension == '.lock' and upload_id + '.json' not in names:
+                # Lock file of a finished or aborted session
+                try:
+                    os.unlink(os.path.join(self.state_dir, name))
+                except FileNotFoundError:
+                    pass
+                continue
+            if extension != '.json':
+                continue
+            try:
+                with self._locked(upload_id) as meta:
+                    if meta['updated'] < cutoff:
+                        self._remove(meta)
+            except (UploadError, OSError, ValueError):
+                continue
+
+    def create(self, directory: str, filename: str, size: int, sha256: Optional[str] = None,
+               use_sudo: bool = False) -> Dict[str, Any]:
+        directory = os.path.expanduser(directory)
+        if not filename or filename in ('.', '..') or '/' in filename or '\0' in filename:
+            raise UploadError('Invalid filename')
+        if size < 0:
+            raise UploadError('size must not be negative')
+        if sha256 is not None and not _SHA256.match(sha256.lower()):
+            raise UploadError('sha256 must be 64 hex digits')
+        if not os.path.exists(directory):
+            raise UploadError('Target directory does not exist')
+        if not os.path.isdir(directory):
+            raise UploadError('Target path is not a directory')
+
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        if use_sudo:
+            # The finished file is moved into place by `sudo mv`
+            part_path = self._path(upload_id, '.part')
+        else:
+            # Same directory as the target, so finishing is an atomic rename
+            part_path = os.path.join(directory, f'.{filename}.{upload_id}.part')
+
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            preallocate(fd, size)
+        except OSError:
+            os.close(fd)
+            os.unlink(part_path)
+            raise
+        os.close(fd)
+
+        meta = {
+            'id': upload_id,
+            'target_path': os.path.join(directory, filename),
+            'part_path': part_path,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'sha256': sha256.lower() if sha256 else None,
+            'use_sudo': use_sudo,
+            'received': [],
+            'created': time.time(),
+        }
+        self._save(meta)
+        return self._describe(meta)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        with self._locked(upload_id) as meta:
+            return self._describe(meta)
+
+    def write(self, upload_id: str, offset: int, stream, length: int) -> Dict[str, Any]:
+        """Copy length bytes from stream to offset of the upload"""
+        with self._locked(upload_id) as meta:
+            if meta.get('finalizing'):
+                raise UploadError('Upload is being finalized', 409)
+            size, part_path = meta['size'], meta['part_path']
+            if offset < 0 or length < 0 or offset + length > size:
+                raise UploadError(f'Chunk {offset}+{length} is outside the file (size {size})', 416)
+            fd = os.open(part_path, os.O_WRONLY)
+            # Taken under the session lock, so finalize() cannot slip in between
+            fcntl.flock(fd, fcntl.LOCK_SH)
+
+        written = 0
+        try:
+            while written < length:
+                block = stream.read(min(BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                view = memoryview(block)
+                while view:
+                    count = os.pwrite(fd, view, offset + written)
+                    view = view[count:]
+                    written += count
+        finally:
+            try:
+                # Record whatever reached the file, even if the connection dropped,
+                # before finalize() may check what is missing
+                if written:
+                    with self._locked(upload_id) as meta:
+                        meta['received'] = add_range(meta['received'], offset, offset + written)
+                        self._save(meta)
+            finally:
+                os.close(fd)
+
+        with self._locked(upload_id) as meta:
+            result = self._describe(meta)
+        if written < length:
+            raise UploadError(f'Chunk ended after {written} of {length} bytes', 400, **result)
+        return result
+
+    def _set_finalizing(self, upload_id: str, finalizing: bool):
+        with self._locked(upload_id) as meta:
+            meta['finalizing'] = finalizing
+            self._save(meta)
+            return meta['part_path']
+
+    def finalize(self, upload_id: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Verify the upload and move it to its target path"""
+        part_path = self._set_finalizing(upload_id, True)
+        done = False
+        try:
+            with open(part_path, 'rb') as f:
+                # Wait for the chunks still being written
+                fcntl.flock(f, fcntl.LOCK_EX)
+                with self._locked(upload_id) as meta:
+                    missing = missing_ranges(meta['received'], meta['size'])
+                    if missing:
+                        raise UploadError('Upload is incomplete', 409, missing=missing)
+                    expected = (sha256 or meta['sha256'] or '').lower() or None
+                    if expected is not None and not _SHA256.match(expected):
+                        raise UploadError('sha256 must be 64 hex digits')
+
+                    digest = hashlib.sha256()
+                    while True:
+                        block = f.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        digest.update(block)
+                    os.fsync(f.fileno())
+                    actual = digest.hexdigest()
+                    if expected is not None and actual != expected:
+                        # No way to tell which chunk was corrupted: the client has to send it all again
+                        meta['received'] = []
+                        meta['finalizing'] = False
+                        self._save(meta)
+                        done = True
+                        raise UploadError('Checksum mismatch', 422, expected=expected, actual=actual)
+
+                    target_path = meta['target_path']
+                    if meta['use_sudo']:
+                        subprocess.run(['sudo', 'mv', part_path, target_path], check=True)
+                        subprocess.run(['sudo', 'chmod', '644', target_path], check=True)
+                    else:
+                        os.replace(part_path, target_path)
+                    self._remove(meta, keep_part=True)
+                    done = True
+                    return {'status': 'success', 'path': target_path, 'size': meta['size'], 'sha256': actual}
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        finally:
+            if not done:
+                try:
+                    self._set_finalizing(upload_id, False)
+                except UploadError:
+                    pass
+
+    def abort(self, upload_id: str) -> Dict[str, Any]:
+        with self._locked(upload_id) as meta:
+            self._remove(meta)
+        return {'status': 'success'}
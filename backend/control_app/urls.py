@@ -11,20 +11,42 @@ urlpatterns = [
     path('disconnect/', views.disconnect, name='disconnect'),
 
     # File System Operations
-    path('list-directory/', views.list_directory, name='list_directory'),
+    path('list-directory/', views.directory, name='list_directory'),
+    path('list-directory/cache-stats/', views.directory_cache_stats, name='directory_cache_stats'),
     path('file-info/', views.file_info, name='file_info'),
+    path('disk-usage/', views.disk_usage, name='disk_usage'),
     path('read-file/', views.read_file, name='read_file'),
+    path('tail/', views.tail, name='tail'),
     path('write-file/', views.write_file, name='write_file'),
     path('create-dir/', views.create_directory, name='create_directory'),
     path('delete-item/', views.delete_item, name='delete_item'),
     path('download-file/', views.download_file, name='download_file'),
+    path('download-item/', views.download_item, name='download_item'),
     path('upload-file/', views.upload_file, name='upload_file'),
-    path('extract-zip/', views.extract_zip, name='extract_zip'),
+    path('uploads/', views.upload_sessions, name='upload_sessions'),
+    path('uploads/<str:upload_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<str:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
+    path('dedup/manifest/', views.chunk_manifest, name='chunk_manifest'),
+    path('dedup/uploads/', views.dedup_uploads, name='dedup_uploads'),
+    path('dedup/uploads/<str:upload_id>/', views.dedup_upload, name='dedup_upload'),
+    path('dedup/uploads/<str:upload_id>/chunks/<str:digest>/', views.dedup_chunk, name='dedup_chunk'),
+    path('dedup/uploads/<str:upload_id>/commit/', views.dedup_commit, name='dedup_commit'),
+    path('sync/manifest/', views.sync_manifest, name='sync_manifest'),
+    path('sync/diff/', views.sync_diff, name='sync_diff'),
+    path('sync/apply/', views.sync_apply, name='sync_apply'),
+    path('extract-zip/', views.extract_zip_file, name='extract_zip'),
 
     # System Information
     path('system-info/', views.system_info, name='system_info'),
+    path('metrics/history/', views.metrics_history, name='metrics_history'),
+    path('events/', views.events, name='events'),
+    path('watch-directory/', views.watch_directory, name='watch_directory'),
     path('running-processes/', views.running_processes, name='running_processes'),
+    path('process-tree/', views.process_tree, name='process_tree'),
     path('kill-process/', views.kill_process, name='kill_process'),
-    path('list-applications/', views.list_applications, name='list_applications'),
+    path('list-applications/', views.applications, name='list_applications'),
+    path('applications/search/', views.application_search, name='application_search'),
+    path('search/files/', views.file_search, name='file_search'),
+    path('search/content/', views.content_search, name='content_search'),
     path('launch-application/', views.launch_application, name='launch_application'),
 ] 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.http import JsonResponse, FileResponse, HttpResponse
+from django.http import JsonResponse, FileResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view, permission_classes
@@ -7,30 +7,64 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 import json
 import logging
 import os
+import time
+from django.conf import settings
 from .discovery import DeviceDiscovery
+from .downloads import serve_file
+from .streaming import stream_content
+from .streams import directory_watcher, hub
 from .agent import (
     get_system_info,
+    get_metrics_history,
     get_running_processes,
+    get_process_changes,
+    query_running_processes,
+    get_process_tree,
     list_applications,
+    search_applications,
     list_directory,
+    list_directory_page,
+    get_directory_cache_stats,
+    search_files,
+    search_file_contents,
     launch_application as launch_app,
     read_file_content,
+    tail_file,
+    follow_file,
     write_file_content,
     delete_file,
     create_directory,
     get_file_info,
-    create_zip_archive,
+    get_disk_usage,
+    stream_disk_usage,
+    archive_directory,
     handle_file_upload,
+    create_upload,
+    get_upload_status,
+    write_upload_chunk,
+    finalize_upload,
+    abort_upload,
+    get_chunk_manifest,
+    create_dedup_upload,
+    get_dedup_upload_status,
+    put_dedup_chunk,
+    commit_dedup_upload,
+    abort_dedup_upload,
+    get_sync_manifest,
+    diff_sync,
+    apply_sync,
     extract_zip,
     take_screenshot,
     get_music_players,
     control_music_player,
     get_local_music,
     play_local_file,
-    kill_process,
+    kill_process as kill_proc,
     open_application,
     open_file
 )
@@ -178,16 +212,174 @@ def system_info(request):
         logger.error(f"Error getting system info: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def metrics_history(request):
+    """Get downsampled history of a host metric"""
+    try:
+        params = {}
+        for name in ('since', 'until', 'step'):
+            if request.GET.get(name):
+                params[name] = float(request.GET[name])
+        if request.GET.get('points'):
+            params['points'] = min(int(request.GET['points']), 5000)
+    except ValueError:
+        return JsonResponse({'error': 'since, until, step and points must be numbers'}, status=400)
+    if params.get('points', 1) < 1:
+        # 0 or less would skip downsampling and return the whole buffer
+        return JsonResponse({'error': 'points must be at least 1'}, status=400)
+    try:
+        result = get_metrics_history(request.GET.get('metric', 'cpu'), **params)
+        if 'error' in result:
+            return JsonResponse(result, status=400)
+        return JsonResponse(result)
+    except Exception as e:
+        logger.error(f"Error getting metrics history: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+PROCESS_QUERY_PARAMS = ('sort', 'order', 'limit', 'offset', 'user', 'name~', 'top')
+
+def _has_valid_token(request):
+    """Check a JWT from the Authorization header or the token query parameter"""
+    # EventSource cannot send headers, so streams also accept ?token=
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    raw_token = header[7:] if header.startswith('Bearer ') else request.GET.get('token')
+    if not raw_token:
+        return False
+    try:
+        JWTAuthentication().get_validated_token(raw_token)
+        return True
+    except InvalidToken:
+        return False
+
+async def _event_stream(topics):
+    subscription = hub.subscribe(topics)
+    keepalive = getattr(settings, 'STREAM_KEEPALIVE', 15)
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            frames = await subscription.get(timeout=keepalive)
+            if not frames:
+                yield b': keepalive\n\n'
+                continue
+            for frame in frames.values():
+                yield frame
+    finally:
+        hub.unsubscribe(subscription)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def events(request):
+    """Stream live updates for the requested topics as Server-Sent Events"""
+    if not _has_valid_token(request):
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+
+    topics = [topic for topic in request.GET.get('topics', 'system').split(',') if topic]
+    unknown = set(topics) - set(hub.collectors)
+    if unknown:
+        return JsonResponse({
+            'error': f"Unknown topics: {', '.join(sorted(unknown))}",
+            'topics': list(hub.collectors)
+        }, status=400)
+
+    response = StreamingHttpResponse(stream_content(request, _event_stream(topics)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def _directory_stream(subscription):
+    keepalive = getattr(settings, 'STREAM_KEEPALIVE', 15)
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            frames = await subscription.get(timeout=keepalive)
+            if not frames:
+                yield b': keepalive\n\n'
+                continue
+            for frame in frames:
+                yield frame
+    finally:
+        directory_watcher.unsubscribe(subscription)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def watch_directory(request):
+    """Stream batched created/deleted/modified/moved events for directories"""
+    if not _has_valid_token(request):
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+
+    paths = [os.path.abspath(os.path.expanduser(path)) for path in request.GET.getlist('path') if path]
+    if not paths:
+        return JsonResponse({'error': 'path is required'}, status=400)
+    missing = [path for path in paths if not os.path.isdir(path)]
+    if missing:
+        return JsonResponse({'error': f"Not a directory: {', '.join(missing)}"}, status=400)
+
+    try:
+        subscription = directory_watcher.subscribe(paths)
+    except OSError as e:
+        # No inotify here, or fs.inotify.max_user_watches is used up
+        return JsonResponse({'error': str(e)}, status=503)
+
+    response = StreamingHttpResponse(stream_content(request, _directory_stream(subscription)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def running_processes(request):
     try:
+        # Versioned mode: ?since=<version> (empty for the first call) returns
+        # only added/removed/changed processes relative to that version
+        if 'since' in request.GET:
+            return JsonResponse(get_process_changes(request.GET.get('since') or None))
+
+        # ?sort=cpu|mem|pid|name&order=&limit=&offset=&user=&name~=<regex>&top=N
+        if any(param in request.GET for param in PROCESS_QUERY_PARAMS):
+            try:
+                filters = {
+                    'sort': request.GET.get('sort') or None,
+                    'order': request.GET.get('order') or None,
+                    'user': request.GET.get('user') or None,
+                    'name_pattern': request.GET.get('name~') or None,
+                    'offset': max(0, int(request.GET.get('offset') or 0))
+                }
+                for name in ('limit', 'top'):
+                    if request.GET.get(name):
+                        filters[name] = max(0, int(request.GET[name]))
+            except ValueError:
+                return JsonResponse({'error': 'offset, limit and top must be integers'}, status=400)
+            result = query_running_processes(**filters)
+            if 'error' in result:
+                return JsonResponse(result, status=400)
+            return JsonResponse(result)
+
         processes = get_running_processes()
         return JsonResponse({'processes': processes})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def process_tree(request):
+    """Get running processes as a parent/child tree"""
+    try:
+        root = int(request.GET['root']) if request.GET.get('root') else None
+        depth = int(request.GET['depth']) if request.GET.get('depth') else None
+    except ValueError:
+        return JsonResponse({'error': 'root and depth must be integers'}, status=400)
+    try:
+        result = get_process_tree(root, depth)
+        if 'error' in result:
+            return JsonResponse(result, status=404)
+        return JsonResponse(result)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @csrf_exempt
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -198,6 +390,81 @@ def applications(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def application_search(request):
+    """Search installed applications, returning the best matches first"""
+    try:
+        limit = min(max(int(request.GET.get('limit') or 10), 1), 100)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    try:
+        apps = search_applications(request.GET.get('q', ''), limit)
+        return JsonResponse({'applications': apps})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def file_search(request):
+    """Search file names under the indexed roots"""
+    query = request.GET.get('q', '')
+    if not query:
+        return JsonResponse({'error': 'q is required'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit') or 100), 1), 1000)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    try:
+        result = search_files(query, request.GET.get('root') or None, limit)
+        if 'error' in result:
+            return JsonResponse(result, status=500)
+        return JsonResponse(result)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def _ndjson(results):
+    try:
+        for result in results:
+            yield json.dumps(result) + '\n'
+    except Exception as e:
+        yield json.dumps({'error': str(e)}) + '\n'
+    finally:
+        # Runs on client disconnect too, which cancels the queued work
+        results.close()
+
+@csrf_exempt
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def content_search(request):
+    """Stream matches of a pattern in files under root as NDJSON"""
+    root = request.GET.get('root')
+    pattern = request.GET.get('pattern')
+    if not root or not pattern:
+        return JsonResponse({'error': 'root and pattern are required'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit') or 1000), 1), 100000)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    try:
+        results = search_file_contents(
+            root,
+            pattern,
+            regex=request.GET.get('regex', 'false').lower() == 'true',
+            case_sensitive=request.GET.get('case_sensitive', 'false').lower() == 'true',
+            limit=limit,
+            use_gitignore=request.GET.get('gitignore', 'true').lower() != 'false'
+        )
+        if isinstance(results, dict):
+            return JsonResponse(results, status=400)
+        response = StreamingHttpResponse(stream_content(request, _ndjson(results)), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -231,8 +498,38 @@ def open_file_handler(request):
 def directory(request):
     try:
         path = request.GET.get('path', '~')
-        contents = list_directory(path)
-        return JsonResponse({'contents': contents}, safe=True)
+        try:
+            offset = max(0, int(request.GET.get('offset') or 0))
+            limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        except ValueError:
+            return JsonResponse({'error': 'offset and limit must be integers'}, status=400)
+        fields = request.GET.get('fields')
+        result = list_directory_page(
+            path,
+            sort=request.GET.get('sort') or None,
+            order=request.GET.get('order', 'asc'),
+            offset=offset,
+            limit=max(0, limit) if limit is not None else None,
+            show_hidden=request.GET.get('show_hidden', 'true').lower() != 'false',
+            fields=fields.split(',') if fields else None
+        )
+        if 'error' in result:
+            return JsonResponse(result, status=400 if 'sort_keys' in result else 500)
+        return JsonResponse({
+            'contents': result['items'],
+            'total': result['total'],
+            'offset': result['offset'],
+            'limit': result['limit'],
+            'next_offset': result['next_offset']
+        })
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def directory_cache_stats(request):
+    try:
+        return JsonResponse(get_directory_cache_stats())
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -244,13 +541,60 @@ def read_file(request):
         if not file_path:
             return JsonResponse({'error': 'path is required'}, status=400)
             
-        result = read_file_content(file_path)
+        # ?offset=&length= reads a byte range, ?from_line=&lines= a page of lines
+        try:
+            ranges = {name: int(request.GET[name]) for name in ('offset', 'length', 'from_line', 'lines')
+                      if request.GET.get(name)}
+        except ValueError:
+            return JsonResponse({'error': 'offset, length, from_line and lines must be integers'}, status=400)
+        result = read_file_content(file_path, **ranges)
         if 'error' in result:
             return JsonResponse(result, status=500)
         return JsonResponse(result)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+async def _tail_stream(initial, follower):
+    keepalive = getattr(settings, 'STREAM_KEEPALIVE', 15)
+    last_sent = time.monotonic()
+    yield b'retry: 5000\n\n'
+    yield f"event: data\ndata: {json.dumps({'text': initial['content'], 'offset': initial['size']})}\n\n".encode()
+    async for event in follower.follow():
+        kind = event.pop('type')
+        if kind == 'idle':
+            if time.monotonic() - last_sent >= keepalive:
+                last_sent = time.monotonic()
+                yield b': keepalive\n\n'
+            continue
+        last_sent = time.monotonic()
+        yield f"event: {kind}\ndata: {json.dumps(event)}\n\n".encode()
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def tail(request):
+    """Last lines of a file; with follow=true, keep streaming appended data as Server-Sent Events"""
+    if not _has_valid_token(request):
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+    file_path = request.GET.get('path')
+    if not file_path:
+        return JsonResponse({'error': 'path is required'}, status=400)
+    try:
+        lines = min(max(int(request.GET.get('lines') or 200), 0), 100000)
+    except ValueError:
+        return JsonResponse({'error': 'lines must be an integer'}, status=400)
+
+    result = tail_file(file_path, lines)
+    if 'error' in result:
+        return JsonResponse(result, status=500)
+    if request.GET.get('follow', 'false').lower() != 'true':
+        return JsonResponse(result)
+
+    response = StreamingHttpResponse(stream_content(request, _tail_stream(result, follow_file(file_path, result['size']))),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def download_file(request):
@@ -262,9 +606,7 @@ def download_file(request):
         if not os.path.exists(file_path):
             return JsonResponse({'error': 'File not found'}, status=404)
             
-        response = FileResponse(open(file_path, 'rb'))
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-        return response
+        return serve_file(request, file_path)
     except PermissionError:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     except Exception as e:
@@ -350,11 +692,35 @@ def file_info(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def disk_usage(request):
+    """Recursive directory sizes as a treemap; ?stream=true sends NDJSON progress first"""
+    path = request.GET.get('path', '/')
+    try:
+        depth = min(max(int(request.GET.get('depth') or 2), 0), 6)
+    except ValueError:
+        return JsonResponse({'error': 'depth must be an integer'}, status=400)
+    fresh = request.GET.get('fresh', 'false').lower() == 'true'
+    try:
+        if request.GET.get('stream', 'false').lower() == 'true':
+            if not os.path.isdir(os.path.expanduser(path)):
+                return JsonResponse({'error': 'Path is not a directory'}, status=400)
+            response = StreamingHttpResponse(stream_content(request, _ndjson(stream_disk_usage(path, depth, fresh))),
+                                             content_type='application/x-ndjson')
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        result = get_disk_usage(path, depth, fresh)
+        if 'error' in result:
+            return JsonResponse(result, status=500)
+        return JsonResponse(result)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def download_item(request):
-    """Download a file or directory (as zip)"""
-    temp_dir = None
+    """Download a file or directory (as zip, tar.gz or tar.zst)"""
     try:
         path = request.GET.get('path')
         if not path:
@@ -364,35 +730,20 @@ def download_item(request):
             return JsonResponse({'error': 'Path not found'}, status=404)
             
         if os.path.isdir(path):
-            # Create zip archive for directory
-            result = create_zip_archive(path)
+            # The archive is generated while it is sent: no temp file, constant time to first byte
+            result = archive_directory(path, request.GET.get('format', 'zip'))
             if 'error' in result:
-                return JsonResponse(result, status=500)
-                
-            # Get the temporary directory path from the zip path
-            temp_dir = os.path.dirname(result['zip_path'])
-            
-            try:
-                response = FileResponse(open(result['zip_path'], 'rb'))
-                response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
-                return response
-            finally:
-                # Clean up the temporary directory in a finally block
-                if temp_dir and os.path.exists(temp_dir):
-                    import shutil
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-        else:
-            # Single file download
-            response = FileResponse(open(path, 'rb'))
-            response['Content-Disposition'] = f'attachment; filename="{os.path.basename(path)}"'
+                return JsonResponse(result, status=400 if 'formats' in result else 500)
+            response = StreamingHttpResponse(stream_content(request, result['stream']),
+                                             content_type=result['content_type'])
+            response['Content-Disposition'] = f'attachment; filename="{result["filename"]}"'
             return response
+        else:
+            # Single file download; Range requests let it resume or seek
+            return serve_file(request, path)
     except PermissionError:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     except Exception as e:
-        # Clean up temp dir if it exists
-        if temp_dir and os.path.exists(temp_dir):
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
         return JsonResponse({'error': str(e)}, status=500)
 
 @csrf_exempt
@@ -407,10 +758,10 @@ def upload_file(request):
         use_sudo = request.POST.get('use_sudo', 'false').lower() == 'true'
         
         uploaded_file = request.FILES['file']
-        file_data = uploaded_file.read()
         
+        # Large uploads are spooled to disk by Django; copy them over chunk by chunk
         result = handle_file_upload(
-            file_data,
+            uploaded_file.chunks(),
             target_path,
             uploaded_file.name,
             use_sudo
@@ -422,6 +773,171 @@ def upload_file(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _upload_response(result, status=200):
+    if 'error' in result:
+        return JsonResponse(result, status=result.pop('http_status', 500))
+    return JsonResponse(result, status=status)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_sessions(request):
+    """Start a resumable upload: {path, filename, size, sha256?, use_sudo?}"""
+    try:
+        data = json.loads(request.body)
+        if not data.get('filename') or 'size' not in data:
+            return JsonResponse({'error': 'filename and size are required'}, status=400)
+        try:
+            size = int(data['size'])
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'size must be an integer'}, status=400)
+        result = create_upload(data.get('path', '/'), data['filename'], size,
+                               data.get('sha256'), bool(data.get('use_sudo', False)))
+        return _upload_response(result, status=201)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT", "DELETE"])
+def upload_session(request, upload_id):
+    """GET: progress and missing ranges; PUT ?offset=N: raw chunk body; DELETE: abort"""
+    try:
+        if request.method == 'GET':
+            return _upload_response(get_upload_status(upload_id))
+        if request.method == 'DELETE':
+            return _upload_response(abort_upload(upload_id))
+        try:
+            offset = int(request.GET.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or '')
+        except ValueError:
+            return JsonResponse({'error': 'offset and a Content-Length header are required'}, status=400)
+        # The body is read from the socket in blocks, never loaded as a whole
+        return _upload_response(write_upload_chunk(upload_id, offset, request, length))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_finalize(request, upload_id):
+    """Verify the sha256 (from here or the session) and move the file into place"""
+    try:
+        data = json.loads(request.body) if request.body else {}
+        return _upload_response(finalize_upload(upload_id, data.get('sha256')))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def chunk_manifest(request):
+    """Chunk digests of a file; fetch the ones you lack from /api/download-file/ with Range"""
+    try:
+        path = request.GET.get('path')
+        if not path:
+            return JsonResponse({'error': 'path is required'}, status=400)
+        return _upload_response(get_chunk_manifest(path))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def dedup_uploads(request):
+    """Start a deduplicated upload: {path, filename, size, sha256, chunks: [[digest, length], ...]}"""
+    try:
+        data = json.loads(request.body)
+        if not data.get('filename') or 'size' not in data or not isinstance(data.get('chunks'), list):
+            return JsonResponse({'error': 'filename, size, sha256 and chunks are required'}, status=400)
+        try:
+            size = int(data['size'])
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'size must be an integer'}, status=400)
+        result = create_dedup_upload(data.get('path', '/'), data['filename'], size,
+                                     data.get('sha256'), data['chunks'])
+        return _upload_response(result, status=201)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET", "DELETE"])
+def dedup_upload(request, upload_id):
+    """GET: digests still missing; DELETE: abort"""
+    try:
+        if request.method == 'DELETE':
+            return _upload_response(abort_dedup_upload(upload_id))
+        return _upload_response(get_dedup_upload_status(upload_id))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["PUT"])
+def dedup_chunk(request, upload_id, digest):
+    """Store one chunk sent as the raw body; it must hash to digest"""
+    try:
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or '')
+        except ValueError:
+            return JsonResponse({'error': 'A Content-Length header is required'}, status=400)
+        return _upload_response(put_dedup_chunk(upload_id, digest, request, length))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def dedup_commit(request, upload_id):
+    """Assemble, verify and move the uploaded file into place"""
+    try:
+        return _upload_response(commit_dedup_upload(upload_id))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def sync_manifest(request):
+    """(path, size, mtime, sha256) of every file under a directory"""
+    try:
+        path = request.GET.get('path')
+        if not path:
+            return JsonResponse({'error': 'path is required'}, status=400)
+        return _upload_response(get_sync_manifest(path))
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def sync_diff(request):
+    """Diff the client's manifest {path, entries, delete?} against the host and return a plan"""
+    try:
+        # Read from the stream: manifests of big trees exceed DATA_UPLOAD_MAX_MEMORY_SIZE
+        data = json.load(request)
+        if not data.get('path') or not isinstance(data.get('entries'), list):
+            return JsonResponse({'error': 'path and entries are required'}, status=400)
+        return _upload_response(diff_sync(data['path'], data['entries'], bool(data.get('delete', True))))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def sync_apply(request):
+    """Apply a plan in one request: multipart with a `plan` part and one `file:<path>` part per upload"""
+    try:
+        plan_part = request.FILES.get('plan')
+        plan = json.load(plan_part) if plan_part else json.loads(request.POST.get('plan', ''))
+        if not plan.get('path'):
+            return JsonResponse({'error': 'plan.path is required'}, status=400)
+        files = {name[len('file:'):]: uploaded.chunks() for name, uploaded in request.FILES.items()
+                 if name.startswith('file:')}
+        return _upload_response(apply_sync(plan['path'], plan, files))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'plan must be JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def extract_zip_file(request):
@@ -529,7 +1045,7 @@ def kill_process(request):
         if not pid:
             return JsonResponse({'error': 'pid is required'}, status=400)
             
-        result = kill_process(pid, use_sudo)
+        result = kill_proc(int(pid), use_sudo)
         if result['status'] == 'error':
             return JsonResponse(result, status=500)
         return JsonResponse(result)